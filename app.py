@@ -1,31 +1,35 @@
 import os
-import sys
-import io
 import json
-import traceback
-import signal
-import threading
-import tempfile
-import psutil
+import math
 import time
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import hashlib
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, abort, g
 from flask_cors import CORS
-import contextlib
-import base64
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-from pygments import highlight
-from pygments.lexers import PythonLexer
-from pygments.formatters import HtmlFormatter
+from werkzeug.utils import safe_join
+from werkzeug.http import parse_content_range_header
 import logging
 from dotenv import load_dotenv
-import platform
-
-# Try to import resource module (Unix-only)
-is_windows = platform.system() == 'Windows'
-if not is_windows:
-    import resource
+from execution import OutputCapture, execute, install_routing, USER_FILE
+from figures import FigureStore, FIGURE_FORMATS
+from profiler import Profiler, PROFILE_MODES
+from pytest_runner import TestRunner, run_pytest
+from worker_pool import WorkerPool, collect_events
+from output_log import RunOutput, OutputLogStore, LOG_NAME
+from sessions import SessionManager, SessionError, SessionBusyError, SessionLimitError
+from limits import RunLimits
+from result_cache import ResultCache, MemoryBackend, DiskBackend, find_nondeterminism
+from jobs import JobQueue, QueueFullError, FINISHED
+from file_index import FileIndex
+from compile_cache import CompileCache
+from shared_data import DatasetStore
+from file_store import FileHistory, RangeMismatchError, atomic_write, write_range, apply_line_patch, file_hash
+from compression import StaticAssets, available_encodings, negotiate, compress_response
+from metrics import (REGISTRY, CONTENT_TYPE, Gauge, REQUEST_SECONDS, REQUESTS, RUN_WALL_SECONDS, RUNS,
+                     FIGURE_ENCODE_SECONDS)
+from linting import LintService, FormatService, BoundedMemo, code_hash, MAX_REMEMBERED_RESULTS
 
 # Load environment variables
 load_dotenv()
@@ -39,108 +43,441 @@ app = Flask(__name__, static_folder='static')
 CORS(app)
 
 # Environment configuration
+PORT = int(os.environ.get('PORT', 5000))
 MAX_EXECUTION_TIME = int(os.environ.get('MAX_EXECUTION_TIME', 30))  # seconds
 MAX_MEMORY_MB = int(os.environ.get('MAX_MEMORY_MB', 500))  # MB
+MAX_CPU_TIME = int(os.environ.get('MAX_CPU_TIME', MAX_EXECUTION_TIME))  # CPU seconds
+MAX_PROCESSES = int(os.environ.get('MAX_PROCESSES', 16))  # processes a run may start
+RUN_CGROUP = os.environ.get('RUN_CGROUP', '')  # writable cgroup v2 directory for per-worker limits
+# Modules imported once by each worker so that runs fork with them already loaded
+PRELOAD_MODULES = [m.strip() for m in os.environ.get('PRELOAD_MODULES', 'numpy,pandas,matplotlib.pyplot,pytest').split(',') if m.strip()]
+WORKER_POOL_SIZE = int(os.environ.get('WORKER_POOL_SIZE', os.cpu_count() or 1))  # 0 runs code in-process
+WORKER_MAX_RUNS = int(os.environ.get('WORKER_MAX_RUNS', 100))  # runs before a worker is recycled
+RESULT_CACHE = os.environ.get('RESULT_CACHE', '').lower()  # '' (off), 'memory' or 'disk'
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 3600))  # seconds
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', 64))  # MB
+COMPILE_CACHE = os.environ.get('COMPILE_CACHE', 'memory').lower()  # '' (off), 'memory' or 'disk'
+COMPILE_CACHE_MAX_MB = int(os.environ.get('COMPILE_CACHE_MAX_MB', 64))  # MB per worker, and on disk
+DATASET_DIR = os.environ.get('DATASET_DIR', 'datasets')  # CSV and .npy files shared with runs, see shared_data.py
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', max(WORKER_POOL_SIZE, 1)))  # jobs run at the same time
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 100))  # queued jobs before /api/jobs answers 429
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 600))  # seconds finished jobs are kept
+SESSION_MAX = int(os.environ.get('SESSION_MAX', 4))  # sessions kept at once
+SESSION_IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT', 900))  # seconds before an idle session is closed
+SESSION_MEMORY_MB = int(os.environ.get('SESSION_MEMORY_MB', 2048))  # MB all sessions together may keep resident
+FIGURE_FORMAT = os.environ.get('FIGURE_FORMAT', 'png').lower()  # 'png', 'svg' or 'webp'
+FIGURE_DPI = int(os.environ.get('FIGURE_DPI', 100))
+FIGURE_PNG_COMPRESSION = int(os.environ.get('FIGURE_PNG_COMPRESSION', 6))  # zlib level 0-9
+FIGURE_WEBP_QUALITY = int(os.environ.get('FIGURE_WEBP_QUALITY', 80))  # 100 is lossless
+MAX_FIGURES = int(os.environ.get('MAX_FIGURES', 20))  # figures kept per run
+FIGURE_STORE_MAX_MB = int(os.environ.get('FIGURE_STORE_MAX_MB', 256))  # MB
+MAX_OUTPUT_BYTES = int(os.environ.get('MAX_OUTPUT_BYTES', 1024 * 1024))  # stdout/stderr kept per run, each
+OUTPUT_LOG_MAX_MB = int(os.environ.get('OUTPUT_LOG_MAX_MB', 64))  # MB of cut output saved per stream, 0 saves none
+OUTPUT_LOG_STORE_MAX_MB = int(os.environ.get('OUTPUT_LOG_STORE_MAX_MB', 512))  # MB
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', 1000))  # runs per /api/run/batch request
+MAX_BATCH_TIME = int(os.environ.get('MAX_BATCH_TIME', 600))  # seconds a whole batch may take
+FILE_HISTORY_VERSIONS = int(os.environ.get('FILE_HISTORY_VERSIONS', 50))  # versions kept per saved file, 0 keeps none
+MAX_FILE_MB = int(os.environ.get('MAX_FILE_MB', 64))  # MB a file uploaded to /api/files may have
+# Encodings responses are compressed with, preferred first; empty turns compression off
+COMPRESSION = available_encodings([e.strip() for e in os.environ.get('COMPRESSION', 'br,gzip').split(',') if e.strip()])
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))  # smaller responses are sent as they are
+METRICS = os.environ.get('METRICS', '1') == '1'  # time requests and serve /metrics
+PREWARM = os.environ.get('PREWARM', '1') == '1'  # warm workers, pylint and Black once the server is serving
 
 # Ensure directories exist
 os.makedirs('user_code', exist_ok=True)
 os.makedirs('output', exist_ok=True)
 
-class TimeoutError(Exception):
-    pass
+# Figures of all runs, stored by content hash and served from /api/figures
+figure_store = FigureStore(os.path.join('output', 'figures'), fmt=FIGURE_FORMAT, dpi=FIGURE_DPI,
+                           png_compression=FIGURE_PNG_COMPRESSION, webp_quality=FIGURE_WEBP_QUALITY,
+                           max_per_run=MAX_FIGURES, max_bytes=FIGURE_STORE_MAX_MB * 1024 * 1024)
 
-def timeout_handler(signum, frame):
-    raise TimeoutError("Code execution timed out")
+# Full output of runs that printed more than MAX_OUTPUT_BYTES, served from /api/logs
+output_logs = None
+if OUTPUT_LOG_MAX_MB > 0:
+    output_logs = OutputLogStore(os.path.join('output', 'logs'), OUTPUT_LOG_MAX_MB * 1024 * 1024,
+                                 OUTPUT_LOG_STORE_MAX_MB * 1024 * 1024)
 
-class MemoryLimitError(Exception):
-    pass
+# Earlier versions of the files saved to user_code, served from /api/history
+file_history = None
+if FILE_HISTORY_VERSIONS > 0:
+    file_history = FileHistory('user_code', os.path.join('output', 'history'), FILE_HISTORY_VERSIONS)
 
-def limit_memory_usage():
-    """Limit memory usage for the current process."""
-    if not is_windows:
-        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
-        resource.setrlimit(resource.RLIMIT_AS, (MAX_MEMORY_MB * 1024 * 1024, hard))
-    # On Windows, we'll use psutil for monitoring instead
+# Warm linter and formatter shared by all /api/lint and /api/format requests
+lint_service = LintService()
+format_service = FormatService()
+# Recently linted or formatted sources, so clients can send just a hash
+recent_sources = BoundedMemo(MAX_REMEMBERED_RESULTS)
 
-class OutputCapture:
-    def __init__(self):
-        self.stdout = io.StringIO()
-        self.stderr = io.StringIO()
-        self.figures = []
-        
-    @contextlib.contextmanager
-    def capture(self):
-        old_stdout, old_stderr = sys.stdout, sys.stderr
-        sys.stdout, sys.stderr = self.stdout, self.stderr
-        
-        # Capture matplotlib figures
-        old_show = plt.show
-        def custom_show(*args, **kwargs):
-            fig = plt.gcf()
-            buf = io.BytesIO()
-            fig.savefig(buf, format='png')
-            buf.seek(0)
-            img_data = base64.b64encode(buf.read()).decode('utf-8')
-            self.figures.append(img_data)
-            plt.close(fig)
-        
-        plt.show = custom_show
-        
-        try:
-            yield self
-        finally:
-            sys.stdout, sys.stderr = old_stdout, old_stderr
-            plt.show = old_show
+# Cache of run results for byte-identical, deterministic code
+result_cache = None
+if RESULT_CACHE in ('memory', 'disk'):
+    max_bytes = RESULT_CACHE_MAX_MB * 1024 * 1024
+    if RESULT_CACHE == 'disk':
+        backend = DiskBackend(os.path.join('output', 'cache'), max_bytes, RESULT_CACHE_TTL)
+    else:
+        backend = MemoryBackend(max_bytes, RESULT_CACHE_TTL)
+    result_cache = ResultCache(backend, limits=(MAX_EXECUTION_TIME, MAX_MEMORY_MB, MAX_CPU_TIME, MAX_PROCESSES,
+                                                FIGURE_FORMAT, FIGURE_DPI, MAX_FIGURES))
 
-def run_code(code, timeout=MAX_EXECUTION_TIME):
-    """Run Python code with timeout and resource limits."""
-    output = OutputCapture()
-    
-    def execute():
+# Code objects of code run before, kept by each worker (and on disk)
+compile_cache = None
+if COMPILE_CACHE in ('memory', 'disk'):
+    compile_cache = CompileCache(COMPILE_CACHE_MAX_MB * 1024 * 1024,
+                                 os.path.join('output', 'compiled') if COMPILE_CACHE == 'disk' else None,
+                                 max_disk_bytes=COMPILE_CACHE_MAX_MB * 1024 * 1024)
+
+# Runs submitted through /api/jobs
+job_queue = JobQueue(JOB_WORKERS, JOB_QUEUE_SIZE, retention=JOB_RETENTION)
+
+# Enforced by the kernel on every run forked by the worker pool
+run_limits = RunLimits(cpu_seconds=MAX_CPU_TIME, memory_mb=MAX_MEMORY_MB,
+                       max_processes=MAX_PROCESSES, cgroup_root=RUN_CGROUP or None)
+
+# Read from the queue when /metrics is scraped
+Gauge('jobs', 'Background jobs by state', ['state'],
+      collect=lambda: {(state,): job_queue.stats()[state] for state in ('queued', 'running')})
+Gauge('result_cache_bytes', 'Size of the result cache',
+      collect=lambda: {(): result_cache.backend.size_bytes} if result_cache is not None else {})
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """Return the shared worker pool, starting it on first use."""
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = WorkerPool(size=WORKER_POOL_SIZE, max_runs=WORKER_MAX_RUNS,
+                                      preload=PRELOAD_MODULES, figure_store=figure_store,
+                                      limits=run_limits, compile_cache=compile_cache,
+                                      datasets=get_dataset_store())
+            atexit.register(_worker_pool.shutdown)
+            logger.info(f"Started {_worker_pool.size} execution workers")
+        return _worker_pool
+
+_session_manager = None
+
+def get_session_manager():
+    """Return the shared session manager, starting it on first use."""
+    global _session_manager
+    with _worker_pool_lock:
+        if _session_manager is None:
+            _session_manager = SessionManager(preload=PRELOAD_MODULES, figure_store=figure_store,
+                                              limits=run_limits, max_sessions=SESSION_MAX,
+                                              idle_timeout=SESSION_IDLE_TIMEOUT,
+                                              memory_budget_mb=SESSION_MEMORY_MB,
+                                              datasets=get_dataset_store())
+            atexit.register(_session_manager.shutdown)
+        return _session_manager
+
+_dataset_store = None
+_dataset_store_lock = threading.Lock()
+
+def get_dataset_store():
+    """Return the shared dataset store, converting the files in DATASET_DIR on first use."""
+    global _dataset_store
+    with _dataset_store_lock:
+        if _dataset_store is None:
+            store = DatasetStore(DATASET_DIR, os.path.join('output', 'datasets'))
+            store.sync()
+            if WORKER_POOL_SIZE == 0:
+                store.map()  # In-process runs read them through this process's mappings
+            _dataset_store = store
+        return _dataset_store
+
+_file_index = None
+_file_index_lock = threading.Lock()
+
+def get_file_index():
+    """Return the index of the scripts in user_code, scanning it on first use."""
+    global _file_index
+    with _file_index_lock:
+        if _file_index is None:
+            _file_index = FileIndex('user_code')
+            atexit.register(_file_index.close)
+        return _file_index
+
+# Components warmed by prewarm(), with the seconds each took
+warmed = {}
+_prewarm_thread = None
+_prewarm_lock = threading.Lock()
+
+def prewarm():
+    """Start warming the worker pool, pylint, Black and the file index in the background (once).
+
+    Heavy imports are kept out of app startup, so the server answers
+    quickly; this moves their cost from the first request of each kind to
+    a background thread.
+    """
+    global _prewarm_thread
+    with _prewarm_lock:
+        if _prewarm_thread is None:
+            _prewarm_thread = threading.Thread(target=_prewarm, name='prewarm', daemon=True)
+            _prewarm_thread.start()
+
+def _warm_workers():
+    """Start the pool and wait until every worker has preloaded and run once."""
+    pool = get_worker_pool()
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        list(executor.map(lambda _: pool.run('', MAX_EXECUTION_TIME), range(pool.size)))
+
+def _prewarm():
+    if WORKER_POOL_SIZE > 0:
+        steps = [('workers', _warm_workers), ('lint', lint_service.warm)]
+    else:
+        # Not pylint: astroid briefly swaps sys.stdout while it loads modules,
+        # which would swallow the output of in-process runs started meanwhile
+        steps = [('execution', install_routing), ('datasets', get_dataset_store)]
+    steps += [('format', format_service.warm), ('files', get_file_index)]
+    for name, warm in steps:
+        start = time.perf_counter()
         try:
-            with output.capture():
-                # Create a local namespace for execution
-                local_vars = {}
-                
-                # Execute the code
-                exec(code, local_vars)
+            warm()
         except Exception as e:
-            traceback.print_exc(file=output.stderr)
-    
-    # Create a thread for execution
-    thread = threading.Thread(target=execute)
-    
-    # Set timeout handler if not on Windows
-    if not is_windows:
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(timeout)
-    
+            logger.warning(f"Could not prewarm {name}: {str(e)}")
+            continue
+        warmed[name] = round(time.perf_counter() - start, 3)
+    logger.info(f"Prewarmed {', '.join(f'{name} ({seconds}s)' for name, seconds in warmed.items())}")
+
+def shutdown(timeout=MAX_EXECUTION_TIME):
+    """Let running jobs finish (up to ``timeout`` seconds), then stop sessions and workers."""
+    if not job_queue.shutdown(timeout):
+        logger.warning(f"Stopping with background jobs still running after {timeout} seconds")
+    if _session_manager is not None:
+        _session_manager.shutdown()
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+    if _file_index is not None:
+        _file_index.close()
+
+def new_run_output():
+    """Return the bounded stdout and stderr for a run."""
+    if output_logs is not None:
+        output_logs.prune()
+    return RunOutput(MAX_OUTPUT_BYTES, output_logs)
+
+def run_code(code, timeout=MAX_EXECUTION_TIME, cancel=None, profile=None, stdin=None):
+    """Run Python code with timeout and resource limits.
+
+    Setting the ``cancel`` event stops the run. Both need the worker pool:
+    in-process runs (WORKER_POOL_SIZE=0) cannot be stopped, so a timed-out
+    run is reported but keeps running in the background, and no CPU or
+    memory limits apply. With ``profile`` (one of PROFILE_MODES) the result
+    also carries a ``profile`` report. ``stdin`` is the text the code reads
+    as standard input.
+
+    Of stdout and stderr only the first and last MAX_OUTPUT_BYTES / 2 are
+    kept; the result's ``truncated`` part says how much was dropped and
+    where the full log can be downloaded.
+    """
+    figure_store.prune()
+    if WORKER_POOL_SIZE > 0:
+        events = get_worker_pool().stream(code, timeout, cancel, profile, stdin)
+        return collect_events(new_run_output().limit(events))
+
+    get_dataset_store()  # Converted before the first run, if prewarming has not done it
+    run_output = new_run_output()
+    output = OutputCapture(figure_store=figure_store, run_output=run_output, stdin=stdin)
+    profiler = Profiler(profile) if profile else None
+    start = time.perf_counter()
+    compiled = None
+    if compile_cache is not None:
+        compiled, lookup = compile_cache.get(code, USER_FILE)
+        compile_cache.observe(lookup)
+    thread = threading.Thread(target=execute, args=(code, output), kwargs={'profiler': profiler, 'compiled': compiled},
+                              daemon=True)
     thread.start()
+    thread.join(timeout)
+    RUN_WALL_SECONDS.observe(time.perf_counter() - start)
     
-    try:
-        # Wait for thread to complete
-        thread.join(timeout)
-        
-        # Check if thread is still alive (timeout occurred)
-        if thread.is_alive():
-            raise TimeoutError("Code execution timed out")
-        
-        # Cancel the alarm if not on Windows
-        if not is_windows:
-            signal.alarm(0)
-    except TimeoutError:
-        output.stderr.write("ERROR: Code execution timed out after {} seconds\n".format(timeout))
-    except MemoryLimitError:
-        output.stderr.write("ERROR: Memory limit exceeded ({}MB)\n".format(MAX_MEMORY_MB))
-    except Exception as e:
-        output.stderr.write(f"ERROR: {str(e)}\n")
+    result = output.result()
+    if thread.is_alive():
+        result['stderr'] += "ERROR: Code execution timed out after {} seconds\n".format(timeout)
+        result['error'] = 'timeout'
+    else:
+        run_output.close()
+        if profiler is not None:
+            result['profile'] = profiler.report(figure_store, code)
+    for fmt, seconds in list(output.figure_timings):
+        FIGURE_ENCODE_SECONDS.observe(seconds, fmt)
+    RUNS.inc(result.get('error', 'ok'))
+    return result
+
+def run_tests(code, spec, cancel=None):
+    """Run one pytest invocation for the test runner (see pytest_runner.TestRunner)."""
+    if WORKER_POOL_SIZE > 0:
+        events = get_worker_pool().stream(code, MAX_EXECUTION_TIME, cancel, pytest=spec)
+        return collect_events(new_run_output().limit(events))
+
+    # As in run_code(), a timed-out in-process run is reported but keeps running in the background
+    output = OutputCapture(figure_store=figure_store, run_output=new_run_output())
+    tests = []
+    thread = threading.Thread(target=lambda: tests.append(run_pytest(code, output, spec.get('node_ids'),
+                                                                     spec.get('collect', False))),
+                              daemon=True)
+    thread.start()
+    thread.join(MAX_EXECUTION_TIME)
+    result = output.result()
+    if thread.is_alive():
+        result['stderr'] += "ERROR: Code execution timed out after {} seconds\n".format(MAX_EXECUTION_TIME)
+        result['error'] = 'timeout'
+        return result
+    return dict(result, tests=tests[0])
+
+# Runs the tests of /api/test requests, one group of tests per worker
+test_runner = TestRunner(run_tests, parallel=max(WORKER_POOL_SIZE, 1))
+
+def result_events(result):
+    """Turn a run result back into the (kind, data) events that produced it."""
+    events = [('stdout', result['stdout']), ('stderr', result['stderr'])]
+    events += [('figure', figure) for figure in result['figures']]
+    events.append(('profile', result.get('profile')))
+    events.append(('truncated', result.get('truncated')))
+    events.append(('exception', result.get('exception')))
+    return [(kind, data) for kind, data in events if data]
+
+def run_code_stream(code, timeout=MAX_EXECUTION_TIME, profile=None, stdin=None):
+    """Run Python code, yielding (kind, data) output events as they are produced."""
+    figure_store.prune()
+    if WORKER_POOL_SIZE > 0:
+        return new_run_output().limit(get_worker_pool().stream(code, timeout, profile=profile, stdin=stdin))
+
+    return iter(result_events(run_code(code, timeout, profile=profile, stdin=stdin)))
+
+def profile_mode(data):
+    """Return the profiler mode a run request asks for, or None.
+
+    ``"profile": true`` means cProfile. Raises ValueError for unknown modes.
+    """
+    profile = data.get('profile')
+    if not profile:
+        return None
+    if profile is True:
+        return 'cprofile'
+    if profile not in PROFILE_MODES:
+        raise ValueError(f"profile must be one of {', '.join(PROFILE_MODES)}")
+    return profile
+
+def request_stdin(data):
+    """Return the standard input a run request carries, or None; raises ValueError."""
+    stdin = data.get('stdin')
+    if stdin is not None and not isinstance(stdin, str):
+        raise ValueError('stdin must be a string')
+    return stdin
+
+def request_seconds(data, name, default, maximum):
+    """Return a time limit of a request in seconds, at most maximum; raises ValueError."""
+    seconds = float(data.get(name, default))
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError(f'{name} must be a positive number of seconds')
+    return min(seconds, maximum)
+
+def cache_key_for(code, data):
+    """Return the result cache key for a run request, or None to bypass the cache."""
+    if result_cache is None:
+        return None
+    # Profiles are timings, which a cached result would not have
+    if not data.get('cache', True) or data.get('profile') or find_nondeterminism(code):
+        result_cache.skip()
+        return None
+    return result_cache.key(code, data.get('stdin'))
+
+def cached_result(cache_key):
+    """Return a cached run result, unless its figures have since been pruned."""
+    cached = result_cache.get(cache_key)
+    if cached is not None and all(figure_store.exists(figure['id']) for figure in cached['figures']):
+        return cached
+    return None
+
+def run_cached(code, data, cancel=None, timeout=MAX_EXECUTION_TIME):
+    """Run code, answering from the result cache when possible."""
+    cache_key = cache_key_for(code, data)
+    if cache_key:
+        cached = cached_result(cache_key)
+        if cached is not None:
+            return dict(cached, cached=True)
     
-    # Return captured output
-    return {
-        'stdout': output.stdout.getvalue(),
-        'stderr': output.stderr.getvalue(),
-        'figures': output.figures
-    }
+    result = run_code(code, timeout, cancel, profile_mode(data), request_stdin(data))
+    # Cut output would refer to a log that is eventually pruned
+    if cache_key and 'error' not in result and 'truncated' not in result:
+        result_cache.put(cache_key, result)
+    return result
+
+if PREWARM:
+    @app.before_request
+    def start_prewarm():
+        # The first request (typically a health check) shows the server is listening
+        if _prewarm_thread is None:
+            prewarm()
+
+if METRICS:
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        """Count the request and time it once the last byte is sent (streams included)."""
+        # The route pattern rather than the path, so IDs do not become labels
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method, status, start = request.method, str(response.status_code), g.request_start
+        def observe():
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route, method)
+            REQUESTS.inc(route, method, status)
+        response.call_on_close(observe)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Serve the server's metrics in the Prometheus text format."""
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.after_request
+def compress(response):
+    """Compress JSON, text and streamed responses for clients that accept gzip or brotli."""
+    return compress_response(response, negotiate(request.accept_encodings, COMPRESSION), COMPRESS_MIN_BYTES)
+
+# Static files, served with their content hash in the URL and compressed once
+static_assets = StaticAssets(app.static_folder, COMPRESS_MIN_BYTES)
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """Add the content hash of static files to their URLs, so that browsers can cache them for good."""
+    if endpoint == 'static' and 'filename' in values:
+        version = static_assets.version(values['filename'])
+        if version is not None:
+            values['v'] = version
+
+def serve_static(filename):
+    """Serve a static file, precompressed; immutable when requested under its current hash."""
+    asset = static_assets.get(filename, negotiate(request.accept_encodings, COMPRESSION))
+    if asset is None:
+        abort(404)
+    response = Response(asset.data, mimetype=asset.mimetype)
+    if asset.encoding is not None:
+        response.headers['Content-Encoding'] = asset.encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(asset.etag)
+    response.last_modified = asset.mtime
+    if request.args.get('v') == asset.version:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # Old or missing hash: the page is out of date or the URL was typed, so revalidate
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+app.view_functions['static'] = serve_static
+
+@app.route('/healthz')
+def healthz():
+    """Report that the server is up, and how far prewarming has got."""
+    if not PREWARM:
+        state = 'off'
+    else:
+        state = 'done' if _prewarm_thread is not None and not _prewarm_thread.is_alive() else 'running'
+    return jsonify({'status': 'ok', 'prewarm': state, 'warmed': dict(warmed)})
 
 @app.route('/')
 def index():
@@ -149,57 +486,23 @@ def index():
 
 @app.route('/api/run', methods=['POST'])
 def execute_code():
-    """API endpoint to execute Python code."""
+    """API endpoint to execute Python code.
+
+    Send ``"profile": "cprofile"`` or ``"sampling"`` to also get a profile
+    report of the run, and ``"stdin"`` to give the code input to read. If
+    the code raises, ``exception`` gives the error's type, message, line
+    and frames (see execution.exception_record).
+    """
     data = request.json
     code = data.get('code', '')
-    
-    # Create a file for the code
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, dir='user_code') as f:
-        f.write(code)
-        temp_file = f.name
-    
     try:
-        # Monitor memory usage in a separate thread
-        def monitor_memory():
-            process = psutil.Process(os.getpid())
-            while True:
-                mem_usage = process.memory_info().rss / (1024 * 1024)  # MB
-                if mem_usage > MAX_MEMORY_MB:
-                    # On Windows, we can't send SIGTERM, so we'll just log and break
-                    if is_windows:
-                        logger.error("Memory limit exceeded")
-                        break
-                    else:
-                        os.kill(os.getpid(), signal.SIGTERM)
-                        break
-                time.sleep(0.1)
-        
-        memory_monitor = threading.Thread(target=monitor_memory)
-        memory_monitor.daemon = True
-        memory_monitor.start()
-        
-        # Run the code
-        result = run_code(code)
-        
-        # Format error messages with line numbers
-        if result['stderr']:
-            error_lines = result['stderr'].split('\n')
-            formatted_errors = []
-            for line in error_lines:
-                if 'line' in line and temp_file in line:
-                    # Extract line number from error message
-                    try:
-                        line_num = int(line.split('line')[1].split(',')[0].strip())
-                        # Adjust line number for actual code
-                        formatted_errors.append(line.replace(temp_file, 'your code'))
-                    except:
-                        formatted_errors.append(line)
-                else:
-                    formatted_errors.append(line)
-            result['stderr'] = '\n'.join(formatted_errors)
-        
-        return jsonify(result)
+        profile_mode(data)
+        request_stdin(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    try:
+        return jsonify(run_cached(code, data))
     except Exception as e:
         logger.error(f"Error executing code: {str(e)}")
         return jsonify({
@@ -207,112 +510,557 @@ def execute_code():
             'stderr': f"Server error: {str(e)}",
             'figures': []
         }), 500
-    finally:
-        # Clean up temporary file
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+
+@app.route('/api/run/stream', methods=['POST'])
+def execute_code_stream():
+    """API endpoint to execute Python code, streaming output as Server-Sent Events."""
+    data = request.json
+    code = data.get('code', '')
+    try:
+        profile = profile_mode(data)
+        stdin = request_stdin(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    cache_key = cache_key_for(code, data)
+    cached = cached_result(cache_key) if cache_key else None
+    events = result_events(cached) if cached is not None else run_code_stream(code, profile=profile, stdin=stdin)
+
+    def generate():
+        # Collect the output only if it is going into the cache
+        collected = {'stdout': [], 'stderr': [], 'figures': []} if cache_key and cached is None else None
+        failed = False
+        try:
+            for kind, payload in events:
+                if kind == 'error':
+                    failed = True
+                    kind, payload = 'stderr', payload['text']
+                elif kind == 'truncated':
+                    collected = None  # Do not cache output that was cut
+                if collected is not None:
+                    if kind == 'exception':
+                        collected['exception'] = payload
+                    else:
+                        collected['figures' if kind == 'figure' else kind].append(payload)
+                # Text events carry {"text": ...}, the others their record
+                body = {'text': payload} if kind in ('stdout', 'stderr') else payload
+                yield f"event: {kind}\ndata: {json.dumps(body)}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming code output: {str(e)}")
+            failed = True
+            yield f"event: stderr\ndata: {json.dumps({'text': f'Server error: {str(e)}'})}\n\n"
+        if collected is not None and not failed:
+            result = {'stdout': ''.join(collected['stdout']),
+                      'stderr': ''.join(collected['stderr']),
+                      'figures': collected['figures']}
+            if 'exception' in collected:
+                result['exception'] = collected['exception']
+            result_cache.put(cache_key, result)
+        yield f"event: done\ndata: {json.dumps({'cached': cached is not None})}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/run/batch', methods=['POST'])
+def execute_batch():
+    """Run many snippets in one request, streaming their results as they finish.
+
+    The body is ``{"items": [{"code": ..., "stdin": ..., "id": ...}, ...]}``
+    with optional ``timeout`` (seconds per item, at most MAX_EXECUTION_TIME)
+    and ``total_timeout`` (seconds for the batch, at most MAX_BATCH_TIME).
+    Items accept the other /api/run options too. Items run in parallel on
+    the worker pool; each result is sent as one line of JSON (NDJSON) in
+    the /api/run format plus the item's ``index`` and ``id``, in order of
+    completion. Items still unfinished when the batch runs out of time are
+    cancelled. A last line with ``"done": true`` sums up the batch.
+    """
+    data = request.json
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} items per batch'}), 413
+    try:
+        timeout = request_seconds(data, 'timeout', MAX_EXECUTION_TIME, MAX_EXECUTION_TIME)
+        total_timeout = request_seconds(data, 'total_timeout', MAX_BATCH_TIME, MAX_BATCH_TIME)
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not isinstance(item.get('code'), str):
+                raise ValueError(f'item {index} must be an object with a code string')
+            profile_mode(item)
+            request_stdin(item)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    cancel = threading.Event()
+    def run_item(item):
+        if cancel.is_set():
+            return {'stdout': '', 'stderr': "ERROR: Batch time limit exceeded\n", 'figures': [], 'error': 'cancelled'}
+        return run_cached(item['code'], item, cancel, timeout)
+
+    parallel = get_worker_pool().size if WORKER_POOL_SIZE > 0 else 1
+    def generate():
+        start = time.monotonic()
+        deadline = start + total_timeout
+        executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='batch')
+        futures = {executor.submit(run_item, item): index for index, item in enumerate(items)}
+        pending, errors = set(futures), 0
+        try:
+            while pending:
+                remaining = None if cancel.is_set() else max(deadline - time.monotonic(), 0)
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    cancel.set()  # Out of time: stop running items, skip queued ones
+                for future in done:
+                    index = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Error running batch item {index}: {str(e)}")
+                        result = {'stdout': '', 'stderr': f"Server error: {str(e)}", 'figures': [], 'error': 'server'}
+                    errors += 'error' in result
+                    line = dict(result, index=index, id=items[index].get('id'))
+                    yield json.dumps(line) + '\n'
+            elapsed = time.monotonic() - start
+            yield json.dumps({
+                'done': True,
+                'items': len(items),
+                'errors': errors,
+                'cancelled': cancel.is_set(),
+                'elapsed_seconds': round(elapsed, 3),
+                'runs_per_second': round(len(items) / elapsed, 1) if elapsed else None
+            }) + '\n'
+        finally:
+            # Also reached when the client disconnects
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/test', methods=['POST'])
+def run_test_file():
+    """Run the pytest tests in the submitted code, spread over the workers.
+
+    Returns one result per test (``outcome``, ``duration``, ``traceback``)
+    and a summary. ``select`` may list test node IDs to run only those.
+    """
+    data = request.json
+    code = data.get('code', '')
+    select = data.get('select')
+    if select is not None and (not isinstance(select, list) or not all(isinstance(n, str) for n in select)):
+        return jsonify({'error': 'select must be a list of test node IDs'}), 400
+    
+    try:
+        return jsonify(test_runner.test(code, select))
+    except Exception as e:
+        logger.error(f"Error running tests: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue code to run in the background and return its job ID at once.
+
+    Higher ``priority`` values run first. Answers 429 with Retry-After
+    when the queue is full.
+    """
+    data = request.json
+    code = data.get('code', '')
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'priority must be an integer'}), 400
+    try:
+        profile_mode(data)
+        request_stdin(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        job = job_queue.submit(lambda cancel: run_cached(code, data, cancel), priority)
+    except QueueFullError as e:
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+    
+    body = dict(job.to_dict(), position=job_queue.position(job))
+    return jsonify(body), 202, {'Location': f'/api/jobs/{job.id}'}
+
+@app.route('/api/jobs', methods=['GET'])
+def job_queue_stats():
+    """Report the job queue depth."""
+    return jsonify(job_queue.stats())
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the status of a job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(dict(job.to_dict(), position=job_queue.position(job)))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Return a finished job's output in the /api/run format (202 while it runs)."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status not in FINISHED:
+        return jsonify(job.to_dict()), 202, {'Retry-After': '1'}
+    if job.result is None:
+        return jsonify(job.to_dict()), 410 if job.error is None else 500
+    return jsonify(dict(job.result, job_id=job.id, status=job.status))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status in FINISHED:
+        return jsonify(dict(job.to_dict(), error='Job already finished')), 409
+    return jsonify(job_queue.cancel(job_id).to_dict())
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """Start a session whose variables persist between cells."""
+    try:
+        session = get_session_manager().create()
+    except SessionLimitError as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '10'}
+    return jsonify(session.to_dict()), 201
+
+@app.route('/api/sessions', methods=['GET'])
+def list_sessions():
+    """List open sessions."""
+    return jsonify({'sessions': [session.to_dict() for session in get_session_manager().list()]})
+
+@app.route('/api/sessions/<session_id>/run', methods=['POST'])
+def run_cell(session_id):
+    """Run a cell against a session's variables; output as for /api/run."""
+    data = request.json
+    code = data.get('code', '')
+    
+    try:
+        events = get_session_manager().stream(session_id, code, MAX_EXECUTION_TIME)
+        result = collect_events(new_run_output().limit(events))
+    except KeyError:
+        return jsonify({'error': 'Unknown session'}), 404
+    except SessionBusyError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(result)
+
+@app.route('/api/sessions/<session_id>/reset', methods=['POST'])
+def reset_session(session_id):
+    """Forget a session's variables."""
+    try:
+        get_session_manager().reset(session_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown session'}), 404
+    except SessionBusyError as e:
+        return jsonify({'error': str(e)}), 409
+    except SessionError as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True})
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    """Close a session."""
+    try:
+        get_session_manager().close(session_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown session'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Report result cache hit/miss counts and size, and those of the compile cache under ``compile``."""
+    stats = dict(result_cache.stats(), enabled=True) if result_cache is not None else {'enabled': False}
+    stats['compile'] = dict(compile_cache.stats(), enabled=True) if compile_cache is not None else {'enabled': False}
+    return jsonify(stats)
+
+@app.route('/api/datasets', methods=['GET'])
+def list_datasets():
+    """List the shared datasets, converting files added to or changed in DATASET_DIR first.
+
+    Workers map the datasets when they start; one added later is opened by
+    each run that loads it (still sharing its pages) until the workers are
+    recycled.
+    """
+    return jsonify({'datasets': get_dataset_store().sync()})
+
+@app.route('/api/figures/<name>', methods=['GET'])
+def get_figure(name):
+    """Serve a stored figure; its name is its content hash, so it never changes."""
+    digest, _, fmt = name.partition('.')
+    if len(digest) != 64 or fmt not in FIGURE_FORMATS or not all(c in '0123456789abcdef' for c in digest):
+        abort(404)
+    response = send_from_directory(figure_store.directory, name, mimetype=FIGURE_FORMATS[fmt],
+                                   max_age=365 * 24 * 3600)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(digest)
+    # SVG can carry scripts; never run them
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@app.route('/api/logs/<name>', methods=['GET'])
+def get_output_log(name):
+    """Download the full output of a run whose output was cut; supports Range requests."""
+    if output_logs is None or not LOG_NAME.match(name):
+        abort(404)
+    response = send_from_directory(output_logs.directory, name, mimetype='text/plain; charset=utf-8',
+                                   conditional=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+def file_saved(filepath):
+    """List a file just written to user_code and record it in the history; return its SHA-256."""
+    # Listed at once, without waiting for the change notification
+    get_file_index().refresh(filepath)
+    return file_history.record(filepath) if file_history is not None else file_hash(filepath)
 
 @app.route('/api/save', methods=['POST'])
 def save_code():
-    """Save code to a file."""
+    """Save code to a file under user_code.
+
+    The body has the ``filename`` and either the ``code`` or, to send only
+    the lines that changed, a ``patch`` (see file_store.apply_line_patch)
+    against the version whose SHA-256 is ``base``. A patch for a file that
+    is no longer that version gets 409 with the file's current ``hash``.
+    The file is replaced atomically, and the response carries its new
+    ``hash``.
+    """
     data = request.json
-    code = data.get('code', '')
     filename = data.get('filename', '')
     
     if not filename:
         return jsonify({'success': False, 'error': 'Filename is required'}), 400
     
-    # Ensure the filename is safe
-    filename = os.path.basename(filename)
     if not filename.endswith('.py'):
         filename += '.py'
-    
-    filepath = os.path.join('user_code', filename)
+    # Ensure the filename is safe
+    filepath = safe_join('user_code', filename)
+    if filepath is None:
+        return jsonify({'success': False, 'error': 'Invalid filename'}), 400
     try:
-        with open(filepath, 'w') as f:
-            f.write(code)
-        return jsonify({'success': True, 'path': filepath})
+        if 'patch' in data:
+            try:
+                with open(filepath, 'rb') as f:
+                    current = f.read()
+            except FileNotFoundError:
+                current = None
+            current_hash = hashlib.sha256(current).hexdigest() if current is not None else None
+            if current_hash is None or current_hash != data.get('base'):
+                return jsonify({'success': False, 'error': 'The file has changed, send the whole code',
+                                'hash': current_hash}), 409
+            code = apply_line_patch(current.decode('utf-8'), data['patch'])
+        else:
+            code = data.get('code', '')
+        atomic_write(filepath, code.encode('utf-8'))
+        return jsonify({'success': True, 'path': filepath, 'hash': file_saved(filepath)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/files/<path:filename>', methods=['PUT'])
+def upload_file(filename):
+    """Write a script under user_code from the raw request body, streamed to disk.
+
+    With ``Content-Range: bytes start-end/total`` the body is one chunk of
+    a larger upload. Chunks must arrive in order; one that does not
+    continue the upload gets 409 with the ``offset`` to continue from, so
+    an interrupted upload can be resumed. Until the last chunk has arrived
+    the answer is 202 with the bytes ``received``, and the file is only
+    replaced (atomically) then.
+    """
+    filepath = safe_join('user_code', filename)
+    if filepath is None or not filename.endswith('.py'):
+        return jsonify({'success': False, 'error': 'Only .py files under user_code can be written'}), 400
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if 'Content-Range' in request.headers and (content_range is None or content_range.length is None):
+        return jsonify({'success': False, 'error': 'Content-Range must be bytes start-end/total'}), 400
+    start, total = (content_range.start, content_range.length) if content_range else (0, None)
+    try:
+        received = write_range(filepath, request.stream, start, total, MAX_FILE_MB * 1024 * 1024)
+    except RangeMismatchError as e:
+        return jsonify({'success': False, 'error': 'Chunk does not continue the upload', 'offset': e.args[0]}), 409
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 413
+    if total is not None and received < total:
+        return jsonify({'success': True, 'received': received}), 202
+    return jsonify({'success': True, 'path': filepath, 'size': received, 'hash': file_saved(filepath)})
+
+@app.route('/api/files/<path:filename>', methods=['GET'])
+def download_file(filename):
+    """Stream a file under user_code as it is; supports Range and conditional requests."""
+    filepath = safe_join('user_code', filename)
+    if filepath is None or not os.path.isfile(filepath):
+        abort(404)
+    response = send_from_directory(os.path.abspath('user_code'), filename, mimetype='text/plain; charset=utf-8',
+                                   conditional=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@app.route('/api/history/<path:filename>', methods=['GET'])
+def file_versions(filename):
+    """List the saved versions of a file, newest first; ``?version=<hash>`` returns the code of one."""
+    filepath = safe_join('user_code', filename)
+    if file_history is None or filepath is None:
+        return jsonify({'success': False, 'error': 'No history for this file'}), 404
+    digest = request.args.get('version')
+    if digest is None:
+        return jsonify({'success': True, 'versions': file_history.versions(filepath)})
+    data = file_history.read(filepath, digest)
+    if data is None:
+        return jsonify({'success': False, 'error': 'No such version'}), 404
+    response = jsonify({'success': True, 'code': data.decode('utf-8', 'replace'), 'hash': digest})
+    # A version never changes
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
 @app.route('/api/load', methods=['GET'])
 def list_files():
-    """List available Python files."""
-    files = [f for f in os.listdir('user_code') if f.endswith('.py')]
-    return jsonify({'files': files})
+    """List the Python files under user_code, subdirectories included.
 
-@app.route('/api/load/<filename>', methods=['GET'])
+    ``prefix`` limits the listing to paths starting with it (such as
+    ``examples/``); ``offset`` and ``limit`` select a page. Each entry has
+    the file's size, mtime and SHA-256. Answers 304 while the listing is
+    unchanged since the ETag the client sent.
+    """
+    index = get_file_index()
+    etag = index.etag()
+    # Weakly, as compressing the listing weakens its ETag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = int(request.args['limit']) if 'limit' in request.args else None
+            if offset < 0 or (limit is not None and limit < 0):
+                raise ValueError
+        except ValueError:
+            return jsonify({'error': 'offset and limit must be non-negative integers'}), 400
+        entries, total = index.list(request.args.get('prefix', ''), offset, limit)
+        response = jsonify({
+            'files': [entry['path'] for entry in entries],
+            'entries': entries,
+            'total': total,
+            'offset': offset
+        })
+    response.set_etag(etag)
+    # Cached by the browser, but checked with the server every time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/load/<path:filename>', methods=['GET'])
 def load_file(filename):
-    """Load code from a file."""
-    filepath = os.path.join('user_code', os.path.basename(filename))
-    if not os.path.exists(filepath):
+    """Load code from a file under user_code.
+
+    The response carries the file's SHA-256 (its ``hash`` in the listing)
+    as ETag and its mtime as Last-Modified, and is 304 while the file is
+    unchanged since either.
+    """
+    filepath = safe_join('user_code', filename)
+    if filepath is None or not os.path.isfile(filepath):
         return jsonify({'success': False, 'error': 'File not found'}), 404
     
     try:
-        with open(filepath, 'r') as f:
-            code = f.read()
-        return jsonify({'success': True, 'code': code})
+        with open(filepath, 'rb') as f:
+            data = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime
+        digest = hashlib.sha256(data).hexdigest()
+        response = jsonify({'success': True, 'code': data.decode('utf-8'), 'hash': digest})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+    response.set_etag(digest)
+    response.last_modified = mtime
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def request_source(data):
+    """Return the code a lint or format request is about, or None if unknown.
+
+    Requests carry either the ``code`` itself or the ``hash`` of code sent
+    earlier.
+    """
+    if 'code' not in data and data.get('hash'):
+        return recent_sources.get(data['hash'])
+    code = data.get('code', '')
+    recent_sources.put(code_hash(code), code)
+    return code
+
+def unknown_source(data):
+    return jsonify({
+        'error': 'Unknown code hash, send the code instead',
+        'hash': data.get('hash')
+    }), 404
 
 @app.route('/api/lint', methods=['POST'])
 def lint_code():
-    """Lint Python code."""
+    """Lint Python code.
+
+    With ``"mode": "fast"`` the pyflakes tier answers straight away while the
+    full pylint pass runs in the background; poll /api/lint/<hash> for it.
+    Instead of ``code`` the request may send the ``hash`` of a source the
+    server has seen recently.
+    """
     data = request.json
-    code = data.get('code', '')
-    
-    # Create a temporary file for the code
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-        f.write(code)
-        temp_file = f.name
+    code = request_source(data)
+    if code is None:
+        return unknown_source(data)
+    mode = data.get('mode', 'full')
     
     try:
-        # Run pylint on the file
-        from pylint import lint
-        from pylint.reporters.text import TextReporter
-        
-        class CustomReporter(TextReporter):
-            def __init__(self):
-                self.messages = []
-                super().__init__()
-            
-            def handle_message(self, msg):
-                self.messages.append({
-                    'line': msg.line,
-                    'column': msg.column,
-                    'type': msg.category,
-                    'message': msg.msg,
-                    'symbol': msg.symbol
-                })
-        
-        reporter = CustomReporter()
-        args = ['--errors-only', temp_file]
-        lint.Run(args, reporter=reporter, exit=False)
+        if mode == 'fast':
+            issues = lint_service.quick(code)
+            key = lint_service.submit(code)
+            return jsonify({
+                'issues': issues,
+                'tier': 'fast',
+                'hash': key,
+                'pending': not lint_service.result(key).done()
+            })
         
         return jsonify({
-            'issues': reporter.messages
+            'issues': lint_service.full(code),
+            'tier': 'full',
+            'hash': code_hash(code)
         })
     except Exception as e:
         return jsonify({
             'error': str(e)
         }), 500
-    finally:
-        # Clean up temporary file
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+
+@app.route('/api/lint/<code_hash>', methods=['GET'])
+def lint_result(code_hash):
+    """Return the full lint pass started by a fast /api/lint request."""
+    future = lint_service.result(code_hash)
+    if future is None:
+        return jsonify({'error': 'Unknown lint request'}), 404
+    if not future.done():
+        return jsonify({'pending': True, 'hash': code_hash})
+    
+    try:
+        return jsonify({'issues': future.result(), 'tier': 'full', 'hash': code_hash, 'pending': False})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/format', methods=['POST'])
 def format_code():
-    """Format Python code using Black."""
+    """Format Python code using Black (accepts a ``hash`` like /api/lint)."""
     data = request.json
-    code = data.get('code', '')
+    code = request_source(data)
+    if code is None:
+        return unknown_source(data)
     
     try:
-        import black
-        
-        formatted_code = black.format_str(code, mode=black.Mode())
+        formatted_code = format_service.format(code)
+        key = code_hash(formatted_code)
+        recent_sources.put(key, formatted_code)
         return jsonify({
-            'code': formatted_code
+            'code': formatted_code,
+            'hash': key
         })
     except Exception as e:
         return jsonify({
@@ -321,4 +1069,5 @@ def format_code():
         }), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
+    # Development server; see gunicorn.conf.py for production
+    app.run(host='0.0.0.0', port=PORT, debug=True)
@@ -0,0 +1,78 @@
+"""
+Batch throughput benchmark: /api/run/batch vs. one /api/run request per program
+-------------------------------------------------------------------------------
+For each worker pool size, starts the app (in a subprocess, with
+WORKER_POOL_SIZE set) and runs the same small programs, each reading a
+number from stdin and printing its square, two ways:
+
+  batch        one /api/run/batch request with all programs
+  per-request  one /api/run request per program, sent one after another
+
+and reports runs per second. Batch throughput should grow with the pool
+size up to the number of cores.
+
+Usage:
+    python benchmarks/batch_throughput.py [--items 200] [--workers 1,2,4]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROGRAM = "n = int(input())\nprint(n * n)\n"
+
+
+def measure(items):
+    """Run in the subprocess: time both ways and print the runs/s as JSON."""
+    from app import app
+    client = app.test_client()
+    batch = [{'code': PROGRAM, 'stdin': f'{i}\n', 'cache': False} for i in range(items)]
+    client.post('/api/run/batch', json={'items': batch[:8]})  # Start the workers
+
+    start = time.perf_counter()
+    lines = client.post('/api/run/batch', json={'items': batch}).get_data(as_text=True).splitlines()
+    batch_seconds = time.perf_counter() - start
+    results = [json.loads(line) for line in lines[:-1]]
+    wrong = sum(result['stdout'] != f"{result['index'] ** 2}\n" for result in results)
+
+    start = time.perf_counter()
+    for item in batch:
+        client.post('/api/run', json=item)
+    single_seconds = time.perf_counter() - start
+
+    print(json.dumps({'batch': items / batch_seconds, 'single': items / single_seconds, 'wrong': wrong}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=200, help='programs per batch')
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+                        help='comma-separated worker pool sizes')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.items)
+        return
+
+    print(f"programs: {args.items}  cores: {os.cpu_count()}")
+    print(f"{'workers':<10}{'batch runs/s':>14}{'per-request runs/s':>20}")
+    for size in args.workers.split(','):
+        env = dict(os.environ, WORKER_POOL_SIZE=size, RESULT_CACHE='')
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', '--items', str(args.items)],
+                              cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            sys.exit(1)
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        note = f"  ({result['wrong']} wrong results)" if result['wrong'] else ''
+        print(f"{size:<10}{result['batch']:>14.1f}{result['single']:>20.1f}{note}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compile cache benchmark: compiling generated scripts against reusing their code objects
+-------------------------------------------------------------------------------------
+For generated scripts of several sizes, times:
+
+  compile      compile() of the source, what every run did before
+  memory hit   CompileCache.get() answered from memory (hashing the source)
+  disk hit     CompileCache.get() answered from a marshal file by a fresh
+               cache, as after a worker restart
+
+and then the latency of /api/run-style runs of each script through a
+one-worker pool with the compile cache off and on (the first run on each
+pool compiles; the median of the others is reported).
+
+Usage:
+    python benchmarks/bench_compile_cache.py [--sizes 1000,10000,50000] [--runs 5]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compile_cache import CompileCache
+from execution import USER_FILE
+from worker_pool import WorkerPool
+
+
+def generated_script(lines):
+    """A script of about ``lines`` lines of small functions, like generated code."""
+    functions = [f'def f{i}(a, b):\n    values = [a * j + b for j in range({i % 7 + 2})]\n    return sum(values) + {i}\n'
+                 for i in range(lines // 3)]
+    return '\n'.join(functions) + '\nprint(f1(1, 2))\n'
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_latency(scripts, cache, runs):
+    """Return {lines: median seconds of the runs after the first} on a one-worker pool."""
+    # Preloaded like the app's workers, so runs do not import pyplot themselves
+    pool = WorkerPool(size=1, max_runs=10000, preload=['matplotlib.pyplot'], compile_cache=cache)
+    try:
+        latencies = {}
+        for lines, source in scripts.items():
+            pool.run(source, 120)  # Compiles (into the cache, if any)
+            latencies[lines] = timed(lambda: pool.run(source, 120), runs)
+        return latencies
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,50000', help='comma-separated script lengths in lines')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per script and pool')
+    args = parser.parse_args()
+
+    scripts = {int(size): generated_script(int(size)) for size in args.sizes.split(',')}
+    directory = tempfile.mkdtemp(prefix='compile_cache_')
+    try:
+        cache = CompileCache(directory=directory)
+        print(f"{'lines':>7}{'KB':>8}{'compile ms':>12}{'memory hit ms':>15}{'disk hit ms':>13}")
+        for lines, source in scripts.items():
+            compile_seconds = timed(lambda: compile(source, USER_FILE, 'exec'), 3)
+            cache.get(source, USER_FILE)
+            memory = timed(lambda: cache.get(source, USER_FILE), 10)
+            disk = timed(lambda: CompileCache(directory=directory).get(source, USER_FILE), 3)
+            print(f"{lines:>7}{len(source) / 1024:>8.0f}{compile_seconds * 1000:>12.2f}{memory * 1000:>15.3f}"
+                  f"{disk * 1000:>13.2f}")
+
+        uncached = run_latency(scripts, None, args.runs)
+        cached = run_latency(scripts, CompileCache(), args.runs)
+        print(f"\n{'lines':>7}{'run ms (no cache)':>19}{'run ms (cache)':>16}")
+        for lines in scripts:
+            print(f"{lines:>7}{uncached[lines] * 1000:>19.1f}{cached[lines] * 1000:>16.1f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
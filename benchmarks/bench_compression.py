@@ -0,0 +1,108 @@
+"""
+Compression benchmark: response sizes and page loads with and without compression and caching
+------------------------------------------------------------------------------------------------
+Sends typical requests to the app (through Flask's test client, with a
+one-worker pool) once per Accept-Encoding and reports, for each:
+
+  identity / gzip / br    bytes on the wire
+  ms                      server time of the request with brotli, and how
+                          much compressing added over identity
+
+Then it models loading the editor over a slow link (--mbps, --rtt-ms):
+the page, its CSS and script, and the file listing. Before this change
+every visit fetched them uncompressed, and repeat visits revalidated each
+static file; now they are compressed, and the fingerprinted static files
+are not requested again at all on repeat visits.
+
+Usage:
+    python benchmarks/bench_compression.py [--mbps 2] [--rtt-ms 150] [--repeat 5]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('WORKER_POOL_SIZE', '1')
+os.environ.setdefault('PREWARM', '0')
+
+EXAMPLE = 'examples/data_analysis.py'
+TABLE = "for i in range(5000):\n    print(f'{i:6d} {i * 0.37:12.4f} {i % 7:3d} sample-{i % 13}')"
+
+# name: (method, path, JSON body)
+REQUESTS = {
+    'run (5000 lines)': ('POST', '/api/run', {'code': TABLE, 'cache': False}),
+    'load file': ('GET', f'/api/load/{EXAMPLE}', None),
+    'file listing': ('GET', '/api/load', None),
+    'lint (fast)': ('POST', '/api/lint', {'code': open(os.path.join('user_code', EXAMPLE)).read(), 'mode': 'fast'}),
+}
+
+
+def send(client, method, path, body, encoding, headers=None):
+    """Return (wire bytes, seconds, response) of one request."""
+    headers = dict(headers or {}, **{'Accept-Encoding': encoding})
+    start = time.perf_counter()
+    response = client.open(path, method=method, json=body, headers=headers)
+    data = response.get_data()
+    return len(data), time.perf_counter() - start, response
+
+
+def transfer_ms(size, args):
+    return size * 8 / (args.mbps * 1e6) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mbps', type=float, default=2, help='bandwidth of the modelled link')
+    parser.add_argument('--rtt-ms', type=float, default=150, help='round-trip time of the modelled link')
+    parser.add_argument('--repeat', type=int, default=5, help='timed requests of each kind and encoding')
+    args = parser.parse_args()
+
+    import app
+    client = app.app.test_client()
+    try:
+        print(f"{'request':<18}{'identity':>10}{'gzip':>9}{'br':>9}{'br ms':>8}{'+ms':>7}")
+        for name, (method, path, body) in REQUESTS.items():
+            sizes, times = {}, {}
+            for encoding in ('identity', 'gzip', 'br'):
+                send(client, method, path, body, encoding)  # Warm
+                runs = [send(client, method, path, body, encoding) for _ in range(args.repeat)]
+                sizes[encoding] = runs[0][0]
+                times[encoding] = statistics.median(seconds for _, seconds, _ in runs)
+            print(f"{name:<18}{sizes['identity']:>10}{sizes['gzip']:>9}{sizes['br']:>9}"
+                  f"{times['br'] * 1000:>8.1f}{(times['br'] - times['identity']) * 1000:>7.1f}")
+
+        # The editor page: the HTML, then its CSS and script (in parallel), and the listing
+        page = client.get('/').get_data(as_text=True)
+        assets = re.findall(r'"(/static/[^"]+)"', page)
+        print(f"\nLoading the editor at {args.mbps:g} Mbit/s with {args.rtt_ms:g} ms round trips:")
+        print(f"{'':<22}{'requests':>9}{'bytes':>9}{'ms':>8}")
+        for label, encoding, repeat_visit in (('before, first visit', 'identity', False),
+                                              ('before, repeat visit', 'identity', True),
+                                              ('now, first visit', 'br', False),
+                                              ('now, repeat visit', 'br', True)):
+            requests, total, rounds = 0, 0, 2  # The page, then the listing once the script runs
+            for path in ['/'] + assets + ['/api/load']:
+                if repeat_visit and path.startswith('/static/') and encoding != 'identity':
+                    continue  # Cached for good under its fingerprinted URL
+                url = path.split('?')[0] if encoding == 'identity' else path
+                size, _, response = send(client, 'GET', url, None, encoding)
+                if repeat_visit and path != '/':
+                    # The browser revalidates with the validators it has
+                    size, _, _ = send(client, 'GET', url, None, encoding,
+                                      {'If-None-Match': response.headers.get('ETag', '')})
+                requests += 1
+                total += size
+                if path.startswith('/static/'):
+                    rounds = 3  # The script has to arrive before the listing is requested
+            print(f"{label:<22}{requests:>9}{total:>9}{rounds * args.rtt_ms + transfer_ms(total, args):>8.0f}")
+    finally:
+        app.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+File listing benchmark: a directory walk per request against the file index
+--------------------------------------------------------------------------
+Fills a temporary directory with --files small scripts spread over
+--dirs subdirectories and times, per listing:
+
+  listdir        os.listdir of the top level, what /api/load used to do
+                 (subdirectories are not listed at all)
+  walk + stat    a recursive walk with a stat per file, what a listing with
+                 metadata costs without an index
+  index: all     FileIndex.list() of every file
+  index: page    a page of 100 files
+  index: prefix  the files of one subdirectory
+  index: etag    the ETag check that answers an unchanged listing with 304
+
+It also reports the index's initial scan and how long a new file takes to
+appear in the listing through the change notifications.
+
+Usage:
+    python benchmarks/file_listing.py [--files 20000] [--dirs 100]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from file_index import FileIndex
+
+
+def timed(fn, repeat):
+    """Return the median milliseconds of repeat calls of fn."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def walk_and_stat(root):
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith('.py'):
+                stat = os.stat(os.path.join(dirpath, name))
+                files.append((name, stat.st_size, stat.st_mtime))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20000, help='scripts to create')
+    parser.add_argument('--dirs', type=int, default=100, help='subdirectories to spread them over')
+    parser.add_argument('--repeat', type=int, default=20, help='timed listings of each kind')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='file_listing_')
+    try:
+        for d in range(args.dirs):
+            os.makedirs(os.path.join(root, f'dir{d:04d}'))
+        for i in range(args.files):
+            with open(os.path.join(root, f'dir{i % args.dirs:04d}', f'script_{i:06d}.py'), 'w') as f:
+                f.write(f'print({i})\n')
+
+        start = time.perf_counter()
+        index = FileIndex(root)
+        print(f"{args.files} files in {args.dirs} directories, initial scan: {time.perf_counter() - start:.2f}s")
+
+        rows = {
+            'listdir': lambda: [name for name in os.listdir(root) if name.endswith('.py')],
+            'walk + stat': lambda: walk_and_stat(root),
+            'index: all': lambda: index.list(),
+            'index: page': lambda: index.list(offset=args.files // 2, limit=100),
+            'index: prefix': lambda: index.list(prefix='dir0001/'),
+            'index: etag': lambda: index.etag(),
+        }
+        print(f"{'listing':<16}{'median ms':>11}")
+        for name, fn in rows.items():
+            print(f"{name:<16}{timed(fn, args.repeat):>11.3f}")
+
+        latencies = []
+        for i in range(10):
+            path = os.path.join(root, f'dir{i:04d}', f'new_{i}.py')
+            start = time.perf_counter()
+            with open(path, 'w') as f:
+                f.write('print()\n')
+            while not index.list(prefix=f'dir{i:04d}/new_')[0]:
+                time.sleep(0.001)
+            latencies.append(time.perf_counter() - start)
+        print(f"new file listed after: {statistics.median(latencies) * 1000:.1f} ms (median of 10)")
+        index.close()
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
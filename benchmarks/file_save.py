@@ -0,0 +1,130 @@
+"""
+File save benchmark: whole-file JSON saves against patches, chunked uploads and the version history
+--------------------------------------------------------------------------------------------------
+Runs the app (through Flask's test client) in a temporary directory and,
+for a generated script of --lines lines:
+
+  save: whole      /api/save with the whole code after a one-line edit,
+                   what the editor sent before
+  save: patch      /api/save with only the changed line
+  upload: whole    PUT /api/files/<path> of a --upload-mb file in one body
+  upload: chunks   the same file in 1 MB Content-Range chunks
+  load: JSON       /api/load/<path> of that file
+  load: range      GET /api/files/<path> of its last 64 KB
+
+reporting the bytes sent (request bodies of saves and uploads, response
+bodies of loads) and the median latency. It then saves --edits
+one-line edits (and every version once more) and compares the size of the
+version history with storing every save as it was.
+
+Usage:
+    python benchmarks/file_save.py [--lines 5000] [--edits 50] [--upload-mb 16]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('WORKER_POOL_SIZE', '0')
+os.environ.setdefault('PREWARM', '0')
+
+CHUNK = 1024 * 1024
+
+
+def script(lines, edit=None):
+    text = [f'value_{i} = compute({i}, scale={i % 17}, label="row {i}")' for i in range(lines)]
+    if edit is not None:
+        text[edit] += '  # edited'
+    return '\n'.join(text) + '\n'
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=5000, help='lines of the saved script')
+    parser.add_argument('--edits', type=int, default=50, help='saved one-line edits for the history')
+    parser.add_argument('--upload-mb', type=int, default=16, help='size of the uploaded file')
+    parser.add_argument('--repeat', type=int, default=10, help='timed requests of each kind')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='file_save_')
+    os.chdir(workdir)
+    import app
+    client = app.app.test_client()
+    try:
+        original = script(args.lines)
+        base = client.post('/api/save', json={'filename': 'bench.py', 'code': original}).get_json()['hash']
+        edited = script(args.lines, edit=args.lines // 2)
+        patch = [{'start': args.lines // 2, 'delete': 1, 'insert': [edited.split('\n')[args.lines // 2]]}]
+        whole_body = {'filename': 'bench.py', 'code': edited}
+
+        def save_patch():
+            # Back to the base version first (untimed cost is the same for both), then patch it
+            response = client.post('/api/save', json={'filename': 'bench.py', 'base': base, 'patch': patch})
+            assert response.status_code == 200, response.get_json()
+            client.post('/api/save', json={'filename': 'bench.py', 'code': original})
+
+        def save_whole():
+            client.post('/api/save', json=whole_body)
+            client.post('/api/save', json={'filename': 'bench.py', 'code': original})
+
+        data = b''.join(b'print(%d)\n' % i for i in range(args.upload_mb * CHUNK // 12))[:args.upload_mb * CHUNK]
+
+        def upload_chunks():
+            for start in range(0, len(data), CHUNK):
+                chunk = data[start:start + CHUNK]
+                client.put('/api/files/upload.py', data=chunk,
+                           headers={'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{len(data)}'})
+
+        patch_bytes = len(json.dumps({'filename': 'bench.py', 'base': base, 'patch': patch}))
+        load_json = lambda: client.get('/api/load/upload.py').get_data()
+        load_range = lambda: client.get('/api/files/upload.py', headers={'Range': 'bytes=-65536'}).get_data()
+        rows = [
+            ('save: whole', len(json.dumps(whole_body)), timed(save_whole, args.repeat) / 2),
+            ('save: patch', patch_bytes, timed(save_patch, args.repeat) / 2),
+            ('upload: whole', len(data), timed(lambda: client.put('/api/files/upload.py', data=data), 3)),
+            ('upload: chunks', len(data), timed(upload_chunks, 3)),
+            ('load: JSON', len(load_json()), timed(load_json, args.repeat)),
+            ('load: range', len(load_range()), timed(load_range, args.repeat)),
+        ]
+        print(f"{'request':<16}{'bytes':>12}{'median ms':>11}")
+        for name, size, ms in rows:
+            print(f"{name:<16}{size:>12}{ms:>11.2f}")
+
+        history = os.path.join('output', 'history')
+        shutil.rmtree(history)
+        app.file_history = app.FileHistory('user_code', history, args.edits * 2 + 1)
+        saved = 0
+        versions = [script(args.lines, edit=i) for i in range(args.edits)]
+        for code in versions + versions:  # Every version saved twice
+            client.post('/api/save', json={'filename': 'history.py', 'code': code})
+            saved += len(code.encode())
+        print(f"\n{len(versions) * 2} saves of {len(versions)} versions of a {len(original) // 1024} KB script: "
+              f"{saved / 2 ** 20:.1f} MB as saved, history {directory_bytes(history) / 2 ** 20:.2f} MB")
+    finally:
+        app.shutdown()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Lint latency benchmark: per-request pylint vs. the warm, incremental linter
+----------------------------------------------------------------------------
+Replays an editing session on a file (by default testing_demo.py): every
+step edits the body of one top-level function and lints the result. Each
+step is linted three ways and the median wall and CPU time are reported:
+
+  per-request  a new pylint.Run on a temporary file, as /api/lint used to
+  warm         the warm LintService linter on the whole file
+  incremental  LintService with remembered diagnostics of unchanged functions
+
+A final line shows re-linting unchanged code, which is answered from the
+content-hash memo.
+
+Usage:
+    python benchmarks/lint_latency.py [--file path] [--steps 20]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from linting import LintService, function_blocks
+
+
+def edits(code, steps, seed=0):
+    """Yield code with one more line added to a random function body each step."""
+    rng = random.Random(seed)
+    lines = code.splitlines(keepends=True)
+    for step in range(steps):
+        block = rng.choice(function_blocks(''.join(lines)))
+        lines.insert(block.end, f"{block.indent}_edit_{step} = {step}\n")
+        yield ''.join(lines)
+
+
+def lint_per_request(code):
+    from pylint import lint
+    from pylint.reporters import CollectingReporter
+
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
+        f.write(code)
+    try:
+        lint.Run(['--errors-only', f.name], reporter=CollectingReporter(), exit=False)
+    finally:
+        os.unlink(f.name)
+
+
+def timed(fn, code):
+    wall, cpu = time.perf_counter(), time.process_time()
+    fn(code)
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=os.path.join(ROOT, 'user_code', 'examples', 'testing_demo.py'))
+    parser.add_argument('--steps', type=int, default=20, help='edits to replay')
+    args = parser.parse_args()
+
+    with open(args.file) as f:
+        code = f.read()
+
+    service = LintService()
+    incremental = LintService()
+    # Warm up pylint and astroid's cache of the imported libraries
+    service._pylint(code)
+    incremental._lint(code)
+
+    session = list(edits(code, args.steps))
+    modes = [
+        ('per-request', lint_per_request),
+        ('warm', service._pylint),
+        ('incremental', incremental._lint),
+        ('unchanged', incremental.full),
+    ]
+    print(f"file: {os.path.relpath(args.file, ROOT)}  edits: {args.steps}")
+    print(f"{'mode':<14}{'wall ms':>10}{'cpu ms':>10}")
+    for name, fn in modes:
+        if name == 'unchanged':
+            for version in session:
+                fn(version)  # Remember every version first
+        times = [timed(fn, version) for version in session]
+        print(f"{name:<14}{statistics.median(t for t, _ in times) * 1000:>10.1f}"
+              f"{statistics.median(c for _, c in times) * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
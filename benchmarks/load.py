@@ -0,0 +1,324 @@
+"""
+Load test: latency percentiles and throughput of every API endpoint
+-------------------------------------------------------------------
+Starts the app on a local port (or uses a running server with --url) and
+drives each scenario at several concurrency levels:
+
+  run:<example>   /api/run on each script in user_code/examples
+  run:cpu         /api/run on a CPU-bound loop
+  run:memory      /api/run allocating and touching ~200 MB
+  run:output      /api/run printing ~5 MB of output
+  lint            full /api/lint pass (each request sends different code)
+  format          /api/format (each request sends different code)
+  save            /api/save of an example script
+  load            /api/load of a saved script
+
+For every scenario and concurrency level it reports p50/p95/p99 latency,
+throughput and errors, plus the peak memory (RSS) of the server and all
+its worker and run processes while the scenario ran. With --output the
+results are also written as JSON together with the commit, so two runs
+can be compared with --compare: scenarios whose p95 latency rose or
+whose throughput fell by more than --threshold percent are listed as
+regressions and the exit status is 1.
+
+Usage:
+    python benchmarks/load.py [--requests 20] [--concurrency 1,4,16] [--output results.json]
+    python benchmarks/load.py --only run:cpu,lint --compare baseline.json
+    python benchmarks/load.py --url http://localhost:5000
+"""
+import os
+import sys
+import json
+import glob
+import math
+import time
+import uuid
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prefix of the files the save scenario writes to user_code
+SAVE_PREFIX = 'loadtest_'
+# How often the server's memory is sampled (seconds)
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+SYNTHETIC = {
+    'cpu': "total = 0\nfor i in range(3_000_000):\n    total += i * i\nprint(total)\n",
+    'memory': "data = bytearray(200 * 1024 * 1024)\nfor i in range(0, len(data), 4096):\n    data[i] = 1\nprint(len(data))\n",
+    'output': "for i in range(100_000):\n    print('line', i, 'x' * 40)\n",
+}
+
+SERVER = """
+import sys
+from werkzeug.serving import run_simple
+from app import app
+run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)
+"""
+
+
+def examples():
+    """Return {name: code} of the example scripts."""
+    scripts = {}
+    for path in sorted(glob.glob(os.path.join(ROOT, 'user_code', 'examples', '*.py'))):
+        with open(path) as f:
+            scripts[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return scripts
+
+
+def scenarios():
+    """Return {name: request(i)}, where request(i) gives the i-th (method, path, body)."""
+    scripts = examples()
+    sample = scripts.get('data_analysis') or SYNTHETIC['cpu']
+    found = {}
+    for name, code in scripts.items():
+        found[f'run:{name}'] = lambda i, code=code: ('POST', '/api/run', {'code': code, 'cache': False})
+    for name, code in SYNTHETIC.items():
+        found[f'run:{name}'] = lambda i, code=code: ('POST', '/api/run', {'code': code, 'cache': False})
+    # Different code every time, so remembered results do not answer for the linter and formatter
+    found['lint'] = lambda i: ('POST', '/api/lint', {'code': f'{sample}\nrequest_id = {uuid.uuid4().hex!r}\n',
+                                                      'mode': 'full'})
+    found['format'] = lambda i: ('POST', '/api/format', {'code': f'{sample}\nrequest_id   =   {uuid.uuid4().hex!r}\n'})
+    found['save'] = lambda i: ('POST', '/api/save', {'code': sample, 'filename': f'{SAVE_PREFIX}{i}.py'})
+    found['load'] = lambda i: ('GET', f'/api/load/{SAVE_PREFIX}0.py', None)
+    return found
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values."""
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def request(url, method, path, body, timeout):
+    """Send one request; return whether it succeeded."""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url + path, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            payload = resp.read()
+    except (urllib.error.URLError, OSError):
+        return False
+    # A run that timed out or crashed still answers 200
+    return path != '/api/run' or 'error' not in json.loads(payload)
+
+
+class MemorySampler:
+    """Tracks the peak RSS of a process and all its descendants."""
+
+    def __init__(self, pid):
+        import psutil
+        self.process = psutil.Process(pid)
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _rss(self):
+        import psutil
+        total = 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def start(self):
+        self.peak = self._rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(MEMORY_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, self._rss())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+
+def measure(url, name, make_request, concurrency, count, timeout, sampler):
+    """Send count requests, concurrency at a time; return the result record."""
+    def timed(i):
+        method, path, body = make_request(i)
+        start = time.perf_counter()
+        ok = request(url, method, path, body, timeout)
+        return time.perf_counter() - start, ok
+
+    timed(0)  # Warm up (and create the file the load scenario reads)
+    if sampler is not None:
+        sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(count)))
+    wall = time.perf_counter() - start
+    peak = sampler.stop() if sampler is not None else None
+
+    latencies = sorted(seconds for seconds, _ in outcomes)
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': sum(not ok for _, ok in outcomes),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'throughput_rps': round(count / wall, 2),
+        'peak_rss_mb': round(peak / (1024 * 1024), 1) if peak is not None else None
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env_overrides):
+    """Start the app on a free port; return (process, base URL)."""
+    port = free_port()
+    env = dict(os.environ, **env_overrides)
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            log.seek(0)
+            sys.exit(f"Server exited with status {proc.returncode}:\n{log.read().decode(errors='replace')}")
+        try:
+            with urllib.request.urlopen(url + '/api/jobs', timeout=1):
+                return proc, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    proc.kill()
+    sys.exit("Server did not start within 120 seconds")
+
+
+def remove_saved_files():
+    """Delete the scripts the save scenario wrote, and their version history.
+
+    Only a server sharing this checkout (started here, or with --url on
+    this machine) leaves them here; the history objects they no longer
+    use are collected by the server.
+    """
+    patterns = [os.path.join(ROOT, 'user_code', SAVE_PREFIX + '*.py'),
+                os.path.join(ROOT, 'output', 'history', 'log', SAVE_PREFIX + '*.py.jsonl')]
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            os.remove(path)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print changes against a baseline run; return the regressions."""
+    previous = {(r['scenario'], r['concurrency']): r for r in baseline['results']}
+    regressions = []
+    print(f"\nagainst {baseline['meta'].get('commit') or 'baseline'} (threshold {threshold}%):")
+    print(f"{'scenario':<22}{'conc':>5}{'p95 ms':>16}{'change':>9}{'req/s':>16}{'change':>9}")
+    for result in results:
+        old = previous.get((result['scenario'], result['concurrency']))
+        if old is None:
+            continue
+        p95_change = (result['p95_ms'] / old['p95_ms'] - 1) * 100 if old['p95_ms'] else 0.0
+        rps_change = (result['throughput_rps'] / old['throughput_rps'] - 1) * 100 if old['throughput_rps'] else 0.0
+        flag = ''
+        if p95_change > threshold or rps_change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(result)
+        print(f"{result['scenario']:<22}{result['concurrency']:>5}"
+              f"{old['p95_ms']:>7.1f} -> {result['p95_ms']:<7.1f}{p95_change:>+8.1f}%"
+              f"{old['throughput_rps']:>7.1f} -> {result['throughput_rps']:<7.1f}{rps_change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server (default: start one)')
+    parser.add_argument('--requests', type=int, default=20, help='requests per scenario and concurrency level')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated concurrency levels')
+    parser.add_argument('--only', help='comma-separated scenario names or prefixes (e.g. run:,lint)')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds per request')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='environment variable for the started server (repeatable)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=10, help='percent change counted as a regression')
+    args = parser.parse_args()
+
+    selected = scenarios()
+    if args.only:
+        prefixes = args.only.split(',')
+        selected = {name: make for name, make in selected.items()
+                    if any(name == p or name.startswith(p) for p in prefixes)}
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    proc = sampler = None
+    url = args.url
+    if url is None:
+        # Repeated runs of the same code should run, not come from the cache
+        env = dict([('RESULT_CACHE', '')] + [item.split('=', 1) for item in args.env])
+        proc, url = start_server(env)
+        sampler = MemorySampler(proc.pid)
+    url = url.rstrip('/')
+
+    results = []
+    print(f"{'scenario':<22}{'conc':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'req/s':>9}{'errors':>8}{'peak MB':>9}")
+    try:
+        for name, make_request in selected.items():
+            for concurrency in levels:
+                result = measure(url, name, make_request, concurrency, args.requests, args.timeout, sampler)
+                results.append(result)
+                peak = f"{result['peak_rss_mb']:>9.0f}" if result['peak_rss_mb'] is not None else f"{'-':>9}"
+                print(f"{name:<22}{concurrency:>5}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                      f"{result['p99_ms']:>10.1f}{result['throughput_rps']:>9.1f}{result['errors']:>8}{peak}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        remove_saved_files()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'requests': args.requests,
+            'concurrency': levels,
+            'url': args.url
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Metrics overhead benchmark: cost of the /metrics instrumentation per request
+----------------------------------------------------------------------------
+Times the metric updates every request makes (its timer and counter) and
+those a run adds (queue wait, wall/CPU time, peak RSS, outcome, a figure)
+in a tight loop, then measures the latency of a few cheap requests
+through the app and prints the instrumentation cost as a share of each.
+It should stay well under 1%.
+
+Usage:
+    python benchmarks/metrics_overhead.py [--requests 50]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import Registry, Histogram, Counter, BYTES_BUCKETS
+
+# name: (path, JSON body or None for GET, whether it runs code)
+REQUESTS = {
+    'run print': ('/api/run', {'code': 'print(1)', 'cache': False}, True),
+    'lint fast': ('/api/lint', {'code': 'x = 1\n', 'mode': 'fast'}, False),
+    'job status': ('/api/jobs', None, False),
+}
+
+
+def instrumentation_seconds(loops, run):
+    """Return the seconds the metric updates of one request take."""
+    registry = Registry()
+    request_seconds = Histogram('request', '', ['route', 'method'], registry=registry)
+    requests = Counter('requests', '', ['route', 'method', 'status'], registry=registry)
+    queue_wait = Histogram('queue_wait', '', ['queue'], registry=registry)
+    wall = Histogram('wall', '', registry=registry)
+    cpu = Histogram('cpu', '', registry=registry)
+    rss = Histogram('rss', '', buckets=BYTES_BUCKETS, registry=registry)
+    runs = Counter('runs', '', ['outcome'], registry=registry)
+    figures = Histogram('figures', '', ['format'], registry=registry)
+
+    start = time.perf_counter()
+    for _ in range(loops):
+        began = time.perf_counter()
+        if run:
+            waiting = time.perf_counter()
+            queue_wait.observe(time.perf_counter() - waiting, 'worker')
+            wall.observe(0.05)
+            cpu.observe(0.04)
+            rss.observe(150 * 1024 * 1024)
+            figures.observe(0.02, 'png')
+            runs.inc('ok')
+        request_seconds.observe(time.perf_counter() - began, '/api/run', 'POST')
+        requests.inc('/api/run', 'POST', '200')
+    return (time.perf_counter() - start) / loops
+
+
+def request_latency(client, path, body, count):
+    """Return the median seconds of count requests."""
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.post(path, json=body) if body is not None else client.get(path)
+        response.get_data()
+        response.close()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50, help='requests per kind')
+    args = parser.parse_args()
+
+    costs = {run: instrumentation_seconds(100000, run) for run in (False, True)}
+    print(f"metric updates per request: {costs[False] * 1e6:.2f} us, per run request: {costs[True] * 1e6:.2f} us")
+
+    from app import app
+    client = app.test_client()
+    print(f"{'request':<14}{'median ms':>11}{'metrics %':>11}")
+    for name, (path, body, run) in REQUESTS.items():
+        request_latency(client, path, body, 3)  # Warm up workers and the linter
+        latency = request_latency(client, path, body, args.requests)
+        print(f"{name:<14}{latency * 1000:>11.2f}{costs[run] / latency * 100:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Profiler overhead benchmark: how much slower profiled runs are, measured vs. reported
+-------------------------------------------------------------------------------------
+Runs a few workloads (call-heavy recursion, a NumPy loop, sleeping) in this
+process without a profiler and under each profile mode, and prints the
+median wall time, the measured overhead (wall time minus that of the
+unprofiled run) and the overhead the profile report claims for itself.
+
+Usage:
+    python benchmarks/profile_overhead.py [--repeat 5]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from profiler import Profiler, PROFILE_MODES
+
+WORKLOADS = {
+    'recursion': '''
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+fib(24)
+''',
+    'numpy': '''
+import numpy as np
+a = np.random.rand(200, 200)
+for _ in range(50):
+    a = a @ a.T / a.sum()
+''',
+    'sleep': '''
+import time
+for _ in range(10):
+    time.sleep(0.01)
+''',
+}
+
+
+def timed(code, mode):
+    """Return the wall time of one run and the overhead its report claims."""
+    namespace = {'__name__': '__main__'}
+    if mode is None:
+        start = time.perf_counter()
+        exec(code, namespace)
+        return time.perf_counter() - start, 0.0
+    profiler = Profiler(mode)
+    profiler.run(code, namespace)
+    return profiler.wall_seconds, profiler.report(code=code)['overhead']['seconds']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per workload and mode')
+    args = parser.parse_args()
+
+    print(f"{'workload':<12}{'mode':<10}{'wall ms':>10}{'measured ms':>13}{'reported ms':>13}")
+    for name, code in WORKLOADS.items():
+        timed(code, None)  # Warm up imports
+        baseline = None
+        for mode in (None,) + PROFILE_MODES:
+            runs = [timed(code, mode) for _ in range(args.repeat)]
+            wall = statistics.median(w for w, _ in runs)
+            reported = statistics.median(o for _, o in runs)
+            if baseline is None:
+                baseline = wall
+                print(f"{name:<12}{'none':<10}{wall * 1000:>10.1f}")
+                continue
+            print(f"{name:<12}{mode:<10}{wall * 1000:>10.1f}{(wall - baseline) * 1000:>13.1f}{reported * 1000:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
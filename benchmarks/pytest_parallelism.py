@@ -0,0 +1,57 @@
+"""
+Parallel pytest benchmark: wall time of /api/test runs vs. the tests' own time
+------------------------------------------------------------------------------
+Generates a suite of tests of uneven length (a few long ones, many short
+ones) and runs it with the test runner behind /api/test on worker pools of
+several sizes. For each size it prints the sum of all test durations, the
+longest test and the wall time of a first run (collecting the tests) and a
+second run (collection remembered, groups balanced by the first run's
+durations).
+
+Usage:
+    python benchmarks/pytest_parallelism.py [--tests 40] [--workers 1,2,4]
+"""
+import os
+import sys
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from worker_pool import WorkerPool
+from pytest_runner import TestRunner
+
+
+def suite(tests):
+    """Return test code: every tenth test takes 0.5s, the others 0.05s."""
+    lines = ['import time', '']
+    for i in range(tests):
+        lines += [f'def test_{i}():', f'    time.sleep({0.5 if i % 10 == 0 else 0.05})', '']
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tests', type=int, default=40)
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, 4, os.cpu_count() or 1})),
+                        help='comma-separated worker pool sizes')
+    args = parser.parse_args()
+
+    code = suite(args.tests)
+    print(f"tests: {args.tests}  cores: {os.cpu_count()}")
+    print(f"{'workers':<10}{'sum s':>8}{'longest s':>11}{'first run s':>13}{'second run s':>14}")
+    for size in [int(n) for n in args.workers.split(',')]:
+        pool = WorkerPool(size=size, preload=['pytest'])
+        try:
+            runner = TestRunner(lambda code, spec, cancel: pool.run(code, 300, cancel, pytest=spec), parallel=size)
+            first = runner.test(code)
+            second = runner.test(code)
+        finally:
+            pool.shutdown()
+        durations = [test['duration'] for test in second['tests']]
+        print(f"{size:<10}{sum(durations):>8.2f}{max(durations):>11.2f}"
+              f"{first['summary']['wall_seconds']:>13.2f}{second['summary']['wall_seconds']:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
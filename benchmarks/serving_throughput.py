@@ -0,0 +1,129 @@
+"""
+Serving benchmark: the development server against gunicorn
+-----------------------------------------------------------
+Starts the app four ways on a local port, one at a time:
+
+  dev       python app.py (Werkzeug's development server with the reloader);
+            its runs fail because the reloader restarts the server when a
+            run writes its script to user_code
+  werkzeug  the same server, threaded, without the debugger and reloader
+  gthread   gunicorn -c gunicorn.conf.py, WEB_WORKER_CLASS=gthread
+  gevent    gunicorn -c gunicorn.conf.py, WEB_WORKER_CLASS=gevent
+
+and drives a few requests at several concurrency levels against each:
+
+  healthz   GET /healthz, the cheapest request
+  run       POST /api/run of print(1) (result cache off)
+  sleep     POST /api/run of a script sleeping 0.5s, so that requests mostly wait
+  lint      POST /api/lint in fast mode
+
+For every server, request and concurrency level it reports p50/p95 latency,
+throughput and errors. All servers share WORKER_POOL_SIZE (default 4), so
+runs are bounded by the same execution pool and the difference is in how
+requests are accepted and waited on.
+
+Usage:
+    python benchmarks/serving_throughput.py [--requests 200] [--concurrency 1,8,32]
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load import ROOT, free_port, measure
+
+WERKZEUG = """
+import os
+from app import app
+app.run(host='127.0.0.1', port=int(os.environ['PORT']), threaded=True)
+"""
+
+# name: (command, environment)
+SERVERS = {
+    'dev': ([sys.executable, 'app.py'], {}),
+    'werkzeug': ([sys.executable, '-c', WERKZEUG], {}),
+    'gthread': ([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], {'WEB_WORKER_CLASS': 'gthread'}),
+    'gevent': ([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], {'WEB_WORKER_CLASS': 'gevent'}),
+}
+
+# name: (method, path, JSON body)
+REQUESTS = {
+    'healthz': ('GET', '/healthz', None),
+    'run': ('POST', '/api/run', {'code': 'print(1)', 'cache': False}),
+    'sleep': ('POST', '/api/run', {'code': 'import time\ntime.sleep(0.5)', 'cache': False}),
+    'lint': ('POST', '/api/lint', {'code': 'x = 1\n', 'mode': 'fast'}),
+}
+
+
+def start(name, pool_size):
+    """Start a server in its own process group; return (process, base URL)."""
+    command, overrides = SERVERS[name]
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WORKER_POOL_SIZE=str(pool_size), RESULT_CACHE='',
+               WEB_ACCESS_LOG='', **overrides)
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            log.seek(0)
+            sys.exit(f"{name} exited with status {proc.returncode}:\n{log.read().decode(errors='replace')}")
+        try:
+            with urllib.request.urlopen(url + '/healthz', timeout=1):
+                return proc, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    stop(proc)
+    sys.exit(f"{name} did not start within 120 seconds")
+
+
+def stop(proc):
+    """Stop a server with the reloader or gunicorn workers it started."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per server, request and level')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--pool-size', type=int, default=4, help='execution workers of every server')
+    parser.add_argument('--only', help='comma-separated servers to run')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds per request')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    servers = args.only.split(',') if args.only else list(SERVERS)
+    print(f"{'server':<9}{'request':<9}{'conc':>5}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>9}{'errors':>8}")
+    for name in servers:
+        proc, url = start(name, args.pool_size)
+        try:
+            for request_name, request in REQUESTS.items():
+                # Sleeping runs are slow by design; send fewer
+                count = args.requests if request_name != 'sleep' else max(args.requests // 5, 1)
+                for concurrency in levels:
+                    result = measure(url, request_name, lambda i: request, concurrency, count, args.timeout, None)
+                    print(f"{name:<9}{request_name:<9}{concurrency:>5}{result['p50_ms']:>10.1f}"
+                          f"{result['p95_ms']:>10.1f}{result['throughput_rps']:>9.1f}{result['errors']:>8}",
+                          flush=True)
+        finally:
+            stop(proc)
+
+
+if __name__ == '__main__':
+    main()
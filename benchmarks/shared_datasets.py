@@ -0,0 +1,112 @@
+"""
+Shared dataset benchmark: parsing a CSV in every run against the shared dataset store
+------------------------------------------------------------------------------------
+Writes a CSV of --rows rows (two float columns, an integer column and a
+string column), converts it with shared_data.DatasetStore and then runs
+--runs concurrent runs on a pool of as many workers, each loading the data
+one way, summing the numeric columns and counting the strings:
+
+  read_csv   pandas.read_csv of the CSV, what runs did before
+  frame      shared_data.frame() of the converted dataset, mapped by the
+             workers before forking the runs
+
+For each it reports the median time to load (and the time to sum and count,
+which touches every page), and the median memory of a run split into private
+memory, which counts against MAX_MEMORY_MB and is paid by every run, and
+mapped file pages, which all runs share through the page cache.
+
+Usage:
+    python benchmarks/shared_datasets.py [--rows 2000000] [--runs 4]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from shared_data import DatasetStore
+from worker_pool import WorkerPool
+
+MEASURE = """
+import json, os, time
+start = time.perf_counter()
+{load}
+loaded = time.perf_counter()
+df.select_dtypes('number').sum()
+df['department'].value_counts()
+summed = time.perf_counter()
+with open('/proc/self/statm') as f:
+    resident, shared = [int(field) * os.sysconf('SC_PAGE_SIZE') for field in f.read().split()[1:3]]
+print(json.dumps({{'load': loaded - start, 'sum': summed - loaded, 'private': resident - shared, 'mapped': shared}}))
+"""
+
+LOADS = {
+    'read_csv': "import pandas as pd\ndf = pd.read_csv({csv!r})",
+    'frame': "from shared_data import frame\ndf = frame('table')",
+}
+
+
+def write_csv(path, rows):
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        'price': rng.random(rows),
+        'weight': rng.normal(size=rows),
+        'quantity': rng.integers(0, 1000, rows),
+        'department': rng.choice(['Sales', 'Engineering', 'Marketing', 'HR', 'Finance'], rows),
+    }).to_csv(path, index=False)
+
+
+def measure(pool, code, runs):
+    with ThreadPoolExecutor(max_workers=runs) as executor:
+        results = list(executor.map(lambda _: pool.run(code, 600), range(runs)))
+    for result in results:
+        if result.get('error') or not result['stdout']:
+            sys.exit(f"Run failed:\n{result['stderr']}")
+    return [json.loads(result['stdout']) for result in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000000, help='rows of the CSV file')
+    parser.add_argument('--runs', type=int, default=4, help='concurrent runs (and workers)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='shared_datasets_')
+    try:
+        sources = os.path.join(directory, 'sources')
+        os.makedirs(sources)
+        csv = os.path.join(sources, 'table.csv')
+        write_csv(csv, args.rows)
+        store = DatasetStore(sources, os.path.join(directory, 'store'))
+        start = time.perf_counter()
+        converted = store.sync()[0]
+        print(f"{args.rows} rows, CSV {os.path.getsize(csv) / 2 ** 20:.0f} MB, converted once in "
+              f"{time.perf_counter() - start:.2f}s to {converted['bytes'] / 2 ** 20:.0f} MB")
+
+        pool = WorkerPool(size=args.runs, max_runs=10000, preload=['numpy', 'pandas'], datasets=store)
+        try:
+            print(f"{'load':<10}{'load ms':>9}{'sum ms':>8}{'private MB':>12}{'mapped MB':>11}")
+            for name, load in LOADS.items():
+                measure(pool, "print('{}')", args.runs)  # Every worker has started
+                reports = measure(pool, MEASURE.format(load=load.format(csv=csv)), args.runs)
+                median = {key: statistics.median(report[key] for report in reports) for key in reports[0]}
+                print(f"{name:<10}{median['load'] * 1000:>9.1f}{median['sum'] * 1000:>8.1f}"
+                      f"{median['private'] / 2 ** 20:>12.0f}{median['mapped'] / 2 ** 20:>11.0f}")
+        finally:
+            pool.shutdown()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Startup latency benchmark: cold interpreter vs. zygote fork
+-----------------------------------------------------------
+Runs every script in user_code/examples (plus an empty script, which
+isolates pure startup cost) two ways and reports the median wall time:
+
+  cold    a fresh `python` process that execs the script, as if nothing
+          had been imported yet
+  zygote  a run on a WorkerPool whose workers preloaded PRELOAD_MODULES
+          and fork a child per run
+
+Usage:
+    python benchmarks/startup_latency.py [--repeat 5] [--preload numpy,pandas]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from worker_pool import WorkerPool
+
+COLD_RUNNER = "import sys; exec(compile(open(sys.argv[1]).read(), sys.argv[1], 'exec'), {})"
+
+
+def time_cold(path, timeout):
+    """Run a script in a fresh interpreter and return (seconds, ok)."""
+    env = dict(os.environ, MPLBACKEND='Agg')
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run([sys.executable, '-c', COLD_RUNNER, path], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        ok = proc.returncode == 0
+    except subprocess.TimeoutExpired:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def time_zygote(pool, code, timeout):
+    """Run code on the pool and return (seconds, ok)."""
+    start = time.perf_counter()
+    result = pool.run(code, timeout)
+    return time.perf_counter() - start, 'Traceback' not in result['stderr'] and 'ERROR:' not in result['stderr']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per script and mode')
+    parser.add_argument('--timeout', type=int, default=120, help='seconds allowed per run')
+    parser.add_argument('--preload', default=os.environ.get('PRELOAD_MODULES', 'numpy,pandas,matplotlib.pyplot'),
+                        help='comma-separated modules the zygote imports')
+    args = parser.parse_args()
+
+    scripts = [('<empty>', None)]
+    scripts += [(os.path.basename(p), p) for p in sorted(glob.glob(os.path.join(ROOT, 'user_code', 'examples', '*.py')))]
+
+    preload = [m.strip() for m in args.preload.split(',') if m.strip()]
+    pool = WorkerPool(size=1, max_runs=10 ** 6, preload=preload)
+    empty_path = os.path.join(ROOT, 'output', 'empty_benchmark.py')
+    os.makedirs(os.path.dirname(empty_path), exist_ok=True)
+    with open(empty_path, 'w') as f:
+        f.write('pass\n')
+
+    try:
+        # Let the zygote finish its preload before timing anything
+        pool.run('pass', args.timeout)
+
+        print(f"preload: {', '.join(preload) or '(none)'}")
+        print(f"{'script':<24}{'cold ms':>10}{'zygote ms':>12}{'speedup':>10}  status")
+        for name, path in scripts:
+            path = path or empty_path
+            with open(path) as f:
+                code = f.read()
+            cold = [time_cold(path, args.timeout) for _ in range(args.repeat)]
+            warm = [time_zygote(pool, code, args.timeout) for _ in range(args.repeat)]
+            cold_ms = statistics.median(t for t, _ in cold) * 1000
+            warm_ms = statistics.median(t for t, _ in warm) * 1000
+            ok = all(ok for _, ok in cold + warm)
+            print(f"{name:<24}{cold_ms:>10.1f}{warm_ms:>12.1f}{cold_ms / warm_ms:>9.1f}x  {'ok' if ok else 'errors'}")
+    finally:
+        pool.shutdown()
+        os.remove(empty_path)
+
+
+if __name__ == '__main__':
+    main()
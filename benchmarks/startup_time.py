@@ -0,0 +1,133 @@
+"""
+Server startup benchmark: time to first healthy response and first-call latency
+-------------------------------------------------------------------------------
+Starts the app on a local port with PREWARM=0 (everything loaded on first
+use) and PREWARM=1 (workers, pylint and Black warmed in the background
+once the server answers), and reports:
+
+  healthy     seconds from starting the process to the first 200 from /healthz
+  warm        seconds until /healthz reports prewarming done (PREWARM=1 only)
+  first call  latency of the first request to each endpoint, sent once the
+              server is healthy (PREWARM=0) or warm (PREWARM=1)
+  second      latency of the same request sent again
+
+Each figure is the median over --repeat server starts.
+
+Usage:
+    python benchmarks/startup_time.py [--repeat 3]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER = """
+import sys
+from werkzeug.serving import run_simple
+from app import app
+run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)
+"""
+
+SAVED_FILE = 'startup_benchmark.py'
+
+# name: (method, path, JSON body)
+ENDPOINTS = {
+    'run': ('POST', '/api/run', {'code': 'print(1)', 'cache': False}),
+    'run/stream': ('POST', '/api/run/stream', {'code': 'print(1)', 'cache': False}),
+    'lint fast': ('POST', '/api/lint', {'code': 'x = y\n', 'mode': 'fast'}),
+    'lint full': ('POST', '/api/lint', {'code': 'import os\nprint(os.sep)\n'}),
+    'format': ('POST', '/api/format', {'code': 'x=1\n'}),
+    'save': ('POST', '/api/save', {'code': 'print(1)\n', 'filename': SAVED_FILE}),
+    'load': ('GET', f'/api/load/{SAVED_FILE}', None),
+}
+
+
+def call(url, method, path, body=None, timeout=120):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url + path, data=data, method=method, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return resp.read()
+
+
+def timed_call(url, method, path, body):
+    start = time.perf_counter()
+    call(url, method, path, body)
+    return time.perf_counter() - start
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, predicate, start, timeout=180):
+    """Poll /healthz until predicate(body) holds; return the seconds since start."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if predicate(json.loads(call(url, 'GET', '/healthz', timeout=1))):
+                return time.perf_counter() - start
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+        time.sleep(0.01)
+    raise RuntimeError("Server did not become ready")
+
+
+def start_once(prewarm):
+    """Start a server; return {'healthy', 'warm', 'first': {...}, 'second': {...}}."""
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, PREWARM='1' if prewarm else '0', RESULT_CACHE='')
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        times = {'healthy': wait_for(url, lambda body: True, start), 'warm': None}
+        if prewarm:
+            times['warm'] = wait_for(url, lambda body: body['prewarm'] == 'done', start)
+        times['first'] = {name: timed_call(url, *request) for name, request in ENDPOINTS.items()}
+        times['second'] = {name: timed_call(url, *request) for name, request in ENDPOINTS.items()}
+        return times
+    finally:
+        proc.terminate()
+        proc.wait()
+        path = os.path.join(ROOT, 'user_code', SAVED_FILE)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='server starts per mode')
+    args = parser.parse_args()
+
+    modes = {}
+    for prewarm in (False, True):
+        runs = [start_once(prewarm) for _ in range(args.repeat)]
+        modes[prewarm] = {
+            'healthy': statistics.median(run['healthy'] for run in runs),
+            'warm': statistics.median(run['warm'] for run in runs) if prewarm else None,
+            'first': {name: statistics.median(run['first'][name] for run in runs) for name in ENDPOINTS},
+            'second': {name: statistics.median(run['second'][name] for run in runs) for name in ENDPOINTS},
+        }
+
+    lazy, warm = modes[False], modes[True]
+    print(f"time to first healthy response: {lazy['healthy']:.2f}s (PREWARM=0), {warm['healthy']:.2f}s (PREWARM=1)")
+    print(f"time until prewarmed: {warm['warm']:.2f}s")
+    print(f"{'endpoint':<12}{'first ms (PREWARM=0)':>22}{'first ms (PREWARM=1)':>22}{'second ms':>11}")
+    for name in ENDPOINTS:
+        print(f"{name:<12}{lazy['first'][name] * 1000:>22.1f}{warm['first'][name] * 1000:>22.1f}"
+              f"{warm['second'][name] * 1000:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
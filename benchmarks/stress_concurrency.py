@@ -0,0 +1,136 @@
+"""
+Concurrency stress test for /api/run and /api/run/stream
+--------------------------------------------------------
+Fires many runs in parallel. Every run prints a unique token to stdout
+and stderr and shows one figure. Each response is then checked for
+exactly its own output, so any output or figures routed to the wrong run
+are caught.
+
+Usage:
+    python benchmarks/stress_concurrency.py                       # in-process test client
+    python benchmarks/stress_concurrency.py --url http://localhost:5000
+    python benchmarks/stress_concurrency.py --endpoint stream --runs 500 --concurrency 64
+
+Exits non-zero if any response is wrong.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SNIPPET = """
+import sys
+import time
+import matplotlib.pyplot as plt
+
+TOKEN = {token!r}
+for i in range({lines}):
+    print(TOKEN, i)
+    time.sleep(0.001)
+print(TOKEN, file=sys.stderr)
+plt.figure()
+plt.title(TOKEN)
+plt.show()
+"""
+
+
+def parse_event_stream(body):
+    """Collect a text/event-stream body into the /api/run JSON shape."""
+    result = {'stdout': '', 'stderr': '', 'figures': []}
+    for block in body.split('\n\n'):
+        kind, data = None, ''
+        for line in block.split('\n'):
+            if line.startswith('event:'):
+                kind = line[6:].strip()
+            elif line.startswith('data:'):
+                data += line[5:].strip()
+        if kind in ('stdout', 'stderr'):
+            result[kind] += json.loads(data)['text']
+        elif kind == 'figure':
+            result['figures'].append(json.loads(data))
+    return result
+
+
+class HttpClient:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def post(self, path, payload):
+        req = urllib.request.Request(self.url + path, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req) as resp:
+            return resp.read().decode()
+
+
+class InProcessClient:
+    def __init__(self):
+        from app import app
+        self.app = app
+
+    def post(self, path, payload):
+        # Flask test clients are not thread-safe; use one per request
+        resp = self.app.test_client().post(path, json=payload)
+        return resp.get_data(as_text=True)
+
+
+def check(client, endpoint, lines):
+    """Run one snippet and return (seconds, error or None)."""
+    token = uuid.uuid4().hex
+    code = SNIPPET.format(token=token, lines=lines)
+    start = time.perf_counter()
+    try:
+        if endpoint == 'stream':
+            result = parse_event_stream(client.post('/api/run/stream', {'code': code}))
+        else:
+            result = json.loads(client.post('/api/run', {'code': code}))
+    except Exception as e:
+        return time.perf_counter() - start, f"request failed: {e}"
+    elapsed = time.perf_counter() - start
+
+    expected = ''.join(f"{token} {i}\n" for i in range(lines))
+    if result['stdout'] != expected:
+        return elapsed, f"stdout mismatch for {token}: {result['stdout'][:200]!r}"
+    if result['stderr'] != token + '\n':
+        return elapsed, f"stderr mismatch for {token}: {result['stderr'][:200]!r}"
+    if len(result['figures']) != 1:
+        return elapsed, f"expected 1 figure for {token}, got {len(result['figures'])}"
+    return elapsed, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server (default: in-process test client)')
+    parser.add_argument('--endpoint', choices=['run', 'stream'], default='run')
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--lines', type=int, default=50, help='lines printed by each run')
+    args = parser.parse_args()
+
+    client = HttpClient(args.url) if args.url else InProcessClient()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda _: check(client, args.endpoint, args.lines), range(args.runs)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(t for t, _ in results)
+    errors = [e for _, e in results if e]
+    for error in errors[:10]:
+        print("FAIL", error)
+    print(f"runs: {args.runs}  concurrency: {args.concurrency}  endpoint: /api/{'run/stream' if args.endpoint == 'stream' else 'run'}")
+    print(f"failures: {len(errors)}  wall: {wall:.2f}s  throughput: {args.runs / wall:.1f} runs/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.0f}ms  "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms  max: {latencies[-1] * 1000:.0f}ms")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
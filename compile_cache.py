@@ -0,0 +1,200 @@
+import os
+import sys
+import time
+import types
+import marshal
+import hashlib
+import logging
+import threading
+import importlib.util
+from collections import OrderedDict
+
+from metrics import CACHE_LOOKUPS, COMPILE_SECONDS, COMPILE_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Bytecode differs between interpreter versions and optimisation levels
+BYTECODE_TAG = f'{importlib.util.MAGIC_NUMBER.hex()}-{sys.implementation.cache_tag}-O{sys.flags.optimize}'
+
+
+class CompileCache:
+    """Code objects of sources run before, so repeated code is not compiled again.
+
+    Entries are keyed by the SHA-256 of the source and filename together
+    with the interpreter's bytecode version. They are kept in memory,
+    dropping the least recently used beyond ``max_bytes`` (counted as
+    marshalled size), and with a ``directory`` also as marshal files that
+    all workers share and that survive restarts; that directory is kept
+    under ``max_disk_bytes``.
+
+    Each worker holds its own copy of the cache (the object is pickled
+    without its entries), compiles before forking a run and reports the
+    lookup in the run's exit payload; ``observe()`` records those reports
+    in the server for ``stats()`` and the metrics.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> (code, compile seconds, size), least recent first
+        self._bytes = 0
+        self._last_prune = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compile_seconds = 0.0
+        self.saved_seconds = 0.0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes, 'directory': self.directory, 'max_disk_bytes': self.max_disk_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def key(self, source, filename):
+        text = f'{BYTECODE_TAG}\0{filename}\0{source}'
+        return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def get(self, source, filename):
+        """Return (code object, lookup) for source compiled under filename.
+
+        ``lookup`` is ``{'hit', 'seconds'}``: whether the code object came
+        from the cache, and the seconds compiling took or, on a hit, took
+        when it was compiled. Returns (None, None) when the source does not
+        compile; executing it then reports the error.
+        """
+        key = self.key(source, filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.directory is not None:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, *entry)
+        if entry is not None:
+            return entry[0], {'hit': True, 'seconds': entry[1]}
+
+        start = time.perf_counter()
+        try:
+            code = compile(source, filename, 'exec', dont_inherit=True)
+        except Exception:
+            return None, None
+        seconds = time.perf_counter() - start
+        data = marshal.dumps((seconds, code))
+        self._remember(key, code, seconds, len(data))
+        if self.directory is not None:
+            self._store(key, data)
+        return code, {'hit': False, 'seconds': seconds}
+
+    def observe(self, lookup):
+        """Record a lookup reported by get(), here or in a worker."""
+        if lookup is None:
+            return
+        with self._lock:
+            if lookup['hit']:
+                self.hits += 1
+                self.saved_seconds += lookup['seconds']
+            else:
+                self.misses += 1
+                self.compile_seconds += lookup['seconds']
+        if lookup['hit']:
+            CACHE_LOOKUPS.inc('compile', 'hit')
+            COMPILE_SAVED_SECONDS.inc(amount=lookup['seconds'])
+        else:
+            CACHE_LOOKUPS.inc('compile', 'miss')
+            COMPILE_SECONDS.observe(lookup['seconds'])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'compile_seconds': round(self.compile_seconds, 6),
+                'saved_seconds': round(self.saved_seconds, 6),
+                'max_bytes': self.max_bytes,
+                'disk': self.directory is not None
+            }
+
+    def _remember(self, key, code, seconds, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (code, seconds, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, dropped) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.marshal')
+
+    def _load(self, key):
+        """Return (code, compile seconds, size) from disk, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            seconds, code = marshal.loads(data)
+            if not isinstance(code, types.CodeType):
+                raise ValueError('not a code object')
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            logger.warning(f"Dropping unreadable compile cache entry {key}: {str(e)}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)  # Recently used, for prune()
+        except OSError:
+            pass
+        return code, seconds, len(data)
+
+    def _store(self, key, data):
+        tmp_path = f'{self._path(key)}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write compile cache entry: {str(e)}")
+        self.prune()
+
+    def prune(self, interval=60):
+        """Delete the least recently used files beyond max_disk_bytes.
+
+        Does nothing if the last prune was less than ``interval`` seconds ago.
+        """
+        now = time.time()
+        if self.directory is None or now - self._last_prune < interval:
+            return
+        self._last_prune = now
+
+        entries, total = [], 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Removed by another worker meanwhile
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,175 @@
+import os
+import zlib
+import hashlib
+import logging
+import mimetypes
+import threading
+from stat import S_ISREG
+from collections import namedtuple
+
+from werkzeug.utils import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Content types worth compressing besides text/*; images and fonts are compressed already
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml'}
+GZIP_LEVEL = 6
+# Responses are compressed as they are sent, so favour speed; static assets are compressed once, so favour size
+BROTLI_QUALITY = 5
+STATIC_BROTLI_QUALITY = 11
+
+# A static file as sent with one encoding (None for as it is)
+StaticAsset = namedtuple('StaticAsset', 'data mimetype encoding etag version mtime')
+
+
+def available_encodings(names):
+    """Return the encodings of names that can be used, in the same order."""
+    encodings = []
+    for name in names:
+        if name == 'br' and brotli is None:
+            logger.info("brotli is not installed, responses are compressed with gzip only")
+        elif name in ('br', 'gzip'):
+            encodings.append(name)
+        else:
+            logger.warning(f"Ignoring unknown compression {name}")
+    return encodings
+
+
+def negotiate(accept_encodings, offered):
+    """Return the encoding of offered the client accepts most (server order breaks ties), or None."""
+    return accept_encodings.best_match(offered) if offered else None
+
+
+def compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def compress(data, encoding, quality=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY if quality is None else quality)
+    return zlib.compress(data, GZIP_LEVEL if quality is None else quality, wbits=31)  # 31: gzip framing
+
+
+def compress_stream(chunks, encoding, source=None):
+    """Compress chunks as they come, flushing after each so that no event waits for the next.
+
+    Closing the generator closes ``source``, so a stream's cleanup (such
+    as stopping its run) still happens when the client goes away.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield process(chunk) + flush()
+        yield finish()
+    finally:
+        close = getattr(source, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response, encoding, min_bytes=1024):
+    """Compress a response's body with encoding (None for none) where that is worth it.
+
+    Bodies under ``min_bytes``, partial and bodiless responses, files sent
+    from disk and content that is compressed already are left alone.
+    Streamed bodies are compressed chunk by chunk. A strong ETag becomes
+    weak, as the bytes differ but the content is the same.
+    """
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers or not compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    if encoding is None or response.direct_passthrough:
+        return response
+
+    if response.is_streamed:
+        source = response.response
+        response.response = compress_stream(response.iter_encoded(), encoding, source)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+class StaticAssets:
+    """The files under ``directory``, fingerprinted and compressed once per version.
+
+    ``version()`` is a hash of a file's content for its URL, so that a
+    URL carrying it can be cached by browsers for good. ``get()`` returns
+    the file's bytes compressed with an encoding, compressing them on
+    first use; a changed file (by size or mtime) is read again.
+    """
+
+    def __init__(self, directory, min_bytes=1024):
+        self.directory = directory
+        self.min_bytes = min_bytes
+        self._files = {}  # filename -> ((size, mtime_ns), version, {encoding: StaticAsset})
+        self._lock = threading.Lock()
+
+    def version(self, filename):
+        """Return the content hash of a file, or None if it does not exist."""
+        entry = self._entry(filename)
+        return entry[1] if entry is not None else None
+
+    def get(self, filename, encoding=None):
+        """Return the StaticAsset of a file for encoding, or None if there is no such file."""
+        entry = self._entry(filename)
+        if entry is None:
+            return None
+        _, version, variants = entry
+        identity = variants[None]
+        if encoding is None or not compressible(identity.mimetype) or len(identity.data) < self.min_bytes:
+            return identity
+        asset = variants.get(encoding)
+        if asset is None:
+            quality = STATIC_BROTLI_QUALITY if encoding == 'br' else 9
+            asset = identity._replace(data=compress(identity.data, encoding, quality), encoding=encoding,
+                                      etag=f'{version}-{encoding}')
+            with self._lock:
+                variants[encoding] = asset
+        return asset
+
+    def _entry(self, filename):
+        path = safe_join(self.directory, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._files.get(filename)
+        if entry is not None and entry[0] == key:
+            return entry
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        version = hashlib.sha256(data).hexdigest()[:16]
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        identity = StaticAsset(data, mimetype, None, version, version, stat.st_mtime)
+        entry = (key, version, {None: identity})
+        with self._lock:
+            self._files[filename] = entry
+        return entry
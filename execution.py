@@ -0,0 +1,378 @@
+import os
+import sys
+import io
+import time
+import linecache
+import traceback
+import contextlib
+import contextvars
+import threading
+import base64
+
+# Non-interactive backend for pyplot wherever it is imported in this process
+# (the workers preload it); it is not imported here to keep it out of startup
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# Filename code is compiled under; tracebacks and profiles use it to tell the
+# code's frames from library frames
+USER_FILE = '<code>'
+
+# Streamed output is sent in chunks of at most this many characters...
+STREAM_CHUNK_SIZE = 64 * 1024
+# ...and at least this often (seconds) while the code is running
+STREAM_FLUSH_INTERVAL = 0.1
+
+
+class StreamWriter(io.TextIOBase):
+    """Text stream that forwards everything written to it in chunks.
+
+    ``emit(name, text)`` is called with pieces of at most ``chunk_size``
+    characters whenever that much is pending and whenever the stream is
+    flushed.
+    """
+
+    def __init__(self, name, emit, chunk_size=STREAM_CHUNK_SIZE):
+        super().__init__()
+        self.name = name
+        self._emit = emit
+        self._chunk_size = chunk_size
+        self._pending = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        with self._lock:
+            self._pending.append(text)
+            self._size += len(text)
+            if self._size >= self._chunk_size:
+                self._flush_locked()
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            text = ''.join(self._pending)
+            self._pending = []
+            self._size = 0
+            for start in range(0, len(text), self._chunk_size):
+                self._emit(self.name, text[start:start + self._chunk_size])
+
+
+# The capture that owns output written in the current context (run)
+_current_capture = contextvars.ContextVar('current_capture', default=None)
+# Capture that owns everything else in this process, e.g. threads started by
+# user code in a forked run, which do not inherit the context above
+_process_capture = None
+_routing_lock = threading.Lock()
+_original_show = None
+_pyplot = None
+
+
+def pyplot():
+    """Return matplotlib.pyplot with the non-interactive backend, importing it on first use."""
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot
+        _pyplot = matplotlib.pyplot
+    return _pyplot
+
+
+def _active_capture():
+    return _current_capture.get() or _process_capture
+
+
+class RoutedStream:
+    """Stand-in for sys.stdin/stdout/stderr that uses the active run's stream.
+
+    Installed once per process, so concurrent runs in different threads
+    each see their own input and output instead of swapping the global
+    streams. Outside a run, the stream that was replaced is used.
+    """
+
+    def __init__(self, name, fallback):
+        self._name = name
+        self._fallback = fallback
+
+    def _target(self):
+        capture = _active_capture()
+        return getattr(capture, self._name) if capture is not None else self._fallback
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def readline(self, size=-1):
+        return self._target().readline(size)
+
+    def read(self, size=-1):
+        return self._target().read(size)
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+def _routed_show(*args, **kwargs):
+    capture = _active_capture()
+    if capture is None:
+        return _original_show(*args, **kwargs)
+    capture.show_figure()
+
+
+def install_routing():
+    """Route sys.stdin, sys.stdout, sys.stderr and plt.show to the active run's capture."""
+    global _original_show
+    plt = pyplot()
+    with _routing_lock:
+        if not isinstance(sys.stdin, RoutedStream):
+            sys.stdin = RoutedStream('stdin', sys.stdin)
+        if not isinstance(sys.stdout, RoutedStream):
+            sys.stdout = RoutedStream('stdout', sys.stdout)
+        if not isinstance(sys.stderr, RoutedStream):
+            sys.stderr = RoutedStream('stderr', sys.stderr)
+        if plt.show is not _routed_show:
+            _original_show = plt.show
+            plt.show = _routed_show
+
+
+class OutputCapture:
+    """Capture stdout, stderr and matplotlib figures of executed code.
+
+    By default everything is buffered and returned by ``result()``. With
+    ``on_event`` set, output is instead forwarded as ``(kind, data)``
+    events while the code runs: ``stdout``/``stderr`` text chunks and
+    ``figure`` records.
+
+    Figures are saved to ``figure_store`` (a figures.FigureStore) and
+    recorded as ``{'id', 'url', 'format'}``; without a store they are
+    inlined as PNG data: URLs. At most ``max_figures`` are kept per run.
+    ``figure_timings`` lists (format, seconds) for each figure encoded.
+    An exception the code raised is printed to stderr and kept as
+    ``exception`` (see exception_record()).
+
+    Buffered output is unbounded unless ``run_output`` (an
+    output_log.RunOutput) is given to keep just its start and end.
+
+    The code reads ``stdin`` (a string) as its standard input; without it,
+    reading input hits end of file at once.
+    """
+
+    def __init__(self, on_event=None, figure_store=None, max_figures=None, run_output=None, stdin=None):
+        self.on_event = on_event
+        self.stdin = io.StringIO(stdin or '')
+        self.run_output = run_output
+        if run_output is not None:
+            self.stdout = run_output.stdout
+            self.stderr = run_output.stderr
+        elif on_event is None:
+            self.stdout = io.StringIO()
+            self.stderr = io.StringIO()
+        else:
+            self.stdout = StreamWriter('stdout', on_event)
+            self.stderr = StreamWriter('stderr', on_event)
+        self.figure_store = figure_store
+        if max_figures is None and figure_store is not None:
+            max_figures = figure_store.max_per_run
+        self.max_figures = max_figures
+        self.figure_count = 0
+        self.figures = []
+        self.figure_timings = []
+        self.exception = None
+
+    def add_figure(self, record):
+        if self.on_event is None:
+            self.figures.append(record)
+        else:
+            # Keep the figure in order with the text printed before it
+            self.stdout.flush()
+            self.stderr.flush()
+            self.on_event('figure', record)
+
+    def add_exception(self, exc, filename=USER_FILE):
+        """Report an exception raised by code compiled under filename."""
+        # Frames of the machinery that ran the code are of no interest
+        tb = _user_traceback(exc, filename)
+        self.stderr.write(''.join(traceback.format_exception(type(exc), exc, tb)))
+        self.exception = exception_record(exc, filename)
+        if self.on_event is not None:
+            self.stdout.flush()
+            self.stderr.flush()
+            self.on_event('exception', self.exception)
+
+    def show_figure(self):
+        """Capture the current matplotlib figure (replaces plt.show)."""
+        plt = pyplot()
+        fig = plt.gcf()
+        try:
+            self.figure_count += 1
+            if self.max_figures is not None and self.figure_count > self.max_figures:
+                if self.figure_count == self.max_figures + 1:
+                    self.stderr.write(f"Figure limit reached ({self.max_figures} per run), "
+                                      "further figures are not shown\n")
+                return
+            start = time.perf_counter()
+            if self.figure_store is not None:
+                record = self.figure_store.render(fig)
+            else:
+                buf = io.BytesIO()
+                fig.savefig(buf, format='png')
+                img_data = base64.b64encode(buf.getvalue()).decode('utf-8')
+                record = {'id': None, 'url': 'data:image/png;base64,' + img_data, 'format': 'png'}
+            self.figure_timings.append((record['format'], time.perf_counter() - start))
+            self.add_figure(record)
+        finally:
+            plt.close(fig)
+
+    @contextlib.contextmanager
+    def capture(self, process_wide=False):
+        """Route output of the current context to this capture.
+
+        With ``process_wide`` the capture also receives output from every
+        other thread of the process; use it when the process serves a
+        single run. Note that pyplot's current figure is process-global, so
+        runs sharing a process can still see each other's figures.
+        """
+        global _process_capture
+        install_routing()
+        token = _current_capture.set(self)
+        previous = _process_capture
+        if process_wide:
+            _process_capture = self
+
+        # Periodically push out partial output of long-running code
+        stop_flushing = threading.Event()
+        if self.on_event is not None:
+            threading.Thread(target=self._flush_periodically, args=(stop_flushing,), daemon=True).start()
+
+        try:
+            yield self
+        finally:
+            stop_flushing.set()
+            _current_capture.reset(token)
+            if process_wide:
+                _process_capture = previous
+
+    def _flush_periodically(self, stop):
+        while not stop.wait(STREAM_FLUSH_INTERVAL):
+            self.stdout.flush()
+            self.stderr.flush()
+
+    def close(self):
+        """Send any output still buffered in streaming mode."""
+        self.stdout.flush()
+        self.stderr.flush()
+
+    def result(self):
+        """Return the captured output in the /api/run response format."""
+        result = {
+            'stdout': self.stdout.getvalue(),
+            'stderr': self.stderr.getvalue(),
+            'figures': self.figures
+        }
+        truncated = self.run_output.truncated() if self.run_output is not None else None
+        if truncated:
+            result['truncated'] = truncated
+        if self.exception is not None:
+            result['exception'] = self.exception
+        return result
+
+
+def register_source(code, filename=USER_FILE):
+    """Make the source of code run under a virtual filename known to linecache.
+
+    Tracebacks and profiles then show its lines although no file has them.
+    """
+    # Without an mtime, linecache.checkcache() keeps the entry
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+
+
+def compile_code(code, filename=USER_FILE):
+    """Compile code for exec() under a virtual filename (see register_source())."""
+    register_source(code, filename)
+    return compile(code, filename, 'exec')
+
+
+def _user_traceback(exc, filename):
+    """Return exc's traceback from the first frame of the code compiled under filename on."""
+    tb = exc.__traceback__
+    while tb is not None and tb.tb_frame.f_code.co_filename != filename:
+        tb = tb.tb_next
+    if tb is None and not isinstance(exc, SyntaxError):
+        return exc.__traceback__  # Not raised by the code; show where it was
+    # Code that does not compile has no frames; the message points at the error
+    return tb
+
+
+def exception_record(exc, filename=USER_FILE):
+    """Describe an exception for the UI.
+
+    Returns ``{'type', 'message', 'line', 'column', 'frames'}``: ``line``
+    (and, for syntax errors, ``column``) is where in the code compiled
+    under filename the exception came from, None if not from the code.
+    ``frames`` run from the code's outermost call to where the exception
+    was raised, each ``{'file', 'line', 'function', 'source', 'user'}``,
+    ``user`` telling whether it is a frame of the code.
+    """
+    frames = [{'file': frame.filename, 'line': frame.lineno, 'function': frame.name, 'source': frame.line,
+               'user': frame.filename == filename}
+              for frame in traceback.extract_tb(_user_traceback(exc, filename))]
+    line = next((frame['line'] for frame in reversed(frames) if frame['user']), None)
+    column = None
+    message = str(exc)
+    if isinstance(exc, SyntaxError):
+        message = exc.msg
+        if exc.filename == filename:
+            line, column = exc.lineno, exc.offset
+    name = type(exc).__qualname__
+    if type(exc).__module__ not in ('builtins', '__main__'):
+        name = f'{type(exc).__module__}.{name}'
+    return {'type': name, 'message': message, 'line': line, 'column': column, 'frames': frames}
+
+
+def execute(code, output=None, process_wide=False, namespace=None, profiler=None, filename=USER_FILE,
+            compiled=None):
+    """Execute code, capturing its output.
+
+    Runs in a fresh namespace unless ``namespace`` (a globals dict to keep
+    between calls) is given, and under ``profiler`` (a profiler.Profiler)
+    if one is given. The code is compiled under ``filename``, unless
+    ``compiled`` is its code object already (see compile_cache).
+    """
+    output = output or OutputCapture()
+    try:
+        with output.capture(process_wide=process_wide):
+            # Create a local namespace for execution
+            local_vars = {} if namespace is None else namespace
+
+            # Execute the code
+            if compiled is None:
+                compiled = compile_code(code, filename)
+            else:
+                register_source(code, filename)
+            if profiler is not None:
+                profiler.run(compiled, local_vars)
+            else:
+                exec(compiled, local_vars)
+    except SystemExit as e:
+        # sys.exit() ends the run normally; like the interpreter, print a non-numeric exit code
+        if e.code is not None and not isinstance(e.code, int):
+            output.stderr.write(f'{e.code}\n')
+    except (Exception, KeyboardInterrupt) as e:
+        # KeyboardInterrupt is how a session cell is stopped
+        output.add_exception(e, filename)
+    output.close()
+    return output
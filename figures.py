@@ -0,0 +1,98 @@
+import os
+import io
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+FIGURE_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml', 'webp': 'image/webp'}
+
+
+class FigureStore:
+    """Render matplotlib figures and keep them on disk by content hash.
+
+    Runs save each figure once under ``<sha256>.<format>`` and refer to it
+    by that name, so output carries a short ID instead of inline image
+    data and identical figures are stored (and cached by browsers) once.
+    The store is passed to the worker processes, which write the files
+    themselves; ``prune()`` keeps the directory under ``max_bytes``.
+    """
+
+    def __init__(self, directory, fmt='png', dpi=100, png_compression=6, webp_quality=80,
+                 max_per_run=20, max_bytes=256 * 1024 * 1024):
+        if fmt not in FIGURE_FORMATS:
+            raise ValueError(f"Unsupported figure format {fmt!r}, use one of {', '.join(FIGURE_FORMATS)}")
+        self.directory = directory
+        self.format = fmt
+        self.dpi = dpi
+        self.png_compression = png_compression
+        self.webp_quality = webp_quality
+        self.max_per_run = max_per_run
+        self.max_bytes = max_bytes
+        self._last_prune = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def render(self, fig):
+        """Save fig and return its figure record ({'id', 'url', 'format'})."""
+        buf = io.BytesIO()
+        fig.savefig(buf, format=self.format, dpi=self.dpi, **self._save_options())
+        return self.put(buf.getvalue(), self.format)
+
+    def _save_options(self):
+        if self.format == 'png':
+            return {'pil_kwargs': {'compress_level': self.png_compression}}
+        if self.format == 'webp':
+            if self.webp_quality >= 100:
+                return {'pil_kwargs': {'lossless': True}}
+            return {'pil_kwargs': {'quality': self.webp_quality}}
+        # Leave out the creation date so identical figures hash the same
+        return {'metadata': {'Date': None}}
+
+    def put(self, data, fmt):
+        """Store image bytes and return their figure record."""
+        name = f"{hashlib.sha256(data).hexdigest()}.{fmt}"
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.utime(path)  # Recently used, keep it when pruning
+        else:
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return figure_record(name)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def prune(self, interval=60):
+        """Delete the least recently used figures beyond max_bytes.
+
+        Does nothing if the last prune was less than ``interval`` seconds ago.
+        """
+        now = time.time()
+        if now - self._last_prune < interval:
+            return
+        self._last_prune = now
+
+        entries, total = [], 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def figure_record(name):
+    """Describe a stored figure the way run results and events refer to it."""
+    return {'id': name, 'url': f'/api/figures/{name}', 'format': name.rsplit('.', 1)[-1]}
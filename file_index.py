@@ -0,0 +1,183 @@
+import os
+import time
+import uuid
+import bisect
+import hashlib
+import logging
+import threading
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+# Directories whose files are never listed (besides hidden ones)
+SKIPPED_DIRECTORIES = {'__pycache__'}
+
+
+class FileIndex:
+    """Recursive listing of the files under ``root`` ending in ``suffix``.
+
+    Each entry carries the file's path (relative to ``root``, with '/'
+    separators), size, mtime and the SHA-256 of its content. The directory
+    is walked once; after that watchdog's change notifications keep the
+    index current, so a listing is a slice of a sorted list rather than a
+    directory walk, and a prefix search is two bisections. ``etag()``
+    changes whenever the index does. Without watchdog a listing rescans
+    the directory if the last scan is older than ``rescan_interval``
+    seconds.
+    """
+
+    def __init__(self, root, suffix='.py', rescan_interval=2):
+        self.root = os.path.abspath(root)
+        self.suffix = suffix
+        self.rescan_interval = rescan_interval
+        self._entries = {}  # path -> {'path', 'size', 'mtime', 'hash'}
+        self._paths = []  # sorted
+        self._lock = threading.Lock()
+        # Refreshes hash files outside _lock but must not overtake each other
+        self._refresh_lock = threading.Lock()
+        # Tags of another process (or an earlier run of this one) never match
+        self._generation = uuid.uuid4().hex[:8]
+        self._version = 0
+        self._scanned_at = 0
+        self._observer = None
+        if Observer is not None:
+            # Watch before scanning so that no change falls in between
+            self._observer = Observer()
+            self._observer.schedule(_ChangeHandler(self), self.root, recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+        self.refresh()
+
+    def etag(self):
+        """Return a tag that changes whenever the listing does."""
+        self._rescan_if_stale()
+        with self._lock:
+            return f'{self._generation}-{self._version}'
+
+    def list(self, prefix='', offset=0, limit=None):
+        """Return (entries, total): a page of the entries whose path starts with prefix.
+
+        ``total`` counts all matching entries; the page holds up to
+        ``limit`` of them (all by default), starting at ``offset``.
+        """
+        self._rescan_if_stale()
+        with self._lock:
+            start = bisect.bisect_left(self._paths, prefix)
+            end = bisect.bisect_left(self._paths, prefix + '\U0010ffff') if prefix else len(self._paths)
+            first = min(start + offset, end)
+            last = end if limit is None else min(first + limit, end)
+            # Entries are replaced, never changed, so they can be handed out
+            return [self._entries[path] for path in self._paths[first:last]], end - start
+
+    def refresh(self, path=None):
+        """Bring the index up to date with a file or directory that changed (all of root by default)."""
+        relative = '' if path is None else self._relative(path)
+        if relative is None:
+            return
+        with self._refresh_lock:
+            self._refresh(relative)
+
+    def _refresh(self, relative):
+        found = {}
+        full = os.path.join(self.root, relative)
+        if os.path.isdir(full):
+            for dirpath, dirnames, filenames in os.walk(full):
+                dirnames[:] = [name for name in dirnames if self._listed(name)]
+                for name in filenames:
+                    if self._listed(name) and name.endswith(self.suffix):
+                        self._add_entry(found, os.path.join(dirpath, name))
+        elif relative.endswith(self.suffix):
+            self._add_entry(found, full)
+
+        with self._lock:
+            changed = False
+            for old in self._under_locked(relative):
+                if old not in found:
+                    del self._entries[old]
+                    del self._paths[bisect.bisect_left(self._paths, old)]
+                    changed = True
+            for new, entry in found.items():
+                previous = self._entries.get(new)
+                if previous is None:
+                    bisect.insort(self._paths, new)
+                elif previous == entry:
+                    continue
+                self._entries[new] = entry
+                changed = True
+            if changed:
+                self._version += 1
+            if not relative:
+                self._scanned_at = time.monotonic()
+
+    def close(self):
+        """Stop watching the directory."""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def _rescan_if_stale(self):
+        if Observer is None and time.monotonic() - self._scanned_at > self.rescan_interval:
+            self.refresh()
+
+    def _listed(self, name):
+        return not name.startswith('.') and name not in SKIPPED_DIRECTORIES
+
+    def _relative(self, path):
+        """Return path relative to root with '/' separators, or None if it is never listed."""
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative == os.curdir:
+            return ''
+        parts = relative.split(os.sep)
+        if parts[0] == os.pardir or not all(self._listed(part) for part in parts):
+            return None
+        return '/'.join(parts)
+
+    def _under_locked(self, relative):
+        """Return the indexed paths at or below relative."""
+        if not relative:
+            return list(self._paths)
+        paths = [relative] if relative in self._entries else []
+        # Everything below a directory sorts between 'dir/' and 'dir0' ('0' follows '/')
+        start = bisect.bisect_left(self._paths, relative + '/')
+        end = bisect.bisect_left(self._paths, relative + '0')
+        return paths + self._paths[start:end]
+
+    def _add_entry(self, found, full):
+        """Add the entry for a file to found, hashing it only if it changed."""
+        relative = self._relative(full)
+        try:
+            stat = os.stat(full)
+            previous = self._entries.get(relative)
+            if previous is not None and (previous['size'], previous['mtime']) == (stat.st_size, stat.st_mtime):
+                found[relative] = previous
+                return
+            with open(full, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return  # Removed meanwhile
+        found[relative] = {'path': relative, 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': digest}
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """Passes watchdog's change notifications on to the index."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        # A directory is modified whenever a file in it is; the file's own event covers that
+        if event.event_type in ('opened', 'closed_no_write') or (event.is_directory and event.event_type == 'modified'):
+            return
+        try:
+            self.index.refresh(event.src_path)
+            if event.event_type == 'moved':
+                self.index.refresh(event.dest_path)
+        except Exception as e:
+            logger.warning(f"Could not update the file index for {event.src_path}: {str(e)}")
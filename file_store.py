@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Bytes copied at a time when streaming uploads and history objects
+BLOCK_SIZE = 64 * 1024
+
+
+# Upload target path -> [lock, number of uploads using it]
+_upload_locks = {}
+_upload_locks_lock = threading.Lock()
+
+
+class RangeMismatchError(Exception):
+    """Raised when an upload chunk does not continue where the upload stands.
+
+    The argument is the offset the next chunk has to start at.
+    """
+
+
+def _fsync_directory(directory):
+    """Make a rename in directory durable (where directories can be opened)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _hidden_path(path, suffix):
+    """A file next to path that file listings skip."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.{suffix}')
+
+
+def atomic_write(path, data):
+    """Replace the file at path with data (bytes), so that readers see either all of it or the old file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = _hidden_path(path, f'{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(os.path.dirname(path) or '.')
+
+
+@contextmanager
+def _upload_lock(path):
+    """Hold the lock of uploads to path, so that their chunks do not interleave."""
+    path = os.path.abspath(path)
+    with _upload_locks_lock:
+        entry = _upload_locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _upload_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _upload_locks[path]
+
+
+def write_range(path, stream, start, total, max_bytes):
+    """Write an upload chunk read from stream at offset start; return the bytes received so far.
+
+    Chunks are collected in a hidden file next to path, which replaces
+    path once all ``total`` bytes have arrived (with ``total`` None, once
+    the stream ends). A chunk starting at 0 starts the upload over; any
+    other has to start where the upload stands, or RangeMismatchError says
+    where that is. Raises ValueError for a chunk beyond ``total`` or an
+    upload over ``max_bytes``. Chunks for the same path are written one at
+    a time.
+    """
+    limit = max_bytes if total is None else total
+    if limit > max_bytes:
+        raise ValueError(f"File is larger than {max_bytes} bytes")
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with _upload_lock(path):
+        return _write_chunk(path, stream, start, total, limit, max_bytes)
+
+
+def _write_chunk(path, stream, start, total, limit, max_bytes):
+    """write_range() of a chunk, under the upload lock of path."""
+    upload_path = _hidden_path(path, 'upload')
+    if start == 0:
+        f = open(upload_path, 'wb')
+    else:
+        try:
+            f = open(upload_path, 'r+b')
+        except FileNotFoundError:
+            raise RangeMismatchError(0) from None
+    with f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() != start:
+            raise RangeMismatchError(f.tell())
+        received = start
+        while True:
+            block = stream.read(BLOCK_SIZE)
+            if not block:
+                break
+            received += len(block)
+            if received > limit:
+                f.truncate(start)
+                if start == 0:
+                    os.remove(upload_path)
+                raise ValueError(f"Chunk goes beyond the file's {limit} bytes" if total is not None
+                                 else f"File is larger than {max_bytes} bytes")
+            f.write(block)
+        complete = total is None or received == total
+        if complete:
+            f.flush()
+            os.fsync(f.fileno())
+    if complete:
+        os.replace(upload_path, path)
+        _fsync_directory(os.path.dirname(path) or '.')
+    return received
+
+
+def file_hash(path):
+    """Return the SHA-256 of a file's content, read a block at a time."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def apply_line_patch(text, patch):
+    """Return text with a line patch applied; raises ValueError for a malformed patch.
+
+    Lines are the pieces of text between '\\n's. A patch is a list of hunks
+    ``{"start": line, "delete": count, "insert": [lines]}``, each
+    replacing ``delete`` lines from ``start`` (0-based, counted in the
+    original text) with the ``insert`` lines, in order and not overlapping.
+    """
+    lines = text.split('\n')
+    if not isinstance(patch, list):
+        raise ValueError('patch must be a list of hunks')
+    result, position = [], 0
+    for hunk in patch:
+        try:
+            start, delete, insert = hunk['start'], hunk['delete'], hunk['insert']
+        except (TypeError, KeyError):
+            raise ValueError('hunks need start, delete and insert') from None
+        if not (isinstance(start, int) and isinstance(delete, int) and isinstance(insert, list)
+                and all(isinstance(line, str) for line in insert)):
+            raise ValueError('start and delete must be integers and insert a list of strings')
+        if start < position or delete < 0 or start + delete > len(lines):
+            raise ValueError('hunks must be in order, not overlap and lie within the file')
+        result += lines[position:start]
+        result += insert
+        position = start + delete
+    result += lines[position:]
+    return '\n'.join(result)
+
+
+class FileHistory:
+    """Earlier versions of the files under ``root``, stored in ``directory``.
+
+    Every version is an object named by the SHA-256 of its content and
+    compressed with zlib, so content saved again, in the same or any other
+    file, is stored only once. A log per file lists its versions; saving
+    unchanged content adds none. Beyond ``max_versions`` per file the
+    oldest are forgotten, and objects no log refers to any more are
+    deleted.
+    """
+
+    def __init__(self, root, directory, max_versions=50):
+        self.root = os.path.abspath(root)
+        self.directory = directory
+        self.max_versions = max_versions
+        self._lock = threading.Lock()
+        self._last_collect = 0
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'log'), exist_ok=True)
+
+    def record(self, path):
+        """Add the current content of a file under root as its newest version; return its hash."""
+        digest = self._store(path)
+        log_path = self._log_path(path)
+        with self._lock:
+            versions = self._read_log(log_path)
+            if versions and versions[-1]['hash'] == digest:
+                return digest
+            versions.append({'hash': digest, 'size': os.path.getsize(path), 'time': time.time()})
+            dropped = len(versions) > self.max_versions
+            versions = versions[-self.max_versions:]
+            atomic_write(log_path, ''.join(json.dumps(version) + '\n' for version in versions).encode())
+        if dropped:
+            self.collect()
+        return digest
+
+    def versions(self, path):
+        """Return the versions of a file, newest first: {'hash', 'size', 'time'}."""
+        with self._lock:
+            return self._read_log(self._log_path(path))[::-1]
+
+    def read(self, path, digest):
+        """Return the content (bytes) of a version of a file, or None if it has no such version."""
+        if not any(version['hash'] == digest for version in self.versions(path)):
+            return None
+        try:
+            with open(self._object_path(digest), 'rb') as f:
+                return zlib.decompress(f.read())
+        except (OSError, zlib.error) as e:
+            logger.warning(f"Could not read version {digest} of {path}: {str(e)}")
+            return None
+
+    def collect(self, interval=60):
+        """Delete the objects no log refers to.
+
+        Does nothing if the last collection was less than ``interval``
+        seconds ago.
+        """
+        now = time.time()
+        if now - self._last_collect < interval:
+            return
+        self._last_collect = now
+        with self._lock:
+            referenced = set()
+            for dirpath, _, filenames in os.walk(os.path.join(self.directory, 'log')):
+                for name in filenames:
+                    if name.endswith('.jsonl'):
+                        referenced.update(version['hash'] for version in self._read_log(os.path.join(dirpath, name)))
+            objects = os.path.join(self.directory, 'objects')
+            for prefix in os.listdir(objects):
+                for name in os.listdir(os.path.join(objects, prefix)):
+                    if name in referenced or name.endswith('.tmp'):
+                        continue
+                    object_path = os.path.join(objects, prefix, name)
+                    try:
+                        # Recently stored objects may belong to a save that has not logged them yet
+                        if now - os.path.getmtime(object_path) > interval:
+                            os.remove(object_path)
+                    except OSError:
+                        pass
+
+    def _store(self, path):
+        """Store a file's content as an object unless it is already; return its hash."""
+        digest = file_hash(path)
+        object_path = self._object_path(digest)
+        if os.path.exists(object_path):
+            try:
+                os.utime(object_path)  # In use again, so collect() keeps it
+                return digest
+            except FileNotFoundError:
+                pass  # Collected meanwhile
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path = f'{object_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        compressor = zlib.compressobj(6)
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as f:
+            for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+                f.write(compressor.compress(block))
+            f.write(compressor.flush())
+            f.flush()
+            os.fsync(f.fileno())
+        # Content of another save that raced this one is the same, so replacing it is harmless
+        os.replace(tmp_path, object_path)
+        return digest
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def _log_path(self, path):
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        return os.path.join(self.directory, 'log', relative + '.jsonl')
+
+    def _read_log(self, log_path):
+        try:
+            with open(log_path) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
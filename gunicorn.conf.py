@@ -0,0 +1,43 @@
+"""Production server settings: gunicorn -c gunicorn.conf.py
+
+Jobs, sessions, the worker pool and the in-memory caches live in the web
+worker process, so the default is one web worker serving many requests on
+threads; code runs in the execution worker pool either way. More web
+workers only suit deployments that do not use /api/jobs or /api/sessions
+(a job or session is known to one web worker only), and each starts its
+own execution pool.
+
+With WEB_WORKER_CLASS=gevent (pip install gevent) requests are greenlets instead of threads,
+so thousands of long runs can be waited on without an OS thread each.
+Linting and formatting then hold up other requests while they run.
+"""
+import os
+
+wsgi_app = 'app:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+workers = int(os.environ.get('WEB_WORKERS', 1))  # web worker processes
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')  # 'gthread' or 'gevent'
+threads = int(os.environ.get('WEB_THREADS', 64))  # concurrent requests per gthread worker
+worker_connections = int(os.environ.get('WEB_CONNECTIONS', 1000))  # concurrent requests per gevent worker
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))  # seconds an idle keep-alive connection is kept
+# Seconds a silent web worker is given before it is restarted; runs do not block the worker's heartbeat
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# Seconds in-flight requests and running jobs get to finish on shutdown (SIGTERM)
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', int(os.environ.get('MAX_EXECUTION_TIME', 30)) + 10))
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-') or None  # '' turns access logging off
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+def post_worker_init(worker):
+    """Start warming the web worker once it is ready to serve."""
+    import app
+    if app.PREWARM:
+        app.prewarm()
+
+
+def worker_exit(server, worker):
+    """After in-flight requests are done, let running jobs finish and stop the execution workers."""
+    import app
+    app.shutdown(graceful_timeout)
@@ -0,0 +1,195 @@
+import time
+import uuid
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+
+from metrics import QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Job states; the last three are final
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when no more jobs can be queued."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, fn, priority, sequence):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.priority = priority
+        self.sequence = sequence
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'priority': self.priority,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """Bounded priority queue of runs executed by background threads.
+
+    ``submit(fn, priority)`` queues ``fn(cancel_event)``, whose return
+    value becomes the job's result, and returns at once; higher priorities
+    run first, equal priorities in submission order. When ``max_queued``
+    jobs are waiting, submit raises QueueFullError with an estimate of
+    when to retry, as it does once the queue is shut down. Finished jobs
+    are kept for ``retention`` seconds.
+    """
+
+    def __init__(self, workers, max_queued, retention=600):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self._heap = []  # (-priority, sequence, job)
+        self._sequence = 0
+        self._jobs = OrderedDict()  # job id -> job, in submission order
+        self._running = 0
+        self._average_seconds = 1.0  # moving average of job run times
+        self._cond = threading.Condition()
+        self._closed = False
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+
+    def submit(self, fn, priority=0):
+        with self._cond:
+            self._purge_locked()
+            if self._closed or len(self._heap) >= self.max_queued:
+                raise QueueFullError(self._retry_after_locked())
+            job = Job(fn, priority, self._sequence)
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (-priority, job.sequence, job))
+            self._sequence += 1
+            self._cond.notify()
+            return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """Return how many queued jobs will run before job, or None if not queued."""
+        with self._cond:
+            if job.status != QUEUED:
+                return None
+            return sum(1 for entry in self._heap if entry[:2] < (-job.priority, job.sequence))
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; return it, or None if unknown.
+
+        Queued jobs are dropped at once. Running jobs are asked to stop
+        through their cancel event and finish as cancelled when they do.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                self._heap = [entry for entry in self._heap if entry[2] is not job]
+                heapq.heapify(self._heap)
+                self._finish_locked(job, CANCELLED)
+            return job
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._heap),
+                'running': self._running,
+                'max_queued': self.max_queued,
+                'workers': self.workers,
+                'average_run_seconds': round(self._average_seconds, 3)
+            }
+
+    def shutdown(self, timeout=None):
+        """Stop starting jobs; wait up to ``timeout`` seconds for running ones.
+
+        Jobs still queued are cancelled. Returns whether no job is still
+        running.
+        """
+        deadline = time.monotonic() + (timeout or 0)
+        with self._cond:
+            self._closed = True
+            for _, _, job in self._heap:
+                job.cancel_event.set()
+                job.error = 'Server shutting down'
+                self._finish_locked(job, CANCELLED)
+            self._heap = []
+            self._cond.notify_all()
+            while self._running and timeout:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return not self._running
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                job = heapq.heappop(self._heap)[2]
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._running += 1
+            QUEUE_WAIT_SECONDS.observe(job.started_at - job.submitted_at, 'job')
+
+            status = DONE
+            try:
+                job.result = job.fn(job.cancel_event)
+                if job.cancel_event.is_set():
+                    status = CANCELLED
+            except Exception as e:
+                logger.exception("Job %s failed", job.id)
+                job.error = str(e)
+                status = FAILED
+
+            with self._cond:
+                self._running -= 1
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * (time.time() - job.started_at)
+                self._finish_locked(job, status)
+                self._cond.notify_all()  # For shutdown() waiting on running jobs
+
+    def _finish_locked(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job.fn = None  # Let go of the code
+
+    def _purge_locked(self):
+        """Forget finished jobs older than the retention period."""
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.status in FINISHED and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _retry_after_locked(self):
+        """Estimate the seconds until a queue slot frees up."""
+        return max(1, round(self._average_seconds / max(self.workers, 1)))
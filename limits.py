@@ -0,0 +1,174 @@
+import os
+import signal
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _address_space_bytes():
+    """Return this process's current virtual memory size, or 0 if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _user_process_count():
+    """Count the processes of the current user (Linux only, else 0)."""
+    uid = os.getuid()
+    count = 0
+    try:
+        for name in os.listdir('/proc'):
+            if name.isdigit():
+                try:
+                    count += os.stat('/proc/' + name).st_uid == uid
+                except OSError:
+                    pass
+    except OSError:
+        return 0
+    return count
+
+
+class RunLimits:
+    """Resource limits enforced on every forked run.
+
+    ``cpu_seconds`` and ``memory_mb`` become RLIMIT_CPU and RLIMIT_AS of
+    the run. The memory limit is added on top of what the run inherits
+    from its worker, so preloaded modules do not count against it.
+    ``max_processes`` caps the processes a run may start (RLIMIT_NPROC,
+    which is per user and not enforced for root).
+
+    With ``cgroup_root`` set to a writable cgroup v2 directory, each
+    worker also gets a leaf cgroup there with memory.max and pids.max set,
+    which the run joins. That accounts memory the rlimits cannot see,
+    also stops root, and lets the pool kill a run's whole process tree
+    at once through cgroup.kill.
+    """
+
+    def __init__(self, cpu_seconds=None, memory_mb=None, max_processes=None, cgroup_root=None):
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_processes = max_processes
+        self.cgroup_root = cgroup_root
+
+    def leaf(self, worker_pid):
+        """Return the cgroup directory of a worker's runs, or None."""
+        if not self.cgroup_root:
+            return None
+        return os.path.join(self.cgroup_root, f'worker-{worker_pid}')
+
+    def create_leaf(self, worker_pid):
+        """Create and configure a worker's cgroup; return its path or None."""
+        path = self.leaf(worker_pid)
+        if path is None:
+            return None
+        try:
+            os.makedirs(path, exist_ok=True)
+            if self.memory_mb:
+                self._write(path, 'memory.max', str(self.memory_mb * 1024 * 1024))
+                self._write(path, 'memory.swap.max', '0', required=False)
+            if self.max_processes:
+                self._write(path, 'pids.max', str(self.max_processes))
+        except OSError as e:
+            logger.warning(f"Could not set up cgroup {path}, using rlimits only: {e}")
+            return None
+        return path
+
+    def remove_leaf(self, worker_pid):
+        path = self.leaf(worker_pid)
+        if path is not None:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+    def oom_kills(self, path):
+        """Return how many times the kernel OOM-killed a process in a cgroup."""
+        try:
+            with open(os.path.join(path, 'memory.events')) as f:
+                for line in f:
+                    name, value = line.split()
+                    if name == 'oom_kill':
+                        return int(value)
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def apply(self, leaf=None, cpu=True):
+        """Limit the current process; called in a run right after the fork.
+
+        Pass ``cpu=False`` for processes that run several pieces of code
+        and budget CPU time per piece with ``allow_cpu()`` instead.
+        """
+        if leaf is not None:
+            try:
+                self._write(leaf, 'cgroup.procs', str(os.getpid()))
+            except OSError as e:
+                logger.warning(f"Could not join cgroup {leaf}: {e}")
+        if resource is None:
+            return
+
+        if self.cpu_seconds and cpu:
+            # SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+            self._setrlimit(resource.RLIMIT_CPU, self.cpu_seconds, self.cpu_seconds + 1)
+        if self.memory_mb:
+            limit = _address_space_bytes() + self.memory_mb * 1024 * 1024
+            self._setrlimit(resource.RLIMIT_AS, limit, limit)
+        if self.max_processes and os.getuid() != 0:
+            # Per user, so allow for the processes the user already has
+            limit = _user_process_count() + self.max_processes
+            self._setrlimit(resource.RLIMIT_NPROC, limit, limit)
+        # Do not leave core files behind when a limit kills the run
+        self._setrlimit(resource.RLIMIT_CORE, 0, 0)
+
+    def allow_cpu(self, seconds=None):
+        """Let the current process use ``seconds`` more CPU time from now on.
+
+        Sets the soft RLIMIT_CPU only, so the limit can be moved again;
+        None lifts it. The kernel sends SIGXCPU once the time is used.
+        """
+        if resource is None or not self.cpu_seconds:
+            return
+        limit = resource.RLIM_INFINITY
+        if seconds is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            limit = int(usage.ru_utime + usage.ru_stime) + seconds
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        if hard != resource.RLIM_INFINITY:
+            limit = hard if limit == resource.RLIM_INFINITY else min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+    def describe(self, status, oom_killed=False):
+        """Return (reason, message) for a run that died of a limit, or None."""
+        if oom_killed:
+            return 'memory', f"Memory limit exceeded ({self.memory_mb}MB)"
+        if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGXCPU:
+            return 'cpu', f"CPU time limit exceeded ({self.cpu_seconds} seconds)"
+        return None
+
+    @staticmethod
+    def _write(path, name, value, required=True):
+        try:
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(value)
+        except OSError:
+            if required:
+                raise
+
+    @staticmethod
+    def _setrlimit(kind, soft, hard):
+        current_soft, current_hard = resource.getrlimit(kind)
+        if current_hard != resource.RLIM_INFINITY:
+            # An unprivileged process cannot raise its hard limit
+            hard = min(hard, current_hard)
+            soft = min(soft, hard)
+        try:
+            resource.setrlimit(kind, (soft, hard))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not set resource limit {kind}: {e}")
@@ -0,0 +1,363 @@
+import os
+import ast
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import LINT_SECONDS, FORMAT_SECONDS, CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Module name and path under which submitted code is linted
+LINT_MODULE = 'submitted_code'
+LINT_FILENAME = '<submitted_code>'
+
+# How many full lint results, formatted sources and function bodies to remember
+MAX_REMEMBERED_RESULTS = 256
+MAX_REMEMBERED_BLOCKS = 4096
+
+# Body that stands in for a function whose diagnostics are already known;
+# astroid infers calls to it as uninferable, so it adds no errors of its own
+STUB_BODY = 'raise NotImplementedError'
+
+# pyflakes messages reported by the fast tier; the others are style warnings
+# that the errors-only pylint pass would not report either
+PYFLAKES_ERRORS = {'UndefinedName', 'UndefinedLocal', 'UndefinedExport', 'DuplicateArgument',
+                   'ReturnOutsideFunction', 'YieldOutsideFunction', 'ContinueOutsideLoop',
+                   'BreakOutsideLoop', 'DefaultExceptNotLast', 'TwoStarredExpressions',
+                   'TooManyExpressionsInStarredAssignment', 'ForwardAnnotationSyntaxError',
+                   'StringDotFormatMissingArgument', 'PercentFormatMissingArgument'}
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def _symbol(name):
+    """Turn a pyflakes message class name into a pylint-style symbol."""
+    return ''.join('-' + c.lower() if c.isupper() else c for c in name).lstrip('-')
+
+
+class BoundedMemo:
+    """Thread-safe mapping that forgets its least recently used entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_locked(key, value)
+
+    def get_or_create(self, key, factory):
+        """Return the value for key, storing factory() first if there is none."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                value = factory()
+                self._put_locked(key, value)
+            else:
+                self._entries.move_to_end(key)
+            return value
+
+    def discard(self, key, value):
+        """Forget key if it still maps to value."""
+        with self._lock:
+            if self._entries.get(key) is value:
+                del self._entries[key]
+
+    def _put_locked(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# A top-level function whose body (lines body_start..end, 1-based) can be
+# swapped for a stub; key identifies the body and everything around it,
+# uses names the top-level functions it calls or refers to (directly or
+# through others), and pinned tells whether module-level code reaches it
+FunctionBlock = namedtuple('FunctionBlock', 'body_start end indent key name uses pinned')
+
+
+def _names(nodes):
+    """Return the names used anywhere in nodes."""
+    return {child.id for node in nodes for child in ast.walk(node) if isinstance(child, ast.Name)}
+
+
+def function_blocks(code):
+    """Split code into top-level functions whose diagnostics can be reused.
+
+    Each block's key hashes its body and the bodies of the functions it
+    uses together with a skeleton of the whole module in which every
+    function body is stubbed out. Editing a body therefore only changes
+    the keys of that function and of those that use it, while editing
+    anything at module level (imports, globals, classes, signatures)
+    changes them all. Functions that declare ``global`` or ``nonlocal``
+    names are never stubbed, as they count as module level.
+    Returns [] for code that does not parse.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return []
+
+    lines = code.splitlines(keepends=True)
+    candidates = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        first = node.body[0]
+        # The body must start on a line of its own to be replaced by whole lines
+        if first.lineno == node.lineno or lines[first.lineno - 1][:first.col_offset].strip():
+            continue
+        # Names a body binds through global or nonlocal are part of the module's state
+        if any(isinstance(child, (ast.Global, ast.Nonlocal)) for child in ast.walk(node)):
+            continue
+        candidates.append(node)
+
+    # Which candidates each body uses, and which the module-level code (the skeleton) uses
+    functions = {node.name for node in candidates}
+    direct, bodies = {}, {}
+    for node in candidates:
+        direct.setdefault(node.name, set()).update(_names(node.body) & functions)
+        bodies[node.name] = bodies.get(node.name, '') + ''.join(lines[node.body[0].lineno - 1:node.end_lineno])
+    module_level = set()
+    for node in tree.body:
+        if node in candidates:
+            parts = [*node.decorator_list, node.args] + ([node.returns] if node.returns else [])
+        else:
+            parts = [node]
+        module_level |= _names(parts) & functions
+
+    def reach(names):
+        seen, pending = set(), list(names)
+        while pending:
+            name = pending.pop()
+            if name not in seen:
+                seen.add(name)
+                pending.extend(direct[name])
+        return frozenset(seen)
+
+    # Module skeleton: every candidate body replaced by a one-line stub
+    skeleton, position = [], 0
+    for node in candidates:
+        skeleton.extend(lines[position:node.body[0].lineno - 1])
+        skeleton.append(' ' * node.body[0].col_offset + STUB_BODY + '\n')
+        position = node.end_lineno
+    skeleton.extend(lines[position:])
+    context = code_hash(''.join(skeleton))
+
+    pinned = reach(module_level)
+    blocks = []
+    for node in candidates:
+        uses = reach(direct[node.name])
+        body_start = node.body[0].lineno
+        key = code_hash('\0'.join([context, ''.join(lines[body_start - 1:node.end_lineno])]
+                                  + [bodies[name] for name in sorted(uses - {node.name})]))
+        blocks.append(FunctionBlock(body_start, node.end_lineno, ' ' * node.body[0].col_offset, key, node.name,
+                                    uses, node.name in pinned))
+    return blocks
+
+
+def stub_bodies(code, blocks):
+    """Replace the bodies of blocks with stubs, keeping line numbers intact."""
+    lines = code.splitlines(keepends=True)
+    for block in blocks:
+        count = block.end - block.body_start + 1
+        lines[block.body_start - 1:block.end] = [block.indent + STUB_BODY + '\n'] + ['\n'] * (count - 1)
+    return ''.join(lines)
+
+
+class _PyflakesReporter:
+    def __init__(self):
+        self.messages = []
+
+    def unexpectedError(self, filename, msg):
+        self.messages.append({'line': 1, 'column': 0, 'type': 'error',
+                              'message': str(msg), 'symbol': 'unexpected-error'})
+
+    def syntaxError(self, filename, msg, lineno, offset, text):
+        self.messages.append({'line': lineno or 1, 'column': max((offset or 1) - 1, 0), 'type': 'error',
+                              'message': msg, 'symbol': 'syntax-error'})
+
+    def flake(self, message):
+        name = type(message).__name__
+        if name in PYFLAKES_ERRORS:
+            self.messages.append({'line': message.lineno, 'column': message.col, 'type': 'error',
+                                  'message': message.message % message.message_args,
+                                  'symbol': _symbol(name)})
+
+
+class LintService:
+    """Long-lived linter for submitted code.
+
+    Keeps one pylint linter (and astroid's cache of third-party modules)
+    warm for the life of the process and lints straight from strings.
+    ``quick()`` runs pyflakes, which answers in milliseconds; the full
+    errors-only pylint pass runs on a background thread and its results
+    are remembered by content hash. Diagnostics are also remembered per
+    top-level function (see ``function_blocks``), so after an edit only
+    the changed functions and module-level code are analysed again.
+    """
+
+    def __init__(self):
+        self._linter = None
+        self._source = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pylint')
+        self._results = BoundedMemo(MAX_REMEMBERED_RESULTS)  # code hash -> Future
+        self._blocks = BoundedMemo(MAX_REMEMBERED_BLOCKS)  # block key -> issues, lines relative to body
+
+    def quick(self, code):
+        """Return pyflakes errors for code."""
+        from pyflakes import api
+
+        reporter = _PyflakesReporter()
+        with LINT_SECONDS.time('fast'):
+            api.check(code, LINT_FILENAME, reporter)
+        return sorted(reporter.messages, key=lambda m: (m['line'], m['column']))
+
+    def submit(self, code):
+        """Start (or reuse) the full pylint pass for code; return its hash."""
+        key = code_hash(code)
+        created = []
+        def start():
+            created.append(True)
+            return self._executor.submit(self._lint, code)
+        self._results.get_or_create(key, start)
+        CACHE_LOOKUPS.inc('lint', 'miss' if created else 'hit')
+        return key
+
+    def warm(self):
+        """Load pyflakes, pylint and astroid now rather than on the first request."""
+        self.quick('')
+        self._executor.submit(self._pylint, 'import os\n').result()
+
+    def result(self, key):
+        """Return the Future of a submitted full pass, or None if unknown."""
+        return self._results.get(key)
+
+    def full(self, code):
+        """Run the full pylint pass and return its issues."""
+        key = self.submit(code)
+        future = self.result(key)
+        try:
+            return future.result()
+        except Exception:
+            # Do not remember failures; the next request retries
+            self._results.discard(key, future)
+            raise
+
+    def _get_ast(self, filepath, modname, data=None):
+        from pylint.lint.pylinter import PyLinter
+        return PyLinter.get_ast(self._linter, filepath, modname, self._source)
+
+    def _ensure_linter(self):
+        if self._linter is not None:
+            return self._linter
+
+        from pylint.lint import Run
+        from pylint.reporters import CollectingReporter
+
+        # Configure once through the normal command line (on an empty file)
+        run = Run(['--errors-only', '--persistent=n', '--score=n', os.devnull],
+                  reporter=CollectingReporter(), exit=False)
+        self._linter = run.linter
+        # Lint the string we are given rather than reading a file
+        self._linter.get_ast = self._get_ast
+        return self._linter
+
+    def _lint(self, code):
+        """Lint code, reusing remembered diagnostics of unchanged functions."""
+        blocks = function_blocks(code)
+        known = {block: self._blocks.get(block.key) for block in blocks}
+        # Only functions nothing analysed again uses are stubbed, so inference into the others still works
+        analysed = [block for block in blocks if known[block] is None or block.pinned]
+        used = set().union(*(block.uses for block in analysed))
+        reused = [block for block in blocks if block not in analysed and block.name not in used]
+
+        with LINT_SECONDS.time('full'):
+            issues = self._pylint(stub_bodies(code, reused) if reused else code)
+
+        def body_of(issue):
+            return next((b for b in blocks if b.body_start <= issue['line'] <= b.end), None)
+
+        fresh = {block: [] for block in blocks if block not in reused}
+        merged = []
+        for issue in issues:
+            block = body_of(issue)
+            if block in reused:
+                continue  # Reported against the stub
+            if block is not None:
+                fresh[block].append(dict(issue, line=issue['line'] - block.body_start))
+            merged.append(issue)
+        for block, block_issues in fresh.items():
+            self._blocks.put(block.key, block_issues)
+        for block in reused:
+            merged.extend(dict(issue, line=issue['line'] + block.body_start) for issue in known[block])
+        return sorted(merged, key=lambda m: (m['line'], m['column']))
+
+    def _pylint(self, code):
+        """Lint code with the warm linter (only ever called on the lint thread)."""
+        from astroid import MANAGER
+        from pylint.reporters import CollectingReporter
+        from pylint.typing import FileItem
+
+        linter = self._ensure_linter()
+        reporter = CollectingReporter()
+        linter.set_reporter(reporter)
+        self._source = code
+        try:
+            linter.initialize()
+            linter.check_single_file_item(FileItem(LINT_MODULE, LINT_FILENAME, LINT_MODULE))
+        finally:
+            self._source = None
+            # Keep third-party modules cached, but not the code we just linted
+            MANAGER.astroid_cache.pop(LINT_MODULE, None)
+
+        return [{
+            'line': msg.line,
+            'column': msg.column,
+            'type': msg.category,
+            'message': msg.msg,
+            'symbol': msg.symbol
+        } for msg in reporter.messages]
+
+
+class FormatService:
+    """Black formatting, remembered by content hash."""
+
+    def __init__(self):
+        self._formatted = BoundedMemo(MAX_REMEMBERED_RESULTS)
+
+    def warm(self):
+        """Load Black (and its grammar) now rather than on the first request."""
+        import black
+        black.format_str('x = 1\n', mode=black.Mode())
+
+    def format(self, code):
+        import black
+
+        key = code_hash(code)
+        formatted = self._formatted.get(key)
+        CACHE_LOOKUPS.inc('format', 'miss' if formatted is None else 'hit')
+        if formatted is None:
+            with FORMAT_SECONDS.time():
+                formatted = black.format_str(code, mode=black.Mode())
+            self._formatted.put(key, formatted)
+            # Formatting formatted code is a no-op
+            self._formatted.put(code_hash(formatted), formatted)
+        return formatted
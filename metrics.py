@@ -0,0 +1,177 @@
+import time
+import bisect
+import threading
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram buckets for durations (seconds) and sizes (bytes)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(2 ** power for power in range(20, 34))  # 1 MiB to 8 GiB
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of the metric types: a named value per combination of labels.
+
+    Label values are passed positionally, in the order of ``labels``.
+    With ``collect``, a function returning {label values tuple: value},
+    the values are read from elsewhere when the metrics are rendered
+    instead of being recorded.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), collect=None, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def samples(self):
+        """Return [(name suffix, label pairs, value)] for rendering."""
+        if self.collect is not None:
+            values = self.collect()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [('', tuple(zip(self.labels, key)), value) for key, value in sorted(values.items())]
+
+
+class Counter(Metric):
+    """A count that only goes up, such as requests or restarts."""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as a queue depth."""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative ``buckets``.
+
+    Observing costs one bisect and a few additions under a lock, so it is
+    cheap enough for every request and run.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS, registry=None):
+        super().__init__(name, documentation, labels, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, *labels):
+        """Context manager observing the seconds its block takes."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        samples = []
+        for key, state in sorted(values.items()):
+            pairs = tuple(zip(self.labels, key))
+            count = 0
+            for bound, observed in zip(self.buckets + (float('inf'),), state):
+                count += observed
+                samples.append(('_bucket', pairs + (('le', _number(float(bound))),), count))
+            samples.append(('_sum', pairs, state[-1]))
+            samples.append(('_count', pairs, count))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """The metrics of a process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, pairs, value in metric.samples():
+                labels = ','.join(f'{name}="{_escape(label)}"' for name, label in pairs)
+                lines.append(f"{metric.name}{suffix}{{{labels}}} {_number(value)}" if labels
+                             else f"{metric.name}{suffix} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics recorded by this process and served from /metrics
+REGISTRY = Registry()
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds',
+                            'Time from receiving a request to sending the last byte of its response',
+                            ['route', 'method'])
+REQUESTS = Counter('http_requests_total', 'Requests answered, by route and status', ['route', 'method', 'status'])
+QUEUE_WAIT_SECONDS = Histogram('run_queue_wait_seconds',
+                               'Time a run waited for an idle worker or a job for a job thread', ['queue'])
+RUN_WALL_SECONDS = Histogram('run_wall_seconds', 'Wall time of runs')
+RUN_CPU_SECONDS = Histogram('run_cpu_seconds', 'User plus system CPU time of runs')
+RUN_PEAK_RSS_BYTES = Histogram('run_peak_rss_bytes', 'Peak resident memory of runs', buckets=BYTES_BUCKETS)
+RUNS = Counter('runs_total', 'Finished runs by outcome: ok or the error reason (timeout, memory, cpu, crash, '
+               'cancelled, abandoned)', ['outcome'])
+WORKER_RESTARTS = Counter('worker_restarts_total', 'Execution workers replaced, by reason', ['reason'])
+FIGURE_ENCODE_SECONDS = Histogram('figure_encode_seconds', 'Time to render and store a figure', ['format'])
+LINT_SECONDS = Histogram('lint_duration_seconds', 'Time of lint passes that were not remembered', ['tier'])
+FORMAT_SECONDS = Histogram('format_duration_seconds', 'Time of Black formatting that was not remembered')
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Lookups in the result, lint, format and compile caches',
+                        ['cache', 'result'])
+COMPILE_SECONDS = Histogram('compile_duration_seconds', 'Time to compile code that was not in the compile cache')
+COMPILE_SAVED_SECONDS = Counter('compile_cache_saved_seconds_total',
+                                'Compile time saved by the compile cache (what the cached code took to compile)')
@@ -0,0 +1,238 @@
+import io
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_STREAMS = ('stdout', 'stderr')
+LOG_NAME = re.compile(r'^[0-9a-f]{32}-(stdout|stderr)\.log$')
+
+
+class OutputWindow(io.TextIOBase):
+    """Text stream that keeps only the start and end of what is written.
+
+    At most ``max_bytes`` of UTF-8 are kept: the first half as it was
+    written and the most recent half in a ring of chunks. Everything in
+    between is dropped and counted. If ``spill_path`` is given, the whole
+    stream is also written to that file (up to ``max_spill_bytes``) once
+    it no longer fits, so it can be downloaded later.
+
+    ``add()`` returns the part of the text that falls in the first half
+    and can be passed on at once; ``rest()`` returns the remainder, with a
+    note on what was dropped, once the stream has ended.
+    """
+
+    def __init__(self, max_bytes, spill_path=None, max_spill_bytes=None, log_url=None):
+        super().__init__()
+        self.head_bytes = max_bytes // 2
+        self.tail_bytes = max_bytes - self.head_bytes
+        self.spill_path = spill_path
+        self.max_spill_bytes = max_spill_bytes
+        self.log_url = log_url
+        self.total_bytes = 0
+        self.dropped_bytes = 0
+        self.spilled_bytes = 0
+        self._head = bytearray()
+        self._tail = deque()
+        self._tail_size = 0
+        self._spill = None
+        self._lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        self.add(text)
+        return len(text)
+
+    def add(self, text):
+        """Take in text; return the part of it to pass on now."""
+        data = text.encode('utf-8', 'replace')
+        with self._lock:
+            self.total_bytes += len(data)
+            if self._spill is not None:
+                self._write_spill(data)
+            room = self.head_bytes - len(self._head)
+            if not self._tail and len(data) <= room:
+                self._head += data
+                return text
+
+            passed = b''
+            if not self._tail and room > 0:
+                passed, data = data[:room], data[room:]
+                self._head += passed
+            self._tail.append(data)
+            self._tail_size += len(data)
+            if self._tail_size > self.tail_bytes:
+                self._drop_locked(self._tail_size - self.tail_bytes)
+            return passed.decode('utf-8', 'ignore')
+
+    def _drop_locked(self, size):
+        if self._spill is None and self.spill_path is not None and not self.dropped_bytes:
+            self._start_spill_locked()
+        self.dropped_bytes += size
+        self._tail_size -= size
+        while size:
+            chunk = self._tail[0]
+            if len(chunk) <= size:
+                self._tail.popleft()
+                size -= len(chunk)
+            else:
+                self._tail[0] = chunk[size:]
+                size = 0
+
+    def _start_spill_locked(self):
+        """Start the log file with everything seen so far."""
+        try:
+            self._spill = open(self.spill_path, 'wb')
+        except OSError as e:
+            logger.warning(f"Could not write output log {self.spill_path}: {e}")
+            self.spill_path = None
+            return
+        self._write_spill(bytes(self._head))
+        for chunk in self._tail:
+            self._write_spill(chunk)
+
+    def _write_spill(self, data):
+        if self.max_spill_bytes is not None:
+            data = data[:max(self.max_spill_bytes - self.spilled_bytes, 0)]
+        if data:
+            self._spill.write(data)
+            self.spilled_bytes += len(data)
+
+    def marker(self):
+        """Return the note that stands in for the dropped output, or ''."""
+        if not self.dropped_bytes:
+            return ''
+        where = f"; full log at {self.log_url}" if self._spill is not None else ''
+        return f"\n... [{self.dropped_bytes} bytes of output not shown{where}] ...\n"
+
+    def rest(self):
+        """Return the text held back by add(): the dropped-output note and the tail."""
+        with self._lock:
+            tail = b''.join(self._tail)
+        return self.marker() + tail.decode('utf-8', 'ignore')
+
+    def getvalue(self):
+        with self._lock:
+            head = bytes(self._head)
+        return head.decode('utf-8', 'ignore') + self.rest()
+
+    def summary(self):
+        """Describe what was dropped, for the ``truncated`` part of a run result."""
+        summary = {'total_bytes': self.total_bytes, 'dropped_bytes': self.dropped_bytes, 'log': None}
+        if self._spill is not None:
+            summary['log'] = {'url': self.log_url, 'bytes': self.spilled_bytes,
+                              'complete': self.spilled_bytes == self.total_bytes}
+        return summary
+
+    def close(self):
+        with self._lock:
+            if self._spill is not None and not self._spill.closed:
+                self._spill.close()
+        super().close()
+
+
+class RunOutput:
+    """The bounded stdout and stderr of one run (see OutputWindow).
+
+    ``limit(events)`` passes a run's output events through the windows:
+    text beyond the first half of a window is held back and sent, after
+    a note on what was dropped, when the run ends, followed by a
+    ``truncated`` event describing each stream that did not fit.
+    """
+
+    def __init__(self, max_bytes, log_store=None):
+        self.id = uuid.uuid4().hex
+        self.windows = {}
+        for name in OUTPUT_STREAMS:
+            if log_store is not None:
+                self.windows[name] = log_store.window(self.id, name, max_bytes)
+            else:
+                self.windows[name] = OutputWindow(max_bytes)
+
+    @property
+    def stdout(self):
+        return self.windows['stdout']
+
+    @property
+    def stderr(self):
+        return self.windows['stderr']
+
+    def truncated(self):
+        """Return {stream: summary} for the streams that were cut, or None."""
+        truncated = {name: window.summary() for name, window in self.windows.items() if window.dropped_bytes}
+        return truncated or None
+
+    def limit(self, events):
+        try:
+            for kind, data in events:
+                if kind in self.windows:
+                    data = self.windows[kind].add(data)
+                    if not data:
+                        continue
+                yield (kind, data)
+            for name, window in self.windows.items():
+                rest = window.rest()
+                if rest:
+                    yield (name, rest)
+            truncated = self.truncated()
+            if truncated:
+                yield ('truncated', truncated)
+        finally:
+            self.close()
+
+    def close(self):
+        for window in self.windows.values():
+            window.close()
+
+
+class OutputLogStore:
+    """Directory of full output logs of runs whose output was cut.
+
+    Each stream gets up to ``max_log_bytes``; ``prune()`` keeps the
+    directory under ``max_bytes``, deleting the oldest logs first.
+    """
+
+    def __init__(self, directory, max_log_bytes, max_bytes):
+        self.directory = directory
+        self.max_log_bytes = max_log_bytes
+        self.max_bytes = max_bytes
+        self._last_prune = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def window(self, run_id, stream, max_bytes):
+        name = f'{run_id}-{stream}.log'
+        return OutputWindow(max_bytes, spill_path=os.path.join(self.directory, name),
+                            max_spill_bytes=self.max_log_bytes, log_url=f'/api/logs/{name}')
+
+    def prune(self, interval=60):
+        """Delete the oldest logs beyond max_bytes.
+
+        Does nothing if the last prune was less than ``interval`` seconds ago.
+        """
+        now = time.time()
+        if now - self._last_prune < interval:
+            return
+        self._last_prune = now
+
+        entries, total = [], 0
+        for entry in os.scandir(self.directory):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,317 @@
+import io
+import os
+import sys
+import html
+import zlib
+import time
+import base64
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from execution import USER_FILE
+
+PROFILE_MODES = ('cprofile', 'sampling')
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+# Entries in each list of the report
+TOP_FUNCTIONS = 20
+TOP_LINES = 10
+
+# Flame graph geometry (pixels)
+FLAME_WIDTH = 1200
+FLAME_FRAME_HEIGHT = 17
+FLAME_FONT_SIZE = 12
+FLAME_CHAR_WIDTH = 7
+# Deeper stacks are cut off in the flame graph
+FLAME_MAX_DEPTH = 100
+
+_call_cost = None
+
+
+def call_cost(calls=20000):
+    """Return the seconds cProfile adds to each function call, measured once."""
+    global _call_cost
+    if _call_cost is None:
+        def noop():
+            pass
+        start = time.perf_counter()
+        for _ in range(calls):
+            noop()
+        plain = time.perf_counter() - start
+
+        profile = cProfile.Profile()
+        profile.enable()
+        start = time.perf_counter()
+        for _ in range(calls):
+            noop()
+        profiled = time.perf_counter() - start
+        profile.disable()
+        _call_cost = max(profiled - plain, 0) / calls
+    return _call_cost
+
+
+class Sampler:
+    """Samples the stack of one thread from a background thread.
+
+    Unlike a signal-based sampler this works in any thread and also sees
+    time spent blocked in C code or I/O. Only frames called from the
+    ``root`` frame passed to ``start()`` are kept, so each sample is a
+    stack of ``(filename, function, first line)`` keys, outermost first,
+    plus the line the innermost frame of ``user_file`` was on.
+
+    The sampler needs the GIL to take a sample, so busy code is sampled
+    less often than the interval asks for; ``switch_interval`` makes it
+    hand over the GIL sooner (see sys.setswitchinterval) while sampling.
+    Each sample is weighted by the time since the previous one, so
+    ``stacks`` and ``lines`` hold seconds rather than counts.
+    """
+
+    def __init__(self, user_file, interval=SAMPLE_INTERVAL, switch_interval=None):
+        self.user_file = user_file
+        self.interval = interval
+        self.switch_interval = switch_interval
+        self.stacks = Counter()
+        self.lines = Counter()
+        self.samples = 0
+        self.overhead = 0.0  # seconds spent taking samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, root):
+        """Start sampling the current thread below the frame root."""
+        self._root = root
+        self._target = threading.get_ident()
+        self._previous_switch_interval = sys.getswitchinterval()
+        if self.switch_interval:
+            sys.setswitchinterval(min(self._previous_switch_interval, self.switch_interval))
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._previous_switch_interval)
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self._sample(frame, start - last)
+            last = time.perf_counter()
+            self.overhead += last - start
+
+    def _sample(self, frame, seconds):
+        stack, user_line = [], None
+        while frame is not None and frame is not self._root:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+            if user_line is None and code.co_filename == self.user_file:
+                user_line = frame.f_lineno
+            frame = frame.f_back
+        if frame is None or not stack:
+            return  # Not inside the profiled code
+        self.samples += 1
+        self.stacks[tuple(reversed(stack))] += seconds
+        if user_line is not None:
+            self.lines[user_line] += seconds
+
+
+class Profiler:
+    """Run code under cProfile or the sampler and report where time went.
+
+    ``mode`` is ``'cprofile'`` (deterministic: every call is timed and
+    counted) or ``'sampling'`` (the stack is sampled every
+    ``SAMPLE_INTERVAL`` seconds, which costs far less on call-heavy code).
+    The sampler also runs in cProfile mode, as it is what provides line
+    hot spots and the flame graph, but there it does not shorten the GIL
+    switch interval.
+
+    The report states the profiling overhead: the time spent taking
+    samples, plus for cProfile the number of calls times the per-call
+    cost measured by ``call_cost()``.
+    """
+
+    def __init__(self, mode='cprofile', user_file=USER_FILE):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}, use one of {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.user_file = user_file
+        self.sampler = Sampler(user_file, switch_interval=SAMPLE_INTERVAL / 5 if mode == 'sampling' else None)
+        self.profile = None
+        self.wall_seconds = 0.0
+
+    def run(self, code, namespace):
+        """exec() code (source or a code object) in namespace under the profiler."""
+        if self.mode == 'cprofile':
+            call_cost()  # Measure before the clock starts
+            self.profile = cProfile.Profile()
+        self.sampler.start(sys._getframe())
+        start = time.perf_counter()
+        try:
+            if self.profile is not None:
+                self.profile.enable()
+            try:
+                exec(code, namespace)
+            finally:
+                if self.profile is not None:
+                    self.profile.disable()
+        finally:
+            self.wall_seconds = time.perf_counter() - start
+            self.sampler.stop()
+
+    def report(self, figure_store=None, code=None):
+        """Return the profile as a JSON-serialisable dict.
+
+        The flame graph is saved to ``figure_store`` and referred to by
+        its figure record. Pass the profiled ``code`` to include the text
+        of the hot lines.
+        """
+        overhead, method = self.sampler.overhead, 'time spent sampling'
+        if self.profile is not None:
+            functions, calls = self._cprofile_functions()
+            overhead += calls * call_cost()
+            method += ' + calls x calibrated cost per call'
+        else:
+            functions = self._sampled_functions()
+        wall = self.wall_seconds
+
+        return {
+            'mode': self.mode,
+            'wall_seconds': round(wall, 6),
+            'overhead': {
+                'seconds': round(overhead, 6),
+                'percent': round(100 * overhead / wall, 1) if wall else 0.0,
+                'method': method
+            },
+            'samples': self.sampler.samples,
+            'sample_interval': self.sampler.interval,
+            'top_self': _top(functions, 'self_seconds'),
+            'top_cumulative': _top(functions, 'cumulative_seconds'),
+            'lines': self._hot_lines(code),
+            'flamegraph': self._flamegraph(figure_store)
+        }
+
+    def _cprofile_functions(self):
+        """Return per-function timings from cProfile and the total call count."""
+        stats = pstats.Stats(self.profile).stats
+        functions, calls = [], 0
+        for (filename, line, name), (_, ncalls, self_time, cumulative, callers) in stats.items():
+            calls += ncalls
+            if filename == '~' and not callers:
+                continue  # The profiler's own exec() and disable() calls
+            functions.append(_function(filename, line, name, ncalls, self_time, cumulative))
+        return functions, calls
+
+    def _sampled_functions(self):
+        """Estimate per-function timings from the samples."""
+        self_seconds, cumulative_seconds = Counter(), Counter()
+        for stack, seconds in self.sampler.stacks.items():
+            self_seconds[stack[-1]] += seconds
+            for key in set(stack):
+                cumulative_seconds[key] += seconds
+        return [_function(filename, line, name, None, self_seconds[key], seconds)
+                for key, seconds in cumulative_seconds.items()
+                for filename, name, line in [key]]
+
+    def _hot_lines(self, code):
+        total = sum(self.sampler.stacks.values())
+        source = code.splitlines() if isinstance(code, str) else []
+        lines = []
+        for line, seconds in self.sampler.lines.most_common(TOP_LINES):
+            lines.append({
+                'line': line,
+                'seconds': round(seconds, 6),
+                'percent': round(100 * seconds / total, 1),
+                'source': source[line - 1].strip() if 0 < line <= len(source) else None
+            })
+        return lines
+
+    def _flamegraph(self, figure_store):
+        if not self.sampler.samples:
+            return None
+        svg = flamegraph_svg(self.sampler.stacks, title=f"{self.mode} profile, {self.sampler.samples} samples",
+                             user_file=self.user_file).encode('utf-8')
+        if figure_store is not None:
+            return figure_store.put(svg, 'svg')
+        return {'id': None, 'url': 'data:image/svg+xml;base64,' + base64.b64encode(svg).decode('ascii'),
+                'format': 'svg'}
+
+
+def _function(filename, line, name, calls, self_time, cumulative):
+    return {
+        'function': name,
+        'file': filename,
+        'line': line,
+        'calls': calls,
+        'self_seconds': round(self_time, 6),
+        'cumulative_seconds': round(cumulative, 6)
+    }
+
+
+def _top(functions, key):
+    return sorted(functions, key=lambda f: f[key], reverse=True)[:TOP_FUNCTIONS]
+
+
+def _frame_label(key, user_file):
+    filename, name, line = key
+    where = f"line {line}" if filename == user_file else f"{os.path.basename(filename)}:{line}"
+    return f"{name} ({where})"
+
+
+def flamegraph_svg(stacks, title='', user_file=USER_FILE):
+    """Render sampled stacks ({stack tuple: seconds}) as a flame graph SVG.
+
+    Callers are drawn below their callees and each frame is as wide as the
+    share of the sampled time it appears in. The output is deterministic, so the
+    same profile always hashes to the same figure.
+    """
+    root = {'seconds': 0, 'children': {}}
+    for stack, seconds in stacks.items():
+        root['seconds'] += seconds
+        node = root
+        for key in stack[:FLAME_MAX_DEPTH]:
+            node = node['children'].setdefault(key, {'seconds': 0, 'children': {}})
+            node['seconds'] += seconds
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node['children'].values()), default=0)
+
+    levels = depth(root)
+    top = 2 * FLAME_FRAME_HEIGHT
+    height = top + levels * FLAME_FRAME_HEIGHT + 4
+    total = root['seconds'] or 1
+    scale = FLAME_WIDTH / total
+    out = io.StringIO()
+    out.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_WIDTH}" height="{height}" '
+              f'viewBox="0 0 {FLAME_WIDTH} {height}" font-family="monospace" font-size="{FLAME_FONT_SIZE}">\n')
+    out.write('<rect width="100%" height="100%" fill="#f8f8f8"/>\n')
+    out.write(f'<text x="{FLAME_WIDTH / 2}" y="{FLAME_FRAME_HEIGHT}" text-anchor="middle">{html.escape(title)}</text>\n')
+
+    def draw(label, node, x, level):
+        width = node['seconds'] * scale
+        y = height - 4 - (level + 1) * FLAME_FRAME_HEIGHT
+        share = 100 * node['seconds'] / total
+        if width >= 0.5:
+            hashed = zlib.crc32(label.encode('utf-8'))
+            color = f"rgb({205 + hashed % 50},{(hashed >> 8) % 230},{(hashed >> 16) % 55})"
+            text = html.escape(label)
+            out.write(f'<g><title>{text} ({node["seconds"] * 1000:.1f} ms, {share:.1f}%)</title>'
+                      f'<rect x="{x:.2f}" y="{y}" width="{width:.2f}" height="{FLAME_FRAME_HEIGHT - 1}" '
+                      f'fill="{color}" rx="2"/>')
+            chars = int((width - 6) / FLAME_CHAR_WIDTH)
+            if chars >= 3:
+                shown = label if len(label) <= chars else label[:chars - 2] + '..'
+                out.write(f'<text x="{x + 3:.2f}" y="{y + FLAME_FRAME_HEIGHT - 5}">{html.escape(shown)}</text>')
+            out.write('</g>\n')
+        for key in sorted(node['children']):
+            child = node['children'][key]
+            draw(_frame_label(key, user_file), child, x, level + 1)
+            x += child['seconds'] * scale
+
+    draw('all', root, 0.0, 0)
+    out.write('</svg>\n')
+    return out.getvalue()
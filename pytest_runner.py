@@ -0,0 +1,198 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from linting import BoundedMemo, code_hash
+
+logger = logging.getLogger(__name__)
+
+# Name the submitted code is saved under while pytest runs it
+TEST_FILE = 'test_submission.py'
+# Collected test IDs are remembered for this many distinct sources
+MAX_REMEMBERED_COLLECTIONS = 256
+
+OUTCOMES = ('passed', 'failed', 'skipped', 'error')
+
+
+class _Recorder:
+    """pytest plugin that records collected tests and their results."""
+
+    def __init__(self, directory):
+        self.directory = directory + os.sep
+        self.collected = []
+        self.collection_errors = []
+        self.results = {}
+
+    def pytest_collection_finish(self, session):
+        self.collected = [item.nodeid for item in session.items]
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self.collection_errors.append({'nodeid': report.nodeid, 'traceback': self._text(report)})
+
+    def pytest_runtest_logreport(self, report):
+        result = self.results.setdefault(report.nodeid, {
+            'nodeid': report.nodeid,
+            'outcome': 'passed',
+            'duration': 0.0,
+            'traceback': None,
+            'stdout': ''
+        })
+        result['duration'] = round(result['duration'] + report.duration, 6)
+        # Each phase's report includes the output of the phases before it
+        result['stdout'] = report.capstdout
+        if report.skipped and result['outcome'] == 'passed':
+            result['outcome'] = 'skipped'
+            # Skips carry (path, line, reason)
+            result['traceback'] = report.longrepr[2] if isinstance(report.longrepr, tuple) else self._text(report)
+        elif report.failed:
+            # A failing fixture is an error, a failing test body a failure
+            result['outcome'] = 'failed' if report.when == 'call' else 'error'
+            result['traceback'] = self._text(report)
+
+    def _text(self, report):
+        """Return a report's traceback with paths relative to the test directory."""
+        return report.longreprtext.replace(self.directory, '')
+
+
+def run_pytest(code, output, node_ids=None, collect_only=False):
+    """Run the tests in code under pytest; called in the process that runs them.
+
+    Runs only ``node_ids`` if given, or just collects the tests with
+    ``collect_only``. Output of the tests goes to ``output`` (an
+    execution.OutputCapture). Returns ``{'collected', 'collection_errors',
+    'results'}``, results being one dict per test run.
+    """
+    import pytest
+
+    directory = tempfile.mkdtemp(prefix='pytest-')
+    path = os.path.join(directory, TEST_FILE)
+    with open(path, 'w') as f:
+        f.write(code)
+    targets = [os.path.join(directory, node_id) for node_id in node_ids] if node_ids else [path]
+    args = targets + ['-p', 'no:cacheprovider', '-p', 'no:terminal', '--capture=sys',
+                      '--rootdir', directory, '--import-mode=importlib']
+    if collect_only:
+        args.append('--collect-only')
+
+    recorder = _Recorder(directory)
+    try:
+        with output.capture(process_wide=True):
+            pytest.main(args, plugins=[recorder])
+    finally:
+        output.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'collected': recorder.collected,
+        'collection_errors': recorder.collection_errors,
+        'results': list(recorder.results.values())
+    }
+
+
+def partition(node_ids, parts, durations=None):
+    """Split tests into at most ``parts`` groups of about equal run time.
+
+    Tests with known ``durations`` ({node id: seconds}) are placed longest
+    first, each into the group with the least time so far; unknown tests
+    are dealt out round-robin. Groups keep the collection order.
+    """
+    parts = max(1, min(parts, len(node_ids)))
+    order = {node_id: index for index, node_id in enumerate(node_ids)}
+    groups = [[] for _ in range(parts)]
+    if durations:
+        loads = [0.0] * parts
+        for node_id in sorted(node_ids, key=lambda node_id: durations.get(node_id, 0), reverse=True):
+            group = loads.index(min(loads))
+            groups[group].append(node_id)
+            loads[group] += durations.get(node_id, 0)
+    else:
+        for index, node_id in enumerate(node_ids):
+            groups[index % parts].append(node_id)
+    return [sorted(group, key=order.get) for group in groups if group]
+
+
+class TestRunner:
+    """Runs the tests of submitted code in parallel.
+
+    ``run(code, spec, cancel)`` executes one pytest invocation in a worker
+    and returns its result in the /api/run format, where ``spec`` is
+    ``{'node_ids': [...]}`` or ``{'collect': True}`` and the result's
+    ``tests`` part is what run_pytest() returned.
+
+    The tests are collected once per distinct source (remembered by
+    content hash) and split into groups that run at the same time, one
+    per ``parallel`` worker, so a suite takes about as long as its slowest
+    group instead of the sum of all tests. Durations of earlier runs of
+    the same source are used to balance the groups. Module and session
+    fixtures run once per group.
+    """
+
+    def __init__(self, run, parallel):
+        self.run = run
+        self.parallel = parallel
+        self._collections = BoundedMemo(MAX_REMEMBERED_COLLECTIONS)  # code hash -> node ids
+        self._durations = BoundedMemo(MAX_REMEMBERED_COLLECTIONS)  # code hash -> {node id: seconds}
+
+    def collect(self, code):
+        """Return (node ids, collection errors, whether they were remembered)."""
+        key = code_hash(code)
+        node_ids = self._collections.get(key)
+        if node_ids is not None:
+            return node_ids, [], True
+        result = self.run(code, {'collect': True}, None)
+        tests = result.get('tests')
+        if tests is None:
+            error = result['stderr'].strip() or 'Collecting the tests failed'
+            return [], [{'nodeid': TEST_FILE, 'traceback': error}], False
+        if not tests['collection_errors']:
+            self._collections.put(key, tests['collected'])
+        return tests['collected'], tests['collection_errors'], False
+
+    def test(self, code, select=None, cancel=None):
+        """Collect and run the tests in code; return the /api/test report."""
+        start = time.perf_counter()
+        key = code_hash(code)
+        node_ids, collection_errors, cached = self.collect(code)
+        if select:
+            wanted = set(select)
+            node_ids = [node_id for node_id in node_ids if node_id in wanted]
+
+        results = {}
+        output = []
+        groups = partition(node_ids, self.parallel, self._durations.get(key))
+        if groups:
+            with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix='pytest') as executor:
+                runs = executor.map(lambda group: (group, self.run(code, {'node_ids': group}, cancel)), groups)
+                for group, result in runs:
+                    output.append(result)
+                    tests = result.get('tests') or {'results': []}
+                    for test in tests['results']:
+                        results[test['nodeid']] = test
+                    for node_id in group:
+                        if node_id not in results:
+                            # The group timed out or crashed before this test finished
+                            results[node_id] = {'nodeid': node_id, 'outcome': 'error', 'duration': None,
+                                                'traceback': result['stderr'].strip() or None, 'stdout': ''}
+
+        tests = [results[node_id] for node_id in node_ids]
+        durations = dict(self._durations.get(key) or {})
+        durations.update((test['nodeid'], test['duration']) for test in tests if test['duration'] is not None)
+        self._durations.put(key, durations)
+
+        summary = {outcome: 0 for outcome in OUTCOMES}
+        for test in tests:
+            summary[test['outcome']] += 1
+        summary['total'] = len(tests)
+        summary['test_seconds'] = round(sum(test['duration'] or 0 for test in tests), 6)
+        summary['wall_seconds'] = round(time.perf_counter() - start, 6)
+        return {
+            'tests': tests,
+            'summary': summary,
+            'collection': {'count': len(node_ids), 'cached': cached, 'errors': collection_errors},
+            'groups': len(groups),
+            'stdout': ''.join(result['stdout'] for result in output),
+            'stderr': ''.join(result['stderr'] for result in output)
+        }
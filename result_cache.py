@@ -0,0 +1,283 @@
+import os
+import sys
+import ast
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from importlib import metadata
+
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Libraries whose versions are part of the cache key
+VERSIONED_PACKAGES = ['numpy', 'pandas', 'matplotlib', 'seaborn', 'scipy', 'scikit-learn',
+                      'tensorflow-cpu', 'torch', 'nltk', 'beautifulsoup4', 'requests']
+
+# Imports whose results depend on the clock, the environment or the network
+NONDETERMINISTIC_MODULES = {'random', 'secrets', 'uuid', 'time', 'datetime', 'os', 'pathlib',
+                            'glob', 'shutil', 'tempfile', 'subprocess', 'socket', 'http',
+                            'urllib', 'requests', 'bs4', 'threading', 'multiprocessing',
+                            'asyncio', 'concurrent',
+                            'shared_data'}  # Datasets change under the same code
+NONDETERMINISTIC_BUILTINS = {'open', 'id', 'hash'}
+# Functions of torch, TensorFlow, scikit-learn and pandas that draw random numbers
+# (``.random`` modules and attributes, as in numpy.random and tf.random, are caught by name)
+RANDOM_FUNCTIONS = {'rand', 'randn', 'randint', 'randperm', 'rand_like', 'randn_like', 'randint_like',
+                    'bernoulli', 'multinomial', 'poisson', 'normal', 'uniform', 'truncated_normal',
+                    'stateless_uniform', 'shuffle', 'resample', 'train_test_split', 'permutation', 'sample'}
+# Calls that seed the global generators, making the draws above repeatable when given a constant
+SEED_FUNCTIONS = {'seed', 'manual_seed', 'set_seed'}
+
+# Bump when the shape of run results changes, so older entries are not reused
+RESULT_FORMAT_VERSION = 2
+
+
+def _called_name(node):
+    """Return the name a call is made through (``f`` of ``f()`` and ``x.f()``), or None."""
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return None
+
+
+def find_nondeterminism(code):
+    """Return why code may give different output on each run, or None.
+
+    This is a conservative static check: random numbers drawn through
+    ``.random`` modules (numpy.random, torch.random, tf.random) or the
+    random functions of torch, TensorFlow, scikit-learn and pandas are
+    allowed when the code seeds the generators with a constant, or passes
+    a constant ``random_state``.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None  # The error message is deterministic
+
+    seeded = any(
+        isinstance(node, ast.Call) and _called_name(node) in SEED_FUNCTIONS
+        and node.args and isinstance(node.args[0], ast.Constant)
+        for node in ast.walk(tree)
+    )
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ''
+            names = [module] + [f'{module}.{alias.name}' for alias in node.names]
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in NONDETERMINISTIC_BUILTINS:
+            return f"calls {node.func.id}()"
+        elif isinstance(node, ast.Call) and _called_name(node) in RANDOM_FUNCTIONS and not seeded \
+                and not any(keyword.arg == 'random_state' and isinstance(keyword.value, ast.Constant)
+                            and keyword.value.value is not None for keyword in node.keywords):
+            return f"calls {_called_name(node)}() without a seed"
+        elif isinstance(node, ast.Attribute) and node.attr == 'random' and not seeded:
+            return "uses unseeded random numbers"
+        else:
+            continue
+        for name in names:
+            if name.split('.')[0] in NONDETERMINISTIC_MODULES:
+                return f"imports {name}"
+            if 'random' in name.split('.')[1:] and not seeded:
+                return f"imports {name} without a seed"
+    return None
+
+
+def environment_fingerprint():
+    """Describe the interpreter and library versions that produced a result."""
+    versions = [sys.version]
+    for package in VERSIONED_PACKAGES:
+        try:
+            versions.append(f"{package}=={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            pass
+    return '\n'.join(versions)
+
+
+class CacheBackend:
+    """LRU index with TTL and a byte budget; subclasses store the values."""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._index = OrderedDict()  # key -> (expires_at, size), least recent first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._evict(key)
+                return None
+            self._index.move_to_end(key)
+        value = self._load(key)
+        if value is None:
+            with self._lock:
+                if key in self._index:
+                    self._evict(key)
+        return value
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        self._store(key, data)
+        with self._lock:
+            if key in self._index:
+                self._evict(key, remove=False)
+            self._index[key] = (time.time() + self.ttl, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._evict(next(iter(self._index)))
+
+    def _evict(self, key, remove=True):
+        _, size = self._index.pop(key)
+        self._bytes -= size
+        if remove:
+            self._remove(key)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+class MemoryBackend(CacheBackend):
+    """Keep cached results in this process."""
+
+    def __init__(self, max_bytes, ttl):
+        super().__init__(max_bytes, ttl)
+        self._values = {}
+
+    def _load(self, key):
+        data = self._values.get(key)
+        return json.loads(data) if data is not None else None
+
+    def _store(self, key, data):
+        self._values[key] = data
+
+    def _remove(self, key):
+        self._values.pop(key, None)
+
+
+class DiskBackend(CacheBackend):
+    """Keep cached results as JSON files in a directory.
+
+    Entries survive restarts: the index is rebuilt from the files, with
+    file modification times standing in for recency.
+    """
+
+    def __init__(self, directory, max_bytes, ttl):
+        super().__init__(max_bytes, ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self._index[key] = (mtime + ttl, size)
+            self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._evict(next(iter(self._index)))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _load(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, data):
+        # Unique per writer, so that processes storing the same key do not write into each other's file
+        tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class ResultCache:
+    """Content-addressed cache of run results.
+
+    Keys hash the code and its standard input together with the
+    interpreter and library versions and the execution limits, so a result is only reused when re-running
+    the code would produce the same output.
+    """
+
+    def __init__(self, backend, limits=()):
+        self.backend = backend
+        self._salt = f"{environment_fingerprint()}\n{RESULT_FORMAT_VERSION}\n{tuple(limits)!r}"
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def key(self, code, stdin=None):
+        text = self._salt + '\0' + code
+        if stdin:
+            text += '\0stdin\0' + stdin
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        result = self.backend.get(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_LOOKUPS.inc('result', 'miss' if result is None else 'hit')
+        return result
+
+    def skip(self):
+        """Count a run that bypassed the cache."""
+        with self._lock:
+            self.skipped += 1
+        CACHE_LOOKUPS.inc('result', 'skip')
+
+    def put(self, key, result):
+        try:
+            self.backend.put(key, result)
+        except OSError as e:
+            logger.warning(f"Could not cache run result: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.backend),
+            'bytes': self.backend.size_bytes,
+            'max_bytes': self.backend.max_bytes
+        }
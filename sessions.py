@@ -0,0 +1,346 @@
+import os
+import time
+import uuid
+import signal
+import logging
+import threading
+from collections import OrderedDict
+
+from worker_pool import Worker, KILL_GRACE_SECONDS, worker_context, collect_events, preload_modules
+
+logger = logging.getLogger(__name__)
+
+
+class SessionError(Exception):
+    """Base class of session errors reported to the client."""
+
+
+class SessionLimitError(SessionError):
+    """Raised when no session can be started because all are busy."""
+
+
+class SessionBusyError(SessionError):
+    """Raised when a session is asked to run a cell while it runs another."""
+
+
+class CpuTimeExceeded(KeyboardInterrupt):
+    """Raised in a cell that used up its CPU time.
+
+    A KeyboardInterrupt, so that ``except Exception`` in user code does
+    not swallow it.
+    """
+
+
+def _cpu_exceeded(signum, frame):
+    raise CpuTimeExceeded("CPU time limit exceeded")
+
+
+def _new_namespace():
+    return {'__name__': '__main__'}
+
+
+def _rss_bytes(pid):
+    """Return the resident memory of a process, or 0 if unknown (Linux only).
+
+    Pages of mapped files, such as the shared datasets, are left out:
+    they are in the page cache once however many kernels read them.
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _kernel_main(conn, preload, figure_store=None, limits=None, datasets=None):
+    """Run cells against one persistent namespace until told to stop."""
+    from execution import OutputCapture, execute, pyplot
+    plt = pyplot()
+
+    # Interrupting a cell raises KeyboardInterrupt inside it; an interrupt that arrives
+    # once the cell has finished is ignored, so it cannot kill the kernel or cut a message short
+    running_cell = threading.Event()
+    def interrupt(signum, frame):
+        if running_cell.is_set():
+            raise KeyboardInterrupt
+    signal.signal(signal.SIGINT, interrupt)
+    if hasattr(signal, 'SIGXCPU'):
+        signal.signal(signal.SIGXCPU, _cpu_exceeded)
+
+    preload_modules(preload)
+    if datasets is not None:
+        datasets.map()
+    leaf = None
+    if limits is not None:
+        leaf = limits.create_leaf(os.getpid())
+        # CPU time is budgeted per cell below; memory covers the whole session
+        limits.apply(leaf, cpu=False)
+
+    # Output is flushed from a background thread too, so serialise sends
+    send_lock = threading.Lock()
+    def send(kind, data):
+        with send_lock:
+            conn.send((kind, data))
+
+    namespace = _new_namespace()
+    cells = 0
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+
+        kind, payload = message
+        try:
+            if kind == 'cell':
+                if limits is not None:
+                    limits.allow_cpu(limits.cpu_seconds)
+                output = OutputCapture(on_event=send, figure_store=figure_store)
+                cells += 1
+                running_cell.set()
+                try:
+                    # Functions from earlier cells keep pointing at their own source
+                    execute(payload['code'], output, process_wide=True, namespace=namespace,
+                            filename=f'<cell {cells}>')
+                finally:
+                    running_cell.clear()
+                    if limits is not None:
+                        limits.allow_cpu(None)
+            elif kind == 'reset':
+                namespace = _new_namespace()
+                plt.close('all')
+        except KeyboardInterrupt:
+            pass  # Interrupted before the cell's own code ran
+        finally:
+            send('done', {})
+
+    if leaf is not None:
+        limits.remove_leaf(os.getpid())
+
+
+class Session:
+    def __init__(self, worker):
+        self.id = uuid.uuid4().hex
+        self.worker = worker
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.cells = 0
+        self.lock = threading.Lock()  # held while a cell runs
+
+    @property
+    def busy(self):
+        return self.lock.locked()
+
+    def memory_bytes(self):
+        return _rss_bytes(self.worker.pid)
+
+    def to_dict(self):
+        return {
+            'session_id': self.id,
+            'created_at': self.created_at,
+            'idle_seconds': round(time.monotonic() - self.last_used, 1),
+            'cells': self.cells,
+            'busy': self.busy,
+            'memory_mb': round(self.memory_bytes() / (1024 * 1024), 1)
+        }
+
+
+class SessionManager:
+    """Notebook-style sessions: kernels that keep their globals between cells.
+
+    Each session owns a process started warm from the same preloaded
+    server as the worker pool and runs its cells one at a time in one
+    namespace, so later cells reuse data loaded or models trained by
+    earlier ones. A cell that runs out of time is interrupted with
+    KeyboardInterrupt, keeping the session's state; only if that does not
+    stop it is the kernel killed and the session lost.
+
+    Sessions idle for ``idle_timeout`` seconds are closed, and so are the
+    least recently used idle sessions while all kernels together use more
+    than ``memory_budget_mb`` of resident memory. At most
+    ``max_sessions`` exist at once. Kernels map the shared ``datasets``
+    (a shared_data.DatasetStore) before their memory limit is applied.
+    """
+
+    def __init__(self, preload=(), figure_store=None, limits=None, max_sessions=8,
+                 idle_timeout=900, memory_budget_mb=None, datasets=None):
+        self.preload = list(preload)
+        self.figure_store = figure_store
+        self.limits = limits
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.memory_budget_mb = memory_budget_mb
+        self.datasets = datasets
+        self._ctx = worker_context(self.preload)
+        self._sessions = OrderedDict()  # session id -> session, least recently used first
+        self._starting = 0  # Sessions being created, which count against max_sessions
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        threading.Thread(target=self._evict_periodically, name='session-evictor', daemon=True).start()
+
+    def create(self):
+        """Start a session and return it."""
+        # Take a place under the lock, so that concurrent creates cannot exceed max_sessions
+        while True:
+            with self._lock:
+                if len(self._sessions) + self._starting < self.max_sessions:
+                    self._starting += 1
+                    break
+            if not self._evict_one():
+                raise SessionLimitError(f"All {self.max_sessions} sessions are busy")
+
+        try:
+            session = Session(Worker(self._ctx, self.preload, self.figure_store, self.limits,
+                                     target=_kernel_main, datasets=self.datasets))
+        except BaseException:
+            with self._lock:
+                self._starting -= 1
+            raise
+        with self._lock:
+            self._starting -= 1
+            self._sessions[session.id] = session
+        logger.info(f"Started session {session.id} (kernel {session.worker.pid})")
+        return session
+
+    def get(self, session_id):
+        """Return a session; raises KeyError if it does not exist."""
+        with self._lock:
+            return self._sessions[session_id]
+
+    def list(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def run(self, session_id, code, timeout):
+        """Run a cell and return its output in the /api/run format."""
+        return collect_events(self.stream(session_id, code, timeout))
+
+    def stream(self, session_id, code, timeout):
+        """Run a cell, yielding its output events (see WorkerPool.stream)."""
+        return self._exchange(self.get(session_id), ('cell', {'code': code}), timeout)
+
+    def reset(self, session_id, timeout=KILL_GRACE_SECONDS):
+        """Forget a session's variables and figures."""
+        for kind, data in self._exchange(self.get(session_id), ('reset', {}), timeout):
+            if kind == 'error':
+                raise SessionError(data['text'].strip())
+
+    def close(self, session_id):
+        """Stop a session, killing its kernel if a cell is running."""
+        with self._lock:
+            session = self._sessions.pop(session_id)
+        self._stop(session)
+
+    def _exchange(self, session, message, timeout):
+        """Send a message to a kernel and yield events until it is done."""
+        if not session.lock.acquire(blocking=False):
+            raise SessionBusyError("The session is running another cell")
+        conn = session.worker.conn
+        try:
+            with self._lock:
+                if session.id in self._sessions:
+                    self._sessions.move_to_end(session.id)
+            conn.send(message)
+            deadline = time.monotonic() + timeout
+            interrupted = False
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not conn.poll(remaining):
+                    if not interrupted:
+                        interrupted = True
+                        os.kill(session.worker.pid, signal.SIGINT)
+                        deadline = time.monotonic() + KILL_GRACE_SECONDS
+                        yield ('error', {'reason': 'timeout',
+                                         'text': "ERROR: Cell timed out after {} seconds and was interrupted\n".format(timeout)})
+                        continue
+                    self._lose(session, "did not stop when interrupted")
+                    yield ('error', {'reason': 'timeout',
+                                     'text': "ERROR: The session did not respond and was closed; its variables are lost\n"})
+                    return
+                kind, data = conn.recv()
+                if kind == 'done':
+                    if message[0] == 'cell':
+                        session.cells += 1
+                    return
+                yield (kind, data)
+        except (EOFError, OSError):
+            session.worker.process.join(1)
+            self._lose(session, f"kernel exited (exit code {session.worker.process.exitcode})")
+            yield ('error', {'reason': 'crash',
+                             'text': "ERROR: The session's kernel exited unexpectedly; its variables are lost\n"})
+        finally:
+            session.last_used = time.monotonic()
+            session.lock.release()
+
+    def _lose(self, session, reason):
+        logger.warning(f"Closing session {session.id}: {reason}")
+        with self._lock:
+            self._sessions.pop(session.id, None)
+        session.worker.kill()
+
+    def _stop(self, session):
+        if session.busy:
+            session.worker.kill()
+        else:
+            session.worker.stop()
+
+    def _evict_one(self):
+        """Close the least recently used idle session; return whether there was one."""
+        with self._lock:
+            for session in self._sessions.values():
+                if not session.busy:
+                    del self._sessions[session.id]
+                    break
+            else:
+                return False
+        logger.info(f"Evicting session {session.id} to make room")
+        self._stop(session)
+        return True
+
+    def evict(self):
+        """Close idle sessions that timed out or that exceed the memory budget."""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        evicted = [(session, "idle") for session in sessions
+                   if not session.busy and now - session.last_used > self.idle_timeout]
+
+        if self.memory_budget_mb:
+            idle_ids = {session.id for session, _ in evicted}
+            remaining = [session for session in sessions if session.id not in idle_ids]
+            total = sum(session.memory_bytes() for session in remaining)
+            budget = self.memory_budget_mb * 1024 * 1024
+            for session in remaining:  # least recently used first
+                if total <= budget:
+                    break
+                if not session.busy:
+                    total -= session.memory_bytes()
+                    evicted.append((session, "over the memory budget"))
+
+        for session, reason in evicted:
+            with self._lock:
+                if self._sessions.get(session.id) is not session or session.busy:
+                    continue
+                del self._sessions[session.id]
+            logger.info(f"Evicting session {session.id}: {reason}")
+            self._stop(session)
+
+    def _evict_periodically(self):
+        interval = max(1, min(30, self.idle_timeout / 2))
+        while not self._closed.wait(interval):
+            try:
+                self.evict()
+            except Exception:
+                logger.exception("Session eviction failed")
+
+    def shutdown(self):
+        """Stop all sessions."""
+        self._closed.set()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            self._stop(session)
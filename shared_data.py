@@ -0,0 +1,317 @@
+"""
+Shared datasets for user code
+-----------------------------
+The server converts the CSV and .npy files in its dataset directory once
+into one .npy file per column; runs then open them as memory-mapped,
+read-only NumPy arrays or pandas DataFrames:
+
+    from shared_data import list_datasets, frame, array
+
+    df = frame('sales')             # DataFrame backed by the shared files
+    prices = array('sales', 'price')
+    matrix = array('embeddings')    # a dataset converted from a .npy file
+
+Nothing is parsed or copied per run, and all runs read the same page-cache
+pages, so a dataset costs memory once rather than once per run. The data
+cannot be changed in place; copy what you want to modify
+(``df = df.copy()``). String columns are stored as categoricals.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+
+# numpy is imported where it is used: the web server imports this module for DatasetStore alone
+
+logger = logging.getLogger(__name__)
+
+# Changing the conversion changes this, so existing datasets are converted again
+FORMAT_VERSION = 1
+SOURCE_SUFFIXES = ('.csv', '.npy')
+META_FILE = 'meta.json'
+
+# Where the helpers find the converted datasets; DatasetStore.map() points it at its store
+_directory = os.path.abspath(os.path.join('output', 'datasets'))
+# name -> (stamp, meta, {column: (values, categories or None)}), mapped once per process
+_mapped = {}
+_mapped_lock = threading.Lock()
+
+
+class DatasetStore:
+    """Converts the datasets in ``source_directory`` for the helpers of this module.
+
+    Every CSV file there becomes a table of the same name (without the
+    suffix) in ``directory``: one .npy file per column, with string
+    columns stored as integer codes and an array of their distinct values.
+    A .npy file becomes an array dataset. ``sync()`` converts new and
+    changed files and drops removed ones; conversions are written aside
+    and renamed into place, so runs never see half a dataset.
+
+    Workers call ``map()`` before forking runs. The runs inherit the
+    mappings, so they neither open the files again nor have the datasets
+    count against their memory limit. The object is pickled without its
+    lock.
+    """
+
+    def __init__(self, source_directory, directory):
+        self.source_directory = os.path.abspath(source_directory)
+        self.directory = os.path.abspath(directory)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __getstate__(self):
+        return {'source_directory': self.source_directory, 'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def sync(self):
+        """Convert new and changed source files, drop removed ones; return list()."""
+        with self._lock:
+            sources = self._sources()
+            for name, path in sources.items():
+                try:
+                    stamp = _stamp(os.stat(path))
+                    meta = _read_meta(os.path.join(self.directory, name))
+                    if meta is None or meta['stamp'] != stamp:
+                        self._convert(name, path, stamp)
+                except Exception as e:
+                    logger.warning(f"Could not convert dataset {name}: {str(e)}")
+            for name in os.listdir(self.directory):
+                if not name.startswith('.') and name not in sources:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                    logger.info(f"Removed dataset {name}")
+        return self.list()
+
+    def list(self):
+        """Return a summary of every converted dataset, by name."""
+        datasets = []
+        for name in list_datasets(self.directory):
+            meta = _read_meta(os.path.join(self.directory, name))
+            if meta is not None:
+                columns = [{'name': column['name'], 'dtype': column['dtype']} for column in meta['columns']]
+                datasets.append({'name': name, 'kind': meta['kind'], 'source': meta['source'],
+                                 'rows': meta['rows'], 'shape': meta.get('shape'), 'bytes': meta['bytes'],
+                                 'columns': columns if meta['kind'] == 'table' else None})
+        return datasets
+
+    def map(self):
+        """Point the helpers at this store and map every dataset into this process."""
+        global _directory
+        _directory = self.directory
+        for name in list_datasets():
+            try:
+                _open(name)
+            except Exception as e:
+                logger.warning(f"Could not map dataset {name}: {str(e)}")
+
+    def _sources(self):
+        """Return {dataset name: source path}."""
+        sources = {}
+        try:
+            names = sorted(os.listdir(self.source_directory))
+        except FileNotFoundError:
+            return sources
+        for filename in names:
+            name, suffix = os.path.splitext(filename)
+            if filename.startswith('.') or suffix.lower() not in SOURCE_SUFFIXES:
+                continue
+            if name in sources:
+                logger.warning(f"Ignoring {filename}: there is another dataset named {name}")
+                continue
+            sources[name] = os.path.join(self.source_directory, filename)
+        return sources
+
+    def _convert(self, name, path, stamp):
+        start = time.perf_counter()
+        tmp = os.path.join(self.directory, f'.{name}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            if path.lower().endswith('.npy'):
+                meta = _convert_array(path, tmp)
+            else:
+                meta = _convert_table(path, tmp)
+            meta.update(stamp=stamp, source=os.path.basename(path))
+            meta['bytes'] = sum(entry.stat().st_size for entry in os.scandir(tmp))
+            with open(os.path.join(tmp, META_FILE), 'w') as f:
+                json.dump(meta, f)
+
+            # Runs that mapped the old files keep reading them until they finish
+            final = os.path.join(self.directory, name)
+            old = tmp + '.old'
+            if os.path.exists(final):
+                os.rename(final, old)
+            os.rename(tmp, final)
+            shutil.rmtree(old, ignore_errors=True)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        logger.info(f"Converted dataset {name} ({meta['rows']} rows) in {time.perf_counter() - start:.2f}s")
+
+
+def _stamp(stat):
+    """Identify a version of a source file (and of the conversion)."""
+    return f'{FORMAT_VERSION}-{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _convert_array(path, directory):
+    import numpy as np
+
+    # Object arrays cannot be memory-mapped; this raises for them
+    values = np.load(path, mmap_mode='r')
+    shutil.copyfile(path, os.path.join(directory, 'data.npy'))
+    return {'kind': 'array', 'rows': int(values.shape[0]) if values.ndim else 1, 'shape': list(values.shape),
+            'columns': [{'name': None, 'dtype': str(values.dtype), 'file': 'data.npy'}]}
+
+
+def _code_dtype(count):
+    """The integer type pandas keeps the codes of ``count`` categories in, so they are not copied."""
+    import numpy as np
+
+    for dtype in (np.int8, np.int16, np.int32):
+        if count < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _table_columns(path):
+    """Yield (name, values, categories or None) for the columns of a CSV file."""
+    import numpy as np
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+    if pd is not None:
+        df = pd.read_csv(path)
+        for name in df.columns:
+            series = df[name]
+            if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufcmM':
+                yield str(name), series.to_numpy(), None
+            else:
+                codes, uniques = pd.factorize(series)  # Missing values get code -1
+                yield str(name), codes, np.asarray(uniques, dtype=str)
+        return
+
+    table = np.atleast_1d(np.genfromtxt(path, delimiter=',', names=True, dtype=None, encoding='utf-8'))
+    for name in table.dtype.names:
+        values = table[name]
+        if values.dtype.kind in 'biufcmM':
+            yield name, values, None
+        else:
+            categories, codes = np.unique(values.astype(str), return_inverse=True)
+            yield name, codes, categories
+
+
+def _convert_table(path, directory):
+    import numpy as np
+
+    columns = []
+    rows = 0
+    for i, (name, values, categories) in enumerate(_table_columns(path)):
+        column = {'name': name, 'dtype': str(values.dtype) if categories is None else 'category', 'file': f'{i}.npy'}
+        if categories is not None:
+            values = values.astype(_code_dtype(len(categories)))
+            column['categories'] = f'{i}.categories.npy'
+            np.save(os.path.join(directory, column['categories']), categories)
+        np.save(os.path.join(directory, column['file']), np.ascontiguousarray(values))
+        columns.append(column)
+        rows = len(values)
+    return {'kind': 'table', 'rows': rows, 'columns': columns}
+
+
+def _open(name):
+    """Return (meta, columns) of a dataset, mapping its files if this process has not yet."""
+    import numpy as np
+
+    path = os.path.join(_directory, name)
+    meta = _read_meta(path) if '/' not in name and os.sep not in name and not name.startswith('.') else None
+    if meta is None:
+        raise KeyError(f"No dataset named {name!r}; available: {', '.join(list_datasets()) or 'none'}")
+    with _mapped_lock:
+        mapped = _mapped.get(name)
+        if mapped is not None and mapped[0] == meta['stamp']:
+            return mapped[1], mapped[2]
+        columns = {}
+        for column in meta['columns']:
+            values = np.load(os.path.join(path, column['file']), mmap_mode='r')
+            categories = np.load(os.path.join(path, column['categories'])) if 'categories' in column else None
+            columns[column['name']] = (values, categories)
+        _mapped[name] = (meta['stamp'], meta, columns)
+        return meta, columns
+
+
+def list_datasets(directory=None):
+    """Return the names of the shared datasets."""
+    directory = directory or _directory
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names
+                  if not name.startswith('.') and os.path.exists(os.path.join(directory, name, META_FILE)))
+
+
+def array(name, column=None):
+    """Return an array dataset, or a column of a table, as a read-only NumPy array.
+
+    String columns are returned as object arrays of their values (with
+    None for missing ones), which unlike the other columns is a copy.
+    """
+    meta, columns = _open(name)
+    if meta['kind'] == 'array':
+        if column is not None:
+            raise ValueError(f"Dataset {name!r} is an array and has no columns")
+        return columns[None][0]
+    if column not in columns:
+        raise KeyError(f"Dataset {name!r} has no column {column!r}; columns: {', '.join(columns)}")
+    values, categories = columns[column]
+    if categories is None:
+        return values
+    decoded = categories.astype(object)[values]
+    decoded[values < 0] = None
+    return decoded
+
+
+def frame(name, columns=None):
+    """Return a table dataset as a pandas DataFrame sharing its memory.
+
+    ``columns`` selects some of the columns. String columns become
+    categoricals.
+    """
+    import pandas as pd
+
+    meta, mapped = _open(name)
+    if meta['kind'] != 'table':
+        raise ValueError(f"Dataset {name!r} is an array; use array({name!r})")
+    data = {}
+    for column in columns or list(mapped):
+        if column not in mapped:
+            raise KeyError(f"Dataset {name!r} has no column {column!r}; columns: {', '.join(mapped)}")
+        values, categories = mapped[column]
+        if categories is not None:
+            # The codes were written in the type pandas keeps them in, so they are not copied
+            values = pd.Categorical.from_codes(values, pd.Index(categories), validate=False)
+        data[column] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def load(name):
+    """Return a dataset: a DataFrame for tables (a dict of arrays without pandas), else an array."""
+    meta, columns = _open(name)
+    if meta['kind'] == 'array':
+        return array(name)
+    try:
+        return frame(name)
+    except ImportError:
+        return {column: array(name, column) for column in columns}
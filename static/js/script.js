@@ -50,9 +50,12 @@ print("Array example:", np.random.rand(5))
 
     // Track current file
     let currentFile = null;
+    // Its text and hash as last loaded or saved, so that saves can send only the changed lines
+    let savedVersion = null;
 
     // UI elements
     const runCodeBtn = document.getElementById('runCode');
+    const profileCodeBtn = document.getElementById('profileCode');
     const clearOutputBtn = document.getElementById('clearOutput');
     const outputText = document.getElementById('outputText');
     const errorText = document.getElementById('errorText');
@@ -76,14 +79,15 @@ print("Array example:", np.random.rand(5))
     const examplesList = document.getElementById('examplesList');
     
     // Event listeners
-    runCodeBtn.addEventListener('click', runCode);
+    runCodeBtn.addEventListener('click', () => runCode());
+    profileCodeBtn && profileCodeBtn.addEventListener('click', () => runCode('cprofile'));
     clearOutputBtn.addEventListener('click', clearOutput);
     newFileBtn.addEventListener('click', newFile);
     openFileBtn.addEventListener('click', openFile);
     saveFileBtn.addEventListener('click', () => saveFileModal.show());
     document.getElementById('saveFileBtn').addEventListener('click', saveFile);
     formatCodeBtn.addEventListener('click', formatCode);
-    lintCodeBtn.addEventListener('click', lintCode);
+    lintCodeBtn.addEventListener('click', () => lintCode());
     themeDarkBtn.addEventListener('click', () => setTheme('dark'));
     themeLightBtn.addEventListener('click', () => setTheme('light'));
     refreshFilesBtn && refreshFilesBtn.addEventListener('click', updateFileList);
@@ -91,8 +95,16 @@ print("Array example:", np.random.rand(5))
     copyOutputBtn && copyOutputBtn.addEventListener('click', copyOutput);
     fileSearchInput && fileSearchInput.addEventListener('input', filterFiles);
 
-    // Run code function
-    function runCode() {
+    // Lint in the background once typing pauses
+    const LINT_DEBOUNCE_MS = 750;
+    let lintTimer = null;
+    editor.on('changes', () => {
+        clearTimeout(lintTimer);
+        lintTimer = setTimeout(() => lintCode(true), LINT_DEBOUNCE_MS);
+    });
+
+    // Run code function; profile is a profiler mode ('cprofile' or 'sampling') or null
+    function runCode(profile = null) {
         // Clear previous output
         clearOutput();
         
@@ -103,31 +115,64 @@ print("Array example:", np.random.rand(5))
         runCodeBtn.innerHTML = '<span class="spinner"></span> Running...';
         runCodeBtn.disabled = true;
         
+        // Output arrives as Server-Sent Events while the code is running
+        let stdout = '';
+        let stderr = '';
+        let figureCount = 0;
+        let exception = null;
+        
+        function handleEvent(type, data) {
+            if (type === 'stdout') {
+                stdout += data.text;
+                outputText.textContent = stdout;
+            } else if (type === 'stderr') {
+                stderr += data.text;
+                errorText.textContent = stderr;
+            } else if (type === 'figure') {
+                const img = document.createElement('img');
+                img.src = data.url;
+                visualOutput.appendChild(img);
+                figureCount++;
+            } else if (type === 'exception') {
+                exception = data;
+            } else if (type === 'profile') {
+                stdout += formatProfile(data);
+                outputText.textContent = stdout;
+                if (data.flamegraph) {
+                    const img = document.createElement('img');
+                    img.src = data.flamegraph.url;
+                    img.alt = 'Flame graph';
+                    visualOutput.appendChild(img);
+                }
+            }
+        }
+        
         // Send the code to the server for execution
-        fetch('/api/run', {
+        fetch('/api/run/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ code: code })
+            body: JSON.stringify(profile ? { code: code, profile: profile } : { code: code })
         })
-        .then(response => response.json())
-        .then(data => {
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Server returned ' + response.status);
+            }
+            return readEventStream(response, handleEvent);
+        })
+        .then(() => {
             // Display the output
-            outputText.textContent = data.stdout || 'No output';
-            errorText.textContent = data.stderr || 'No errors';
+            outputText.textContent = stdout || 'No output';
+            errorText.textContent = stderr || 'No errors';
+            if (exception && exception.line) {
+                showExceptionLine(exception);
+            }
             
-            // Display visualizations
-            if (data.figures && data.figures.length > 0) {
-                data.figures.forEach(imgData => {
-                    const img = document.createElement('img');
-                    img.src = 'data:image/png;base64,' + imgData;
-                    visualOutput.appendChild(img);
-                });
-                
+            if (figureCount > 0) {
                 // Activate the Visualizations tab if there are figures
                 document.getElementById('visual-tab').click();
-            } else if (data.stderr && data.stderr.trim() !== '') {
+            } else if (stderr.trim() !== '') {
                 // Activate the Errors tab if there are errors
                 document.getElementById('error-tab').click();
             } else {
@@ -156,6 +201,78 @@ print("Array example:", np.random.rand(5))
         });
     }
 
+    // Highlight the line the code raised an exception from and move the cursor there
+    function showExceptionLine(exception) {
+        const line = exception.line - 1;
+        editor.eachLine(handle => editor.removeLineClass(handle, 'background', 'cm-error-line'));
+        editor.addLineClass(line, 'background', 'cm-error-line');
+        editor.setCursor({ line: line, ch: exception.column ? exception.column - 1 : 0 });
+        editor.scrollIntoView(null, 100);
+    }
+
+    // Render a profile report as text below the program's output
+    function formatProfile(report) {
+        const ms = seconds => (seconds * 1000).toFixed(1).padStart(9) + ' ms';
+        const where = f => (f.file === '<code>' ? 'line ' : f.file.split('/').pop() + ':') + f.line;
+        let text = '\n=== Profile (' + report.mode + ') ===\n';
+        text += 'Wall time ' + ms(report.wall_seconds).trim() + ', profiler overhead ' +
+            ms(report.overhead.seconds).trim() + ' (' + report.overhead.percent + '%, ' + report.overhead.method + ')\n';
+        text += '\nTop functions by self time:\n';
+        report.top_self.slice(0, 10).forEach(f => {
+            text += ms(f.self_seconds) + ms(f.cumulative_seconds) +
+                (f.calls === null ? '' : String(f.calls).padStart(9) + ' calls') + '  ' + f.function + ' (' + where(f) + ')\n';
+        });
+        if (report.lines.length) {
+            text += '\nHot lines in your code:\n';
+            report.lines.forEach(l => {
+                text += String(l.percent).padStart(6) + '%  line ' + l.line + ': ' + (l.source || '') + '\n';
+            });
+        }
+        return text;
+    }
+
+    // Read a text/event-stream response, calling onEvent(type, data) per event
+    function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        function dispatch(block) {
+            let type = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    type = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (data) {
+                onEvent(type, JSON.parse(data));
+            }
+        }
+        
+        function pump() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    if (buffer.trim()) {
+                        dispatch(buffer);
+                    }
+                    return;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    dispatch(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+                }
+                return pump();
+            });
+        }
+        
+        return pump();
+    }
+
     // Clear output function
     function clearOutput() {
         outputText.textContent = '';
@@ -169,6 +286,7 @@ print("Array example:", np.random.rand(5))
             editor.setValue('# New Python file\n\n');
             clearOutput();
             currentFile = null;
+            savedVersion = null;
             updateFileName('Code Editor');
         }
     }
@@ -234,6 +352,7 @@ print("Array example:", np.random.rand(5))
                 editor.setValue(data.code);
                 clearOutput();
                 currentFile = filename;
+                savedVersion = { text: data.code, hash: data.hash };
                 updateFileName(filename);
                 showToast(`File "${filename}" loaded`);
             } else {
@@ -246,6 +365,50 @@ print("Array example:", np.random.rand(5))
         });
     }
 
+    // The lines of newText that differ from oldText, as one /api/save patch hunk
+    function linePatch(oldText, newText) {
+        const oldLines = oldText.split('\n');
+        const newLines = newText.split('\n');
+        let start = 0;
+        while (start < oldLines.length && start < newLines.length && oldLines[start] === newLines[start]) {
+            start++;
+        }
+        let oldEnd = oldLines.length;
+        let newEnd = newLines.length;
+        while (oldEnd > start && newEnd > start && oldLines[oldEnd - 1] === newLines[newEnd - 1]) {
+            oldEnd--;
+            newEnd--;
+        }
+        return [{ start: start, delete: oldEnd - start, insert: newLines.slice(start, newEnd) }];
+    }
+
+    // Save code to a file, as a patch when it is the current file as last loaded or saved
+    function saveSource(filename, code) {
+        const base = filename === currentFile ? savedVersion : null;
+        const body = base && base.hash
+            ? { filename: filename, base: base.hash, patch: linePatch(base.text, code) }
+            : { filename: filename, code: code };
+        return fetch('/api/save', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(body)
+        })
+        .then(response => response.json().then(data => ({ status: response.status, data: data })))
+        .then(({ status, data }) => {
+            if (status === 409 && body.patch) {
+                // Changed on the server since; send the whole code
+                savedVersion = null;
+                return saveSource(filename, code);
+            }
+            if (data.success) {
+                savedVersion = { text: code, hash: data.hash };
+            }
+            return data;
+        });
+    }
+
     // Save file function
     function saveFile() {
         const filename = document.getElementById('saveFileName').value;
@@ -256,17 +419,7 @@ print("Array example:", np.random.rand(5))
         
         const code = editor.getValue();
         
-        fetch('/api/save', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ 
-                filename: filename,
-                code: code 
-            })
-        })
-        .then(response => response.json())
+        saveSource(filename, code)
         .then(data => {
             if (data.success) {
                 saveFileModal.hide();
@@ -286,18 +439,56 @@ print("Array example:", np.random.rand(5))
         });
     }
 
-    // Format code function
-    function formatCode() {
-        const code = editor.getValue();
-        
-        fetch('/api/format', {
+    // Hashes of sources the server has seen; requests for them send only the hash
+    const serverHashes = new Set();
+
+    function sha256Hex(text) {
+        // crypto.subtle is only available on https:// and localhost
+        if (!window.crypto || !crypto.subtle) {
+            return Promise.resolve(null);
+        }
+        return crypto.subtle.digest('SHA-256', new TextEncoder().encode(text))
+            .then(buf => Array.from(new Uint8Array(buf), b => b.toString(16).padStart(2, '0')).join(''));
+    }
+
+    // POST code (or just its hash, when the server already has it) and return the JSON reply
+    function postSource(url, code, extra) {
+        const post = body => fetch(url, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ code: code })
+            body: JSON.stringify(Object.assign(body, extra))
+        });
+        
+        return sha256Hex(code)
+        .then(hash => {
+            if (!hash || !serverHashes.has(hash)) {
+                return post({ code: code });
+            }
+            return post({ hash: hash }).then(response => {
+                if (response.status !== 404) {
+                    return response;
+                }
+                // The server has forgotten this source
+                serverHashes.delete(hash);
+                return post({ code: code });
+            });
         })
         .then(response => response.json())
+        .then(data => {
+            if (data.hash) {
+                serverHashes.add(data.hash);
+            }
+            return data;
+        });
+    }
+
+    // Format code function
+    function formatCode() {
+        const code = editor.getValue();
+        
+        postSource('/api/format', code, {})
         .then(data => {
             if (data.error) {
                 errorText.textContent = 'Formatting error: ' + data.error;
@@ -316,45 +507,91 @@ print("Array example:", np.random.rand(5))
         });
     }
 
-    // Lint code function
-    function lintCode() {
+    // Lint code function: pyflakes answers first, the full pylint pass follows.
+    // Background (quiet) lints only highlight lines.
+    let lintGeneration = 0;
+
+    function lintCode(quiet = false) {
         const code = editor.getValue();
+        const generation = ++lintGeneration;
         
-        fetch('/api/lint', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ code: code })
-        })
-        .then(response => response.json())
+        postSource('/api/lint', code, { mode: 'fast' })
         .then(data => {
-            if (data.error) {
-                errorText.textContent = 'Linting error: ' + data.error;
-                showToast('Linting error', 'error');
-            } else if (data.issues && data.issues.length > 0) {
-                let lintOutput = 'Linting issues found:\n\n';
-                data.issues.forEach(issue => {
-                    lintOutput += `Line ${issue.line}, Column ${issue.column}: ${issue.message} (${issue.symbol})\n`;
-                    // Highlight the line in the editor
-                    editor.addLineClass(issue.line - 1, 'background', 'cm-error-line');
-                });
-                errorText.textContent = lintOutput;
-                showToast(`Found ${data.issues.length} linting issues`, 'warning');
-            } else {
-                errorText.textContent = 'No linting issues found';
-                showToast('No linting issues found', 'success');
+            if (generation !== lintGeneration) {
+                return;  // The code has changed since
+            }
+            showLintIssues(data, !data.pending, quiet);
+            if (data.pending) {
+                pollLintResult(data.hash, generation, quiet);
+            } else if (data.hash) {
+                fetch(`/api/lint/${data.hash}`)
+                    .then(response => response.json())
+                    .then(full => generation === lintGeneration && showLintIssues(full, true, quiet));
             }
-            document.getElementById('error-tab').click();
         })
         .catch(error => {
             console.error('Error:', error);
-            errorText.textContent = 'Error: ' + error.message;
-            document.getElementById('error-tab').click();
-            showToast('Error: ' + error.message, 'error');
+            if (!quiet) {
+                errorText.textContent = 'Error: ' + error.message;
+                document.getElementById('error-tab').click();
+                showToast('Error: ' + error.message, 'error');
+            }
         });
     }
 
+    // Wait for the full lint pass of a fast lint request
+    function pollLintResult(hash, generation, quiet) {
+        setTimeout(() => {
+            if (generation !== lintGeneration) {
+                return;
+            }
+            fetch(`/api/lint/${hash}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (generation !== lintGeneration) {
+                        return;
+                    }
+                    if (data.pending) {
+                        pollLintResult(hash, generation, quiet);
+                    } else {
+                        showLintIssues(data, true, quiet);
+                    }
+                })
+                .catch(error => console.error('Error:', error));
+        }, 250);
+    }
+
+    function showLintIssues(data, final, quiet) {
+        editor.eachLine(line => editor.removeLineClass(line, 'background', 'cm-error-line'));
+        (data.issues || []).forEach(issue => {
+            // Highlight the line in the editor
+            editor.addLineClass(issue.line - 1, 'background', 'cm-error-line');
+        });
+        if (quiet) {
+            return;
+        }
+        
+        if (data.error) {
+            errorText.textContent = 'Linting error: ' + data.error;
+            showToast('Linting error', 'error');
+        } else if (data.issues && data.issues.length > 0) {
+            let lintOutput = final ? 'Linting issues found:\n\n' : 'Linting issues found (full check running):\n\n';
+            data.issues.forEach(issue => {
+                lintOutput += `Line ${issue.line}, Column ${issue.column}: ${issue.message} (${issue.symbol})\n`;
+            });
+            errorText.textContent = lintOutput;
+            if (final) {
+                showToast(`Found ${data.issues.length} linting issues`, 'warning');
+            }
+        } else if (final) {
+            errorText.textContent = 'No linting issues found';
+            showToast('No linting issues found', 'success');
+        } else {
+            errorText.textContent = 'No issues found so far (full check running)';
+        }
+        document.getElementById('error-tab').click();
+    }
+
     // Set theme function
     function setTheme(theme) {
         if (theme === 'dark') {
@@ -564,17 +801,7 @@ print("Array example:", np.random.rand(5))
             if (currentFile) {
                 // Save current file directly
                 const code = editor.getValue();
-                fetch('/api/save', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({ 
-                        filename: currentFile,
-                        code: code 
-                    })
-                })
-                .then(response => response.json())
+                saveSource(currentFile, code)
                 .then(data => {
                     if (data.success) {
                         showToast(`File "${currentFile}" saved`);
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+os.environ.setdefault('WORKER_POOL_SIZE', '0')
+os.environ.setdefault('PREWARM', '0')
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('field', ['timeout', 'total_timeout'])
+@pytest.mark.parametrize('value', [0, -1, 'nan', 'inf', '-inf', None, 'soon'])
+def test_batch_rejects_invalid_time_limits(client, field, value):
+    response = client.post('/api/run/batch', json={'items': [{'code': 'pass'}], field: value})
+    assert response.status_code == 400
+
+
+def test_batch_accepts_time_limits(client):
+    response = client.post('/api/run/batch', json={'items': [{'code': "print('ok')"}], 'timeout': 5,
+                                                    'total_timeout': '10'})
+    assert response.status_code == 200
+    assert '"stdout": "ok\\n"' in response.get_data(as_text=True)
+
+
+def test_in_process_tests_are_time_limited(client, monkeypatch):
+    monkeypatch.setattr(app, 'MAX_EXECUTION_TIME', 1)
+    code = "import time\n\ndef test_quick():\n    assert True\n\ndef test_hangs():\n    time.sleep(60)\n"
+    response = client.post('/api/test', json={'code': code, 'select': ['test_submission.py::test_hangs']})
+    report = response.get_json()
+    assert response.status_code == 200
+    assert [test['outcome'] for test in report['tests']] == ['error']
+    assert 'timed out' in report['stderr']
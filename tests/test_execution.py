@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+from execution import OutputCapture, execute
+from worker_pool import WorkerPool
+
+EXITS = [
+    ("print('before'); import sys; sys.exit(0)", ''),
+    ("print('before'); exit()", ''),
+    ("print('before'); raise SystemExit(3)", ''),
+    ("print('before'); import sys; sys.exit('bye')", 'bye\n'),
+]
+
+
+@pytest.mark.parametrize('code, stderr', EXITS)
+def test_system_exit_ends_run_normally(code, stderr):
+    result = execute(code).result()
+    assert result['stdout'] == 'before\n'
+    assert result['stderr'] == stderr
+    assert 'exception' not in result
+
+
+def test_system_exit_ends_streamed_run_normally():
+    events = []
+    output = OutputCapture(on_event=lambda kind, data: events.append((kind, data)))
+    execute("print('before'); import sys; sys.exit(1)", output)
+    assert events == [('stdout', 'before\n')]
+
+
+CONCURRENT = """
+import sys
+import time
+for i in range(20):
+    print({token!r}, i)
+    print({token!r}, i, file=sys.stderr)
+    time.sleep(0.001)
+"""
+
+
+def test_concurrent_runs_keep_their_own_output():
+    tokens = [f'run-{i}' for i in range(8)]
+    results = {}
+    start = threading.Barrier(len(tokens))
+
+    def run(token):
+        start.wait()
+        results[token] = execute(CONCURRENT.format(token=token)).result()
+
+    threads = [threading.Thread(target=run, args=(token,)) for token in tokens]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for token in tokens:
+        expected = ''.join(f'{token} {i}\n' for i in range(20))
+        assert results[token]['stdout'] == expected
+        assert results[token]['stderr'] == expected
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = WorkerPool(size=1, max_runs=100)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize('code, stderr', EXITS)
+def test_system_exit_in_worker(pool, code, stderr):
+    result = pool.run(code, 10)
+    assert result['stdout'] == 'before\n'
+    assert result['stderr'] == stderr
+    assert 'error' not in result
+
+
+def test_timeout_before_run_starts_keeps_worker(pool):
+    workers = set(pool._workers)
+    # Times out before the worker announces the forked run
+    result = pool.run("import time; time.sleep(30)", 1e-6)
+    assert result['error'] == 'timeout'
+    assert pool._workers == workers
+    assert pool.run("print('next')", 10)['stdout'] == 'next\n'
@@ -0,0 +1,41 @@
+import time
+import threading
+
+import file_store
+from file_store import write_range
+
+
+class SlowStream:
+    """A request body that arrives a block at a time."""
+
+    def __init__(self, data, delay=0.01):
+        self.blocks = [data[i:i + file_store.BLOCK_SIZE] for i in range(0, len(data), file_store.BLOCK_SIZE)]
+        self.delay = delay
+
+    def read(self, size):
+        time.sleep(self.delay)
+        return self.blocks.pop(0) if self.blocks else b''
+
+
+def test_concurrent_uploads_to_the_same_path_do_not_interleave(tmp_path):
+    path = str(tmp_path / 'script.py')
+    uploads = [bytes([ord('a') + i]) * (8 * file_store.BLOCK_SIZE) for i in range(4)]
+    errors = []
+
+    def upload(data):
+        try:
+            write_range(path, SlowStream(data), 0, len(data), 2 ** 20)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload, args=(data,)) for data in uploads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with open(path, 'rb') as f:
+        assert f.read() in uploads
+    assert not (tmp_path / '.script.py.upload').exists()
+    assert not file_store._upload_locks
@@ -0,0 +1,27 @@
+import threading
+
+from jobs import JobQueue, CANCELLED, DONE
+
+
+def test_shutdown_cancels_queued_jobs():
+    queue = JobQueue(workers=1, max_queued=10)
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(cancel):
+        started.set()
+        release.wait(10)
+        return 'ran'
+
+    running = queue.submit(blocking)
+    started.wait(10)
+    queued = [queue.submit(lambda cancel: 'never') for _ in range(3)]
+    assert not queue.shutdown()  # The first job is still running
+    release.set()
+    assert queue.shutdown(timeout=10)
+
+    assert running.status == DONE and running.result == 'ran'
+    for job in queued:
+        assert job.status == CANCELLED
+        assert job.finished_at is not None
+        assert job.error == 'Server shutting down'
+    assert queue.stats()['queued'] == 0
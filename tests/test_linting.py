@@ -0,0 +1,100 @@
+import pytest
+
+from linting import LintService
+
+GLOBAL = '''\
+def init():
+    global CONFIG
+    CONFIG = {'debug': True}
+
+def report():
+    return BODY
+
+init()
+print(CONFIG)
+'''
+
+NESTED_GLOBAL = '''\
+def setup():
+    def inner():
+        global STATE
+        STATE = 1
+    inner()
+
+def report():
+    return BODY
+
+setup()
+print(STATE)
+'''
+
+PLAIN = '''\
+import os
+
+def first():
+    return os.getcwd()
+
+def second():
+    return BODY
+
+print(first(), second())
+'''
+
+CALLEE = '''\
+def make():
+    return [1, 2]
+
+
+def use():
+    x = make()
+    return x.nosuch
+'''
+
+CALLER_EDITED = '''\
+def make():
+    return [1, 2]
+
+
+def use():
+    y = 1
+    x = make()
+    return x.nosuch
+'''
+
+BROKEN = '''\
+def first():
+    return undefined_name
+
+def second():
+    return BODY
+'''
+
+
+@pytest.mark.parametrize('template', [GLOBAL, NESTED_GLOBAL, PLAIN, BROKEN],
+                         ids=['global', 'nested-global', 'plain', 'broken'])
+def test_incremental_lint_matches_fresh_lint(template):
+    before, after = template.replace('BODY', '1'), template.replace('BODY', 'missing')
+    incremental = LintService()
+    incremental.full(before)
+    assert incremental.full(after) == LintService().full(after)
+    assert incremental.full(before) == LintService().full(before)
+
+
+@pytest.mark.parametrize('before, after', [(CALLEE, CALLER_EDITED), (CALLER_EDITED, CALLEE),
+                                           (CALLEE, CALLEE.replace('[1, 2]', 'dict()'))],
+                         ids=['caller-edited', 'caller-reverted', 'callee-edited'])
+def test_incremental_lint_infers_through_reused_functions(before, after):
+    incremental = LintService()
+    incremental.full(before)
+    assert incremental.full(after) == LintService().full(after)
+
+
+def test_unused_functions_are_reused():
+    code = 'def one():\n    return 1\n\n\ndef two():\n    return BODY\n'
+    incremental = LintService()
+    incremental.full(code.replace('BODY', '2'))
+    linted = []
+    run = incremental._pylint
+    incremental._pylint = lambda source: linted.append(source) or run(source)
+    assert incremental.full(code.replace('BODY', 'missing')) == LintService().full(code.replace('BODY', 'missing'))
+    assert 'return 1' not in linted[0]  # one() was stubbed
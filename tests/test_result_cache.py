@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from result_cache import DiskBackend, find_nondeterminism
+
+NONDETERMINISTIC = [
+    "from numpy.random import rand\nprint(rand())",
+    "from numpy import random\nprint(random.rand())",
+    "import numpy.random as npr\nprint(npr.rand())",
+    "import numpy as np\nprint(np.random.rand())",
+    "import torch\nprint(torch.rand(3))",
+    "import torch\nprint(torch.randn(3))",
+    "from torch import randperm\nprint(randperm(5))",
+    "import tensorflow as tf\nprint(tf.random.normal([2]))",
+    "from tensorflow.random import uniform\nprint(uniform([2]))",
+    "from sklearn.utils import shuffle\nprint(shuffle([1, 2, 3]))",
+    "from sklearn.model_selection import train_test_split\nprint(train_test_split([1, 2, 3, 4]))",
+    "import pandas as pd\nprint(pd.DataFrame({'a': [1, 2]}).sample(1))",
+    "import random\nrandom.seed(0)\nprint(random.random())",
+]
+
+DETERMINISTIC = [
+    "import numpy as np\nnp.random.seed(0)\nprint(np.random.rand())",
+    "from numpy.random import rand, seed\nseed(1)\nprint(rand())",
+    "import torch\ntorch.manual_seed(0)\nprint(torch.rand(3))",
+    "import tensorflow as tf\ntf.random.set_seed(0)\nprint(tf.random.normal([2]))",
+    "from sklearn.utils import shuffle\nprint(shuffle([1, 2, 3], random_state=0))",
+    "import numpy as np\nprint(np.arange(10).sum())",
+    "from math import sqrt\nprint(sqrt(2))",
+]
+
+
+@pytest.mark.parametrize('code', NONDETERMINISTIC)
+def test_random_code_is_not_cached(code):
+    assert find_nondeterminism(code) is not None
+
+
+@pytest.mark.parametrize('code', DETERMINISTIC)
+def test_deterministic_code_is_cached(code):
+    assert find_nondeterminism(code) is None
+
+
+def test_disk_backend_concurrent_stores_of_one_key(tmp_path):
+    backend = DiskBackend(str(tmp_path), max_bytes=2 ** 20, ttl=60)
+    values = [{'stdout': str(i) * 50000} for i in range(8)]
+    errors = []
+
+    def put(value):
+        try:
+            backend.put('key', value)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put, args=(value,)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert backend.get('key') in values
+    assert not [path for path in tmp_path.iterdir() if path.suffix == '.tmp']
@@ -0,0 +1,57 @@
+import os
+import time
+import signal
+import threading
+
+import pytest
+
+from sessions import SessionManager, SessionLimitError
+
+
+@pytest.fixture
+def manager():
+    manager = SessionManager(max_sessions=2)
+    yield manager
+    manager.shutdown()
+
+
+def test_concurrent_creates_respect_max_sessions(manager):
+    created, refused = [], []
+
+    def create():
+        try:
+            session = manager.create()
+            session.lock.acquire()  # Busy, so that no other create evicts it
+            created.append(session)
+        except SessionLimitError:
+            refused.append(True)
+
+    threads = [threading.Thread(target=create) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(manager.list()) <= 2
+    assert len(created) + len(refused) == 6
+    for session in created:
+        session.lock.release()
+
+
+def test_interrupt_after_cell_does_not_kill_kernel(manager):
+    session = manager.create()
+    assert manager.run(session.id, 'x = 41', 10).get('error') is None
+    # What a timed-out exchange sends, arriving after the cell finished
+    for _ in range(20):
+        os.kill(session.worker.pid, signal.SIGINT)
+        time.sleep(0.01)
+    result = manager.run(session.id, 'print(x + 1)', 10)
+    assert result['stdout'] == '42\n'
+    assert session.worker.process.is_alive()
+
+
+def test_interrupt_stops_running_cell(manager):
+    session = manager.create()
+    result = manager.run(session.id, 'y = 1\nimport time\nwhile True: time.sleep(0.01)', 1)
+    assert result['error'] == 'timeout'
+    assert 'KeyboardInterrupt' in result['stderr']
+    assert manager.run(session.id, 'print(y)', 10)['stdout'] == '1\n'
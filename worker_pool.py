@@ -0,0 +1,503 @@
+import os
+import sys
+import queue
+import signal
+import logging
+import importlib
+import threading
+import multiprocessing
+import platform
+import time
+
+from metrics import (QUEUE_WAIT_SECONDS, RUN_WALL_SECONDS, RUN_CPU_SECONDS, RUN_PEAK_RSS_BYTES, RUNS,
+                     WORKER_RESTARTS, FIGURE_ENCODE_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+is_windows = platform.system() == 'Windows'
+can_fork = hasattr(os, 'fork')
+
+# How long to wait for a worker to report a killed run before giving up on it
+KILL_GRACE_SECONDS = 5
+# How often a cancellable run checks whether it has been cancelled (seconds)
+CANCEL_POLL_INTERVAL = 0.1
+# ru_maxrss is in kilobytes, except on macOS where it is in bytes
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+class WorkerLostError(Exception):
+    """Raised when a run can only be stopped by killing its worker.
+
+    Args are a reason to log, and the error reason and message to report
+    to the client (None if there is nothing to report).
+    """
+
+
+def preload_modules(modules):
+    """Import modules so that forked runs inherit them copy-on-write."""
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            logger.warning(f"Could not preload {name}: {e}")
+    if 'numpy' in sys.modules:
+        # numpy.random is imported lazily; do it here rather than in every run
+        importlib.import_module('numpy.random')
+    return loaded
+
+
+def worker_context(preload=()):
+    """Return the multiprocessing context that starts execution processes."""
+    # forkserver avoids forking the (multi-threaded) web server process
+    ctx = multiprocessing.get_context('spawn' if is_windows else 'forkserver')
+    if not is_windows:
+        ctx.set_forkserver_preload(['execution'] + list(preload))
+    return ctx
+
+
+def collect_events(events):
+    """Gather a run's output events into the /api/run result format."""
+    stdout, stderr, figures = [], [], []
+    error = profile = truncated = tests = exception = None
+    for kind, data in events:
+        if kind == 'stdout':
+            stdout.append(data)
+        elif kind == 'stderr':
+            stderr.append(data)
+        elif kind == 'figure':
+            figures.append(data)
+        elif kind == 'error':
+            stderr.append(data['text'])
+            error = data['reason']
+        elif kind == 'profile':
+            profile = data
+        elif kind == 'truncated':
+            truncated = data
+        elif kind == 'tests':
+            tests = data
+        elif kind == 'exception':
+            exception = data
+    result = {'stdout': ''.join(stdout), 'stderr': ''.join(stderr), 'figures': figures}
+    if error:
+        result['error'] = error
+    if profile is not None:
+        result['profile'] = profile
+    if truncated is not None:
+        result['truncated'] = truncated
+    if tests is not None:
+        result['tests'] = tests
+    if exception is not None:
+        result['exception'] = exception
+    return result
+
+
+def _reseed_after_fork():
+    """Give each forked run its own random state."""
+    # The random module reseeds itself on fork; NumPy's global state does not
+    numpy = sys.modules.get('numpy')
+    if numpy is not None:
+        numpy.random.seed()
+
+
+def _run_payload(conn, payload, figure_store=None):
+    """Execute a run, sending its output events over the pipe."""
+    from execution import OutputCapture, execute
+    from profiler import Profiler
+
+    # Output is flushed from a background thread too, so serialise sends
+    send_lock = threading.Lock()
+    def send(kind, data):
+        with send_lock:
+            conn.send((kind, data))
+
+    # The process serves only this run, so capture output from all its threads
+    output = OutputCapture(on_event=send, figure_store=figure_store, stdin=payload.get('stdin'))
+    if payload.get('pytest') is not None:
+        from pytest_runner import run_pytest
+        spec = payload['pytest']
+        send('tests', run_pytest(payload['code'], output, spec.get('node_ids'), spec.get('collect', False)))
+        send('done', {'figure_timings': output.figure_timings})
+        return
+
+    profiler = Profiler(payload['profile']) if payload.get('profile') else None
+    execute(payload['code'], output, process_wide=True, profiler=profiler, compiled=payload.get('compiled'))
+    if profiler is not None:
+        send('profile', profiler.report(figure_store, payload['code']))
+    send('done', {'figure_timings': output.figure_timings})
+
+
+def _run_forked(conn, payload, figure_store=None, limits=None, leaf=None):
+    """Zygote side of a run: fork a child that executes the code.
+
+    The child leads its own process group, so killing the group stops
+    anything the run started as well. Returns the exit payload, which
+    includes the run's wall time, CPU time and peak RSS.
+    """
+    start = time.monotonic()
+    ready_r, ready_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child: wait until the parent has announced our pid, then run
+        try:
+            os.setpgid(0, 0)
+            os.close(ready_w)
+            os.read(ready_r, 1)
+            os.close(ready_r)
+            if limits is not None:
+                limits.apply(leaf)
+            _reseed_after_fork()
+            _run_payload(conn, payload, figure_store)
+        finally:
+            os._exit(0)
+
+    # Set the group here too, so it exists before anyone tries to kill it
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    oom_kills = limits.oom_kills(leaf) if leaf else 0
+    os.close(ready_r)
+    conn.send(('started', {'pid': pid}))
+    try:
+        os.write(ready_w, b'x')
+    except BrokenPipeError:
+        pass  # Killed as soon as it was announced, e.g. by a deadline that had already passed
+    os.close(ready_w)
+    _, status, usage = os.wait4(pid, 0)
+    wall_seconds = time.monotonic() - start
+    # Do not let processes started by the run outlive it
+    _kill(pid)
+    return {
+        'status': status,
+        'oom_killed': bool(leaf) and limits.oom_kills(leaf) > oom_kills,
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'max_rss_bytes': usage.ru_maxrss * RSS_UNIT
+    }
+
+
+def _worker_main(conn, preload, figure_store=None, limits=None, compile_cache=None, datasets=None):
+    """Serve run requests from the pool until told to stop."""
+    # Ctrl+C in the dev server is handled by the parent, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    leaf = limits.create_leaf(os.getpid()) if limits is not None and can_fork else None
+
+    from execution import USER_FILE, install_routing
+    import profiler  # noqa: F401
+    preload_modules(preload)
+    # Imports matplotlib whatever the preload list says, so that runs inherit it rather than import it each
+    install_routing()
+    if datasets is not None:
+        # Mapped before any run is forked, so the runs share them and the memory limit leaves them out
+        datasets.map()
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+
+        kind, payload = message
+        if kind == 'run':
+            lookup = None
+            if compile_cache is not None and payload.get('pytest') is None:
+                # Compiled here, so the code object outlives the run and is inherited by the next ones
+                payload['compiled'], lookup = compile_cache.get(payload['code'], USER_FILE)
+            if can_fork:
+                exit_payload = _run_forked(conn, payload, figure_store, limits, leaf)
+            else:
+                _run_payload(conn, payload, figure_store)
+                exit_payload = {'status': 0, 'oom_killed': False}
+            conn.send(('exit', dict(exit_payload, compile=lookup)))
+
+    if leaf is not None:
+        limits.remove_leaf(os.getpid())
+
+
+def describe_exit(status):
+    """Describe a waitpid() status of a run that produced no result."""
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        try:
+            name = signal.Signals(signum).name
+        except ValueError:
+            name = str(signum)
+        return f"killed by signal {name}"
+    return f"exit code {os.WEXITSTATUS(status)}"
+
+
+class Worker:
+    """A single pre-forked execution process and its control pipe."""
+
+    def __init__(self, ctx, preload=(), figure_store=None, limits=None, target=_worker_main, **options):
+        self.conn, child_conn = ctx.Pipe()
+        # Under gevent's monkey patching the pipe is created non-blocking; both ends
+        # expect whole messages, and readiness is waited for with wait() anyway
+        for end in (self.conn, child_conn):
+            os.set_blocking(end.fileno(), True)
+        self.process = ctx.Process(target=target, args=(child_conn, list(preload), figure_store, limits),
+                                   kwargs=options)
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def stop(self, timeout=1):
+        """Ask the worker to exit, killing it if it does not."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        """Kill the worker immediately."""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """Pool of warm worker processes that execute user code.
+
+    Each worker is a zygote: it imports the ``preload`` modules once and
+    then forks a fresh child per run, so runs start with NumPy, pandas and
+    friends already in memory (shared copy-on-write) and cannot leak state
+    into each other. Runs on different workers execute in parallel.
+    Workers are recycled after ``max_runs`` runs and replaced on crash.
+    Runs save figures to ``figure_store`` (a figures.FigureStore) and
+    ``limits`` (a limits.RunLimits) is enforced on every forked run.
+    With ``compile_cache`` (a compile_cache.CompileCache) workers keep the
+    code objects of the code they ran, and this process records their
+    cache lookups. With ``datasets`` (a shared_data.DatasetStore) workers
+    map the shared datasets before forking runs.
+    """
+
+    def __init__(self, size=None, max_runs=100, preload=(), figure_store=None, limits=None, compile_cache=None,
+                 datasets=None):
+        self.size = size or os.cpu_count() or 1
+        self.max_runs = max_runs
+        self.preload = list(preload)
+        self.figure_store = figure_store
+        self.limits = limits
+        self.compile_cache = compile_cache
+        self.datasets = datasets
+        self._ctx = worker_context(self.preload)
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        worker = Worker(self._ctx, self.preload, self.figure_store, self.limits, compile_cache=self.compile_cache,
+                        datasets=self.datasets)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _retire(self, worker, kill=False, reason='recycled'):
+        """Remove a worker from the pool and start a replacement."""
+        WORKER_RESTARTS.inc(reason)
+        with self._lock:
+            self._workers.discard(worker)
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def run(self, code, timeout, cancel=None, profile=None, stdin=None, pytest=None):
+        """Execute code on an idle worker and return the captured output."""
+        return collect_events(self.stream(code, timeout, cancel, profile, stdin, pytest))
+
+    def stream(self, code, timeout, cancel=None, profile=None, stdin=None, pytest=None):
+        """Execute code on an idle worker, yielding output events as they arrive.
+
+        Events are ``(kind, data)`` tuples where kind is ``stdout``,
+        ``stderr`` or ``figure``, or ``error`` with a ``reason`` and
+        ``text`` when the run was cut short. Pipe backpressure bounds buffering: the
+        run blocks on output until the consumer asks for more. Closing the
+        generator early stops the run, and so does setting the optional
+        ``cancel`` threading.Event from another thread.
+
+        With ``profile`` set to a profiler mode (see profiler.Profiler) the
+        run is profiled and a ``profile`` event with the report follows
+        its output. ``stdin`` is the text the code reads as standard input.
+
+        With ``pytest`` (see pytest_runner.TestRunner) the code is run as a
+        test file instead and a ``tests`` event carries the results.
+        """
+        waiting = time.perf_counter()
+        worker = self._idle.get()
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - waiting, 'worker')
+        if cancel is not None and cancel.is_set():
+            # Cancelled while waiting for a worker
+            self._idle.put(worker)
+            RUNS.inc('cancelled')
+            yield ('error', {'reason': 'cancelled', 'text': "ERROR: Run cancelled\n"})
+            return
+        state = {'child_pid': None, 'exited': False, 'outcome': 'ok'}
+        lost = None  # Why the worker has to be replaced, if it does
+        try:
+            worker.conn.send(('run', {'code': code, 'profile': profile, 'stdin': stdin, 'pytest': pytest}))
+            yield from self._events(worker, timeout, state, cancel)
+        except WorkerLostError as e:
+            lost = 'killed'
+            state['outcome'] = e.args[1] or 'crash'
+            logger.warning("Restarting worker %s: %s", worker.pid, e.args[0])
+            if e.args[2]:
+                yield ('error', {'reason': e.args[1], 'text': e.args[2]})
+        except (EOFError, OSError):
+            lost = state['outcome'] = 'crash'
+            worker.process.join(1)
+            exitcode = worker.process.exitcode
+            logger.error("Worker %s crashed (exit code %s), restarting it", worker.pid, exitcode)
+            yield ('error', {'reason': 'crash',
+                             'text': "ERROR: Execution worker exited unexpectedly (exit code {})\n".format(exitcode)})
+        finally:
+            if lost is None and not state['exited']:
+                # The consumer went away mid-run; stop the run before reusing the worker
+                state['outcome'] = 'abandoned'
+                if not self._abandon(worker, state):
+                    lost = 'killed'
+            RUNS.inc(state['outcome'])
+            self._release(worker, lost)
+
+    def _events(self, worker, timeout, state, cancel=None):
+        """Yield a run's output events until its worker reports the exit."""
+        conn = worker.conn
+        deadline = time.monotonic() + timeout
+        timed_out = False
+        finished = False
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if not timed_out:
+                if cancel is not None and cancel.is_set():
+                    reason, message = 'cancelled', "ERROR: Run cancelled\n"
+                elif remaining <= 0:
+                    reason, message = 'timeout', "ERROR: Code execution timed out after {} seconds\n".format(timeout)
+                elif not conn.poll(remaining if cancel is None else min(remaining, CANCEL_POLL_INTERVAL)):
+                    continue
+                else:
+                    reason = None
+                if reason:
+                    timed_out = True
+                    state['outcome'] = reason
+                    if not can_fork:
+                        # Nothing to kill but the worker itself
+                        raise WorkerLostError(f"run {reason}", reason, message)
+                    if state['child_pid'] is not None:
+                        self._kill_run(worker, state['child_pid'])
+                    # Otherwise the run is killed as soon as it is announced
+                    deadline = time.monotonic() + KILL_GRACE_SECONDS
+                    yield ('error', {'reason': reason, 'text': message})
+                    continue
+            elif not conn.poll(max(remaining, 0)):
+                raise WorkerLostError("killed run was not reported", None, None)
+
+            kind, data = conn.recv()
+            if kind == 'started':
+                state['child_pid'] = data['pid']
+                if timed_out:
+                    self._kill_run(worker, data['pid'])
+            elif kind == 'done':
+                finished = True
+                for fmt, seconds in data.get('figure_timings', ()):
+                    FIGURE_ENCODE_SECONDS.observe(seconds, fmt)
+            elif kind == 'exit':
+                state['exited'] = True
+                _observe_exit(data)
+                if self.compile_cache is not None:
+                    self.compile_cache.observe(data.get('compile'))
+                exceeded = self.limits.describe(data['status'], data['oom_killed']) if self.limits else None
+                if exceeded and not timed_out:
+                    state['outcome'] = exceeded[0]
+                    yield ('error', {'reason': exceeded[0], 'text': f"ERROR: {exceeded[1]}\n"})
+                elif not finished and not timed_out:
+                    state['outcome'] = 'crash'
+                    yield ('error', {'reason': 'crash',
+                                     'text': "ERROR: Execution exited unexpectedly ({})\n".format(describe_exit(data['status']))})
+                return
+            else:
+                yield (kind, data)
+
+    def _abandon(self, worker, state):
+        """Stop an unfinished run; return whether its worker is reusable."""
+        conn = worker.conn
+        deadline = time.monotonic() + KILL_GRACE_SECONDS
+        try:
+            if state['child_pid'] is not None:
+                self._kill_run(worker, state['child_pid'])
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not conn.poll(remaining):
+                    return False
+                kind, data = conn.recv()
+                if kind == 'started':
+                    self._kill_run(worker, data['pid'])
+                elif kind == 'exit':
+                    return True
+        except (EOFError, OSError):
+            return False
+
+    def _kill_run(self, worker, pid):
+        """Kill a run and every process it started."""
+        _kill(pid)
+        leaf = self.limits.leaf(worker.pid) if self.limits else None
+        if leaf is not None:
+            # Also catches processes that left the run's process group
+            try:
+                with open(os.path.join(leaf, 'cgroup.kill'), 'w') as f:
+                    f.write('1')
+            except OSError:
+                pass
+
+    def _release(self, worker, lost=None):
+        """Return a worker to the idle queue, or replace it if ``lost`` gives a reason to."""
+        if lost is not None:
+            self._retire(worker, kill=True, reason=lost)
+            return
+        worker.runs += 1
+        if worker.runs >= self.max_runs:
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        """Stop all workers."""
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+def _observe_exit(data):
+    """Record the resource use a worker reported for a forked run."""
+    if 'wall_seconds' in data:
+        RUN_WALL_SECONDS.observe(data['wall_seconds'])
+        RUN_CPU_SECONDS.observe(data['cpu_seconds'])
+        RUN_PEAK_RSS_BYTES.observe(data['max_rss_bytes'])
+
+
+def _kill(pid):
+    """SIGKILL the process group led by a run."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass